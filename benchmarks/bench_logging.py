@@ -0,0 +1,106 @@
+"""
+Measures what a logging call costs the caller (the event loop, in the app).
+
+Four setups log the same per-event INFO line:
+- stream: the previous setup, a StreamHandler writing to the output on the
+  calling thread, with an f-string message;
+- queue: the queue handler with JSON records and a lazy %-style message,
+  with the rate limit off;
+- queue, rate limited: the same, at the default limit of 10 per second per
+  call site, so most records are dropped before they are formatted;
+- disabled level: a DEBUG call while the level is INFO, f-string vs lazy.
+
+The output is /dev/null by default. `--write-delay-ms` makes every write
+to it sleep, like a stdout piped into a slow collector; the stream setup
+then pays that delay on every call, the queue setups do not.
+
+Usage:
+    python benchmarks/bench_logging.py [--calls 20000] [--write-delay-ms 0]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import structured_logging
+
+logger = logging.getLogger("bench")
+
+
+class SlowStream:
+    """A text stream whose writes sleep for a fixed time."""
+    def __init__(self, target, delay_seconds):
+        self._target = target
+        self._delay = delay_seconds
+
+    def write(self, text):
+        if self._delay:
+            time.sleep(self._delay)
+        return self._target.write(text)
+
+    def flush(self):
+        self._target.flush()
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+def time_calls(calls, log_once):
+    started = time.perf_counter()
+    for i in range(calls):
+        log_once(i)
+    return (time.perf_counter() - started) / calls
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--write-delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    devnull = open(os.devnull, "w")
+    stream = SlowStream(devnull, args.write_delay_ms / 1000)
+    user_id, group = "U4af4980629", "Site B"
+    results = {}
+
+    reset_root()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(structured_logging.TEXT_FORMAT))
+    logging.getLogger().addHandler(handler)
+    results["stream (f-string)"] = time_calls(
+        args.calls, lambda i: logger.info(f"Image {i} received from user {user_id} for group '{group}'.")
+    )
+
+    for name, rate in (("queue (lazy, JSON)", 0), ("queue, rate limited", 10)):
+        reset_root()
+        _, listener = structured_logging.configure(rate_per_second=rate, queue_size=args.calls + 1, stream=stream)
+        with structured_logging.bind(message_id="m1", user_id=user_id):
+            results[name] = time_calls(
+                args.calls, lambda i: logger.info("Image %s received from user %s for group '%s'.", i, user_id, group)
+            )
+        drain_started = time.perf_counter()
+        listener.stop()
+        results[name + ", listener drain"] = (time.perf_counter() - drain_started) / args.calls
+
+    reset_root()
+    results["disabled level (f-string)"] = time_calls(
+        args.calls, lambda i: logger.debug(f"Chunk {i} of message for user {user_id} in '{group}'.")
+    )
+    results["disabled level (lazy)"] = time_calls(
+        args.calls, lambda i: logger.debug("Chunk %s of message for user %s in '%s'.", i, user_id, group)
+    )
+
+    print(f"{args.calls} calls, write delay {args.write_delay_ms} ms (per call, on the calling thread unless noted):")
+    for name, seconds in results.items():
+        print(f"  {name:<40} {seconds * 1e6:9.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the shared memory executor against a plain ProcessPoolExecutor.
+
+Each job sends a multi-megabyte buffer to a worker. Two stage shapes are
+measured: one that returns a small value (like a perceptual hash) and one
+that returns a buffer of the same size (like a re-encoded image).
+
+Usage:
+    python benchmarks/bench_shared_memory_executor.py [--jobs 200] [--size-mb 4] [--workers 2]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.shared_memory_executor import SharedMemoryExecutor, SharedMemoryResult, run_cpu_stage
+
+
+def checksum_stage(content):
+    """A stage with a small result."""
+    return zlib.crc32(content)
+
+
+def rewrite_stage(content):
+    """A stage whose result is as large as its input."""
+    return bytes(content)
+
+
+async def run_jobs(executor, stage, payloads, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(payload):
+        async with semaphore:
+            result = await run_cpu_stage(executor, stage, payload)
+            if isinstance(result, SharedMemoryResult):
+                result.release()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(payload) for payload in payloads))
+    return time.perf_counter() - started
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--size-mb", type=float, default=4.0)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    payloads = [os.urandom(size) for _ in range(8)] * (args.jobs // 8)
+    concurrency = args.workers * 2
+    total_mb = len(payloads) * size / (1024 * 1024)
+
+    plain = ProcessPoolExecutor(max_workers=args.workers)
+    shared = SharedMemoryExecutor(slot_count=concurrency, slot_size=size, max_workers=args.workers)
+    try:
+        # Warm up both pools so worker start-up is not measured.
+        await run_jobs(plain, checksum_stage, payloads[:concurrency], concurrency)
+        await run_jobs(shared, checksum_stage, payloads[:concurrency], concurrency)
+
+        print(f"{len(payloads)} jobs x {args.size_mb} MB, {args.workers} workers")
+        for stage in (checksum_stage, rewrite_stage):
+            plain_seconds = await run_jobs(plain, stage, payloads, concurrency)
+            shared_seconds = await run_jobs(shared, stage, payloads, concurrency)
+            print(
+                f"{stage.__name__:>15}: pickled {plain_seconds:6.2f}s ({total_mb / plain_seconds:7.1f} MB/s)"
+                f" | shared memory {shared_seconds:6.2f}s ({total_mb / shared_seconds:7.1f} MB/s)"
+                f" | speed-up x{plain_seconds / shared_seconds:.2f}"
+            )
+    finally:
+        plain.shutdown()
+        shared.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
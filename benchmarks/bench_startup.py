@@ -0,0 +1,97 @@
+"""
+Measures the cold start of the web app: importing `main` and, optionally,
+running its startup (signing in to Drive, connecting to Redis, warming up
+the LINE client).
+
+Each run uses a fresh interpreter, so nothing is cached between runs. The
+slowest imports of the last run are listed as well.
+
+Without `--startup` no network access or credentials are needed; dummy LINE
+credentials are used and the local databases go to a temporary directory.
+With `--startup` the environment (or `.env`) must hold real credentials and
+a Drive token.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--startup] [--top 15]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PROBE = """
+import asyncio, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+result = {"import_seconds": imported - started}
+if STARTUP:
+    async def start():
+        async with main.app.router.lifespan_context(main.app):
+            result["startup_seconds"] = time.perf_counter() - imported
+    asyncio.run(start())
+print("RESULT " + json.dumps(result))
+"""
+
+
+def run_once(startup: bool, env: dict) -> tuple:
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.replace("STARTUP", str(startup))],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    result_line = next(line for line in completed.stdout.splitlines() if line.startswith("RESULT "))
+    return json.loads(result_line[len("RESULT "):]), completed.stderr
+
+
+def slowest_imports(importtime_log: str, top: int) -> list:
+    """Parses `-X importtime` output into (cumulative microseconds, module) pairs for the
+    modules `main` imports directly, slowest first."""
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        if depth == 1:
+            rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--startup", action="store_true", help="also run the app's startup (needs credentials)")
+    parser.add_argument("--top", type=int, default=15, help="how many of the slowest imports to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ)
+        if not args.startup:
+            env.setdefault("LINE_CHANNEL_SECRET", "benchmark-secret")
+            env.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "benchmark-token")
+            for name in ("UPLOAD_INDEX_PATH", "UPLOAD_LEDGER_PATH", "UPLOAD_SPOOL_PATH", "NOTE_JOURNAL_PATH"):
+                env[name] = os.path.join(data_dir, f"{name.lower()}.db")
+            env["CONFIG_FILE_PATH"] = os.path.join(data_dir, "config.json")
+
+        results, importtime_log = [], ""
+        for _ in range(args.runs):
+            result, importtime_log = run_once(args.startup, env)
+            results.append(result)
+
+    for key in ("import_seconds", "startup_seconds"):
+        values = [result[key] for result in results if key in result]
+        if values:
+            print(f"{key:>16}: median {statistics.median(values) * 1000:8.1f} ms   "
+                  f"min {min(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+    print("\nSlowest imports of main (cumulative, last run):")
+    for cumulative, module in slowest_imports(importtime_log, args.top):
+        print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
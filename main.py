@@ -1,36 +1,78 @@
+import asyncio
+import atexit
 import logging
 import sys
 import os
 import json
-from typing import Optional, Dict, Any, List
+import time
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, AsyncIterator
 
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, Response
-from linebot.v3.webhook import WebhookParser
+from fastapi import FastAPI, Request, HTTPException, Response
 from linebot.v3.messaging import AsyncApiClient, AsyncMessagingApi, Configuration
-from linebot.v3.exceptions import InvalidSignatureError
-import sentry_sdk
+from linebot.v3.webhooks import Event
 
-from src.webhook_processor import process_webhook_event
-from src.state_manager import StateManager
+from src.webhook_processor import process_webhook_events, connect_redis
+from src.webhook_payload import SignatureVerifier, parse_events
+from src.state_manager import StateManager, RedisStateManager
 from src.config_manager import ConfigManager
 from src.google_drive_uploader import GoogleDriveService
+from src.upload_index import UploadIndex
+from src.media_buffer import MediaMemoryBudget
+from src.image_set_batcher import ImageSetBatcher
+from src.confirmation_aggregator import ConfirmationAggregator
+from src.upload_ledger import UploadLedger
+from src.upload_spool import UploadSpool
+from src.spool_drainer import SpoolDrainer
+from src.inflight import InFlightTracker, drain_on_shutdown
+from src.loop_monitor import LoopMonitor
+from src.admin_api import router as admin_router
+from src import metrics, structured_logging, tracing
+
+# Optional subsystems are imported in the branch that builds them, so a disabled one costs no import time.
+if TYPE_CHECKING:
+    from src.shared_memory_executor import CpuExecutor
 
 # ==============================================================================
 # INITIAL SETUP (Logging, Environment Variables)
 # ==============================================================================
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+load_dotenv()
+# Records are written by a listener thread, so logging never blocks the event loop on stdout.
+log_handler, log_listener = structured_logging.configure(
+    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper(), logging.INFO),
+    json_format=os.getenv('LOG_FORMAT', 'json').lower() == 'json',
+    rate_per_second=float(os.getenv('LOG_RATE_LIMIT', '10')),
     stream=sys.stdout,
 )
-load_dotenv()
+atexit.register(log_listener.stop)
 
 # ==============================================================================
 # FASTAPI APP INSTANCE
 # ==============================================================================
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Builds and starts the services on startup and flushes them on shutdown.
+
+    The note export and the spool drain run in the web process only; upload
+    workers (worker.py) start just the services that handle events.
+    """
+    await start_services()
+    if app.note_exporter:
+        app.note_exporter.start()
+    app.spool_drainer.start()
+    yield
+    # Stop taking deliveries and let the running ones finish; media cut off at the deadline goes to the spool.
+    await drain_on_shutdown(
+        app.inflight, shutdown_drain_seconds, app.state_manager, app.upload_spool, upload_ledger=app.upload_ledger
+    )
+    await app.spool_drainer.stop()
+    if app.note_exporter:
+        await app.note_exporter.stop()
+    await stop_services()
+
+app = FastAPI(lifespan=lifespan)
 
 # ==============================================================================
 # CONFIGURATION & SERVICE INITIALIZATION
@@ -38,24 +80,125 @@ app = FastAPI()
 # --- Sentry Initialization ---
 sentry_dsn: Optional[str] = os.getenv('SENTRY_DSN', None)
 if sentry_dsn:
+    import sentry_sdk  # Imported only when used; it is one of the slower imports.
     sentry_sdk.init(
         dsn=sentry_dsn,
-        traces_sample_rate=1.0,
+        # Sentry's own transactions are off; the tracer below decides which traces are sent.
+        traces_sample_rate=0.0,
     )
 
+# --- Tracing of Deliveries (tail-based: errors and slow traces are always kept) ---
+trace_exporter_name: str = os.getenv('TRACE_EXPORTER', 'sentry' if sentry_dsn else 'memory').lower()
+if trace_exporter_name != 'none':
+    if trace_exporter_name == 'sentry':
+        trace_exporter: Any = tracing.SentryExporter()
+    elif trace_exporter_name == 'file':
+        trace_exporter = tracing.JsonLinesExporter(os.getenv('TRACE_FILE_PATH', 'data/traces.jsonl'))
+    else:
+        trace_exporter = tracing.InMemoryExporter()
+    tracing.configure(tracing.Tracer(
+        tracing.Sampler(
+            rate=float(os.getenv('TRACE_SAMPLE_RATE', '0.1')),
+            slow_seconds=float(os.getenv('TRACE_SLOW_SECONDS', '5')),
+        ),
+        trace_exporter,
+    ))
+
 # --- Load Application Configuration from File ---
 CONFIG_FILE: str = os.getenv('CONFIG_FILE_PATH', 'config.json')
 try:
     with open(CONFIG_FILE, 'r') as f:
         config_data: Dict[str, Any] = json.load(f)
 except (FileNotFoundError, json.JSONDecodeError) as e:
-    logging.error(f"Error loading config file: {e}")
+    logging.error("Error loading config file: %s", e)
     config_data = {}
 
+# --- Optional Split of Webhook Ingress and Upload Workers (via a Redis Stream) ---
+app.event_stream = None
+redis_url: Optional[str] = os.getenv('REDIS_URL')
+if os.getenv('EVENT_STREAM', 'false').lower() == 'true':
+    if not redis_url:
+        raise RuntimeError("EVENT_STREAM requires REDIS_URL.")
+    import redis.asyncio
+    from src.event_stream import WebhookEventStream
+    app.event_stream = WebhookEventStream(
+        redis.asyncio.from_url(redis_url),
+        stream_name=os.getenv('EVENT_STREAM_NAME', 'line:webhook-events'),
+    )
+
 # --- Create and Attach Singleton Services & Managers to App Instance ---
+# Workers share sessions through Redis, since a user's messages may reach different workers.
 app.state_manager = StateManager()
+if app.event_stream:
+    import redis
+    app.state_manager = RedisStateManager(redis.from_url(redis_url, decode_responses=True))
 app.config_manager = ConfigManager(config_data)
-app.gdrive_service = GoogleDriveService()
+app.upload_index = UploadIndex(os.getenv('UPLOAD_INDEX_PATH', 'data/upload_index.db'))
+app.upload_ledger = UploadLedger(os.getenv('UPLOAD_LEDGER_PATH', 'data/upload_ledger.db'))
+app.upload_spool = UploadSpool(os.getenv('UPLOAD_SPOOL_PATH', 'data/upload_spool.db'))
+
+# --- Storage for Uploads and Notes: Google Drive (default), a local directory or an S3 bucket ---
+# Built on startup by start_services(), since signing in to Drive may need the network.
+storage_backend_name: str = os.getenv('STORAGE_BACKEND', 'drive').lower()
+notes_backend_name: str = os.getenv('NOTES_BACKEND', 'text').lower()
+app.gdrive_service = None
+app.storage_backend = None
+app.storage_parent_folder_id = None
+app.notes_backend = None
+app.spool_drainer = None
+
+# --- Memory Budget for In-Flight Media (larger items spill to disk) ---
+app.media_budget = MediaMemoryBudget(
+    max_bytes=int(os.getenv('MEDIA_MEMORY_BUDGET_MB', '64')) * 1024 * 1024,
+    spill_threshold=int(os.getenv('MEDIA_SPILL_THRESHOLD_MB', '8')) * 1024 * 1024,
+)
+
+# --- Optional Batching of Photos Sent Together as an Image Set ---
+app.image_set_batcher = None
+if os.getenv('IMAGE_SET_BATCHING', 'false').lower() == 'true':
+    app.image_set_batcher = ImageSetBatcher(
+        fan_out=int(os.getenv('IMAGE_SET_FAN_OUT', '4')),
+        name_by_index=os.getenv('IMAGE_SET_NAME_BY_INDEX', 'false').lower() == 'true',
+    )
+
+# --- Optional CPU-Bound Image Stages (share one worker pool) ---
+near_duplicate_enabled: bool = os.getenv('NEAR_DUPLICATE_DETECTION', 'false').lower() == 'true'
+image_transform_enabled: bool = os.getenv('IMAGE_TRANSFORM', 'false').lower() == 'true'
+cpu_executor: Optional["CpuExecutor"] = None
+if near_duplicate_enabled or image_transform_enabled:
+    cpu_workers: int = int(os.getenv('CPU_WORKERS', '2'))
+    if os.getenv('SHARED_MEMORY_EXECUTOR', 'false').lower() == 'true':
+        from src.shared_memory_executor import SharedMemoryExecutor
+        cpu_executor = SharedMemoryExecutor(
+            slot_count=int(os.getenv('SHARED_MEMORY_SLOTS', '8')),
+            slot_size=int(os.getenv('SHARED_MEMORY_SLOT_MB', '16')) * 1024 * 1024,
+            max_workers=cpu_workers,
+        )
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        cpu_executor = ProcessPoolExecutor(max_workers=cpu_workers)
+
+app.near_duplicate_detector = None
+if near_duplicate_enabled:
+    from src.near_duplicate_detector import NearDuplicateDetector
+    app.near_duplicate_detector = NearDuplicateDetector(
+        similarity_threshold=float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.9')),
+        action=os.getenv('NEAR_DUPLICATE_ACTION', 'skip'),
+        window_size=int(os.getenv('NEAR_DUPLICATE_WINDOW', '200')),
+        executor=cpu_executor,
+    )
+
+app.image_transformer = None
+if image_transform_enabled:
+    from src.image_transformer import ImageTransformer
+    app.image_transformer = ImageTransformer(
+        max_dimension=int(os.getenv('IMAGE_MAX_DIMENSION', '2048')),
+        quality=int(os.getenv('IMAGE_QUALITY', '85')),
+        strip_metadata=os.getenv('IMAGE_STRIP_METADATA', 'false').lower() == 'true',
+        min_savings=float(os.getenv('IMAGE_MIN_SAVINGS', '0.1')),
+        max_pending=int(os.getenv('IMAGE_TRANSFORM_QUEUE_SIZE', '8')),
+        executor=cpu_executor,
+    )
 
 # ==============================================================================
 # LINE BOT API SETUP
@@ -63,6 +206,7 @@ app.gdrive_service = GoogleDriveService()
 channel_secret: Optional[str] = os.getenv('LINE_CHANNEL_SECRET', None)
 channel_access_token: Optional[str] = os.getenv('LINE_CHANNEL_ACCESS_TOKEN', None)
 parent_folder_id: Optional[str] = os.getenv('PARENT_FOLDER_ID', None)
+app.parent_folder_id = parent_folder_id
 
 if not channel_secret or not channel_access_token:
     raise RuntimeError("LINE_CHANNEL_SECRET or LINE_CHANNEL_ACCESS_TOKEN not found.")
@@ -70,7 +214,141 @@ if not channel_secret or not channel_access_token:
 configuration = Configuration(access_token=channel_access_token)
 async_api_client = AsyncApiClient(configuration)
 line_bot_api = AsyncMessagingApi(async_api_client)
-parser = WebhookParser(channel_secret)
+signature_verifier = SignatureVerifier(channel_secret)
+
+# --- Optional Upload Confirmations (one coalesced message per user and window) ---
+app.confirmation_aggregator = None
+if os.getenv('UPLOAD_CONFIRMATIONS', 'false').lower() == 'true':
+    app.confirmation_aggregator = ConfirmationAggregator(
+        line_bot_api,
+        window_seconds=float(os.getenv('CONFIRMATION_WINDOW_SECONDS', '3')),
+    )
+
+# --- Optional Local Note Journal (exported to Drive in the background) ---
+app.note_journal = None
+app.note_exporter = None  # Built on startup, with the storage it exports to.
+if os.getenv('NOTE_JOURNAL', 'false').lower() == 'true':
+    from src.note_journal import NoteJournal
+    app.note_journal = NoteJournal(os.getenv('NOTE_JOURNAL_PATH', 'data/notes.db'))
+
+# --- Metrics (GET /metrics); group names as labels are opt-in, since each group adds series ---
+metrics.configure(group_labels=os.getenv('METRICS_GROUP_LABELS', 'false').lower() == 'true')
+
+# --- Log Queue (its drops are reported with the runtime stats) ---
+app.log_handler = log_handler
+
+# --- Event Loop Lag Monitor (logs the stack of calls that block the loop) ---
+app.loop_monitor = None
+if os.getenv('LOOP_MONITOR', 'true').lower() == 'true':
+    app.loop_monitor = LoopMonitor(
+        interval=float(os.getenv('LOOP_MONITOR_INTERVAL_SECONDS', '0.25')),
+        block_threshold=float(os.getenv('LOOP_BLOCK_THRESHOLD_SECONDS', '0.5')),
+    )
+
+# --- On-Demand Sampling Profiler and Memory Snapshots (admin endpoints, so only with ADMIN_API_TOKEN) ---
+app.profiler = None
+app.memory_snapshots = None
+if os.getenv('ADMIN_API_TOKEN'):
+    from src.profiler import SamplingProfiler
+    from src.memory_snapshots import MemorySnapshots
+    app.profiler = SamplingProfiler()  # GET /debug/profile
+    app.memory_snapshots = MemorySnapshots()  # GET /debug/memory; tracemalloc stays off until started there.
+
+# --- Tracer (GET /traces lists the kept traces when they are held in memory) ---
+app.tracer = tracing.get_tracer()
+
+# --- Webhook Deliveries Being Handled (drained on shutdown) ---
+app.inflight = InFlightTracker()
+shutdown_drain_seconds: float = float(os.getenv('SHUTDOWN_DRAIN_SECONDS', '20'))
+
+# ==============================================================================
+# STARTUP (run by the lifespan, so importing the app stays fast)
+# ==============================================================================
+def build_storage_services(gdrive_service: GoogleDriveService) -> None:
+    """Builds the storage backend and the services that write to it."""
+    app.gdrive_service = gdrive_service
+    if storage_backend_name == 'local':
+        from src.storage_backends import LocalStorageBackend
+        app.storage_backend = LocalStorageBackend(
+            os.getenv('LOCAL_STORAGE_ROOT', 'data/storage'), upload_index=app.upload_index
+        )
+    elif storage_backend_name == 's3':
+        from src.storage_backends import S3StorageBackend
+        app.storage_backend = S3StorageBackend(
+            os.getenv('S3_BUCKET', ''),
+            prefix=os.getenv('S3_PREFIX', ''),
+            endpoint_url=os.getenv('S3_ENDPOINT_URL') or None,
+            upload_index=app.upload_index,
+        )
+    else:
+        app.storage_backend = app.gdrive_service
+    if app.storage_backend is not app.gdrive_service:
+        logging.info(
+            "STORAGE_BACKEND=%s: GET /export/{group}/{date}.zip and python -m src.drive_reconciler "
+            "read from Google Drive and are disabled.", storage_backend_name,
+        )
+
+    # --- Notes Backend: plain text files (default) or Google Docs appended in place ---
+    app.notes_backend = None
+    if notes_backend_name == 'google_docs':
+        if app.storage_backend is app.gdrive_service:
+            from src.google_docs_notes import GoogleDocsNotesBackend
+            app.notes_backend = GoogleDocsNotesBackend(app.gdrive_service, credentials=app.gdrive_service.credentials)
+        else:
+            logging.warning("NOTES_BACKEND=google_docs requires STORAGE_BACKEND=drive; notes are written as text files.")
+
+    # PARENT_FOLDER_ID is a Drive folder; other backends keep the group folders at their root.
+    app.storage_parent_folder_id = parent_folder_id if app.storage_backend is app.gdrive_service else None
+
+    if app.note_journal:
+        from src.note_journal import NoteExporter
+        app.note_exporter = NoteExporter(
+            app.note_journal,
+            app.storage_backend,
+            app.storage_parent_folder_id,
+            interval_seconds=float(os.getenv('NOTE_EXPORT_INTERVAL_SECONDS', '60')),
+        )
+
+    # --- Background Retry of Uploads Queued by Reconciliation or Cut Off by a Shutdown ---
+    app.spool_drainer = SpoolDrainer(
+        app.upload_spool,
+        app.storage_backend,
+        channel_access_token,
+        app.storage_parent_folder_id,
+        upload_ledger=app.upload_ledger,
+        interval_seconds=float(os.getenv('SPOOL_DRAIN_INTERVAL_SECONDS', '300')),
+    )
+
+async def warm_up_line() -> None:
+    """Opens the connection to the LINE API, so the first reply does not pay for the TLS handshake."""
+    try:
+        await line_bot_api.get_bot_info()
+    except Exception as e:
+        logging.warning("⚠️ Could not reach the LINE API on startup: %s", e)
+
+async def start_services() -> None:
+    """Signs in to Drive, connects to Redis and warms up the LINE client concurrently."""
+    if app.loop_monitor:
+        app.loop_monitor.start()
+    started: float = time.perf_counter()
+    gdrive_service, _, _ = await asyncio.gather(
+        asyncio.to_thread(GoogleDriveService, upload_index=app.upload_index),
+        asyncio.to_thread(connect_redis),
+        warm_up_line(),
+    )
+    build_storage_services(gdrive_service)
+    logging.info("Services started in %.2fs.", time.perf_counter() - started)
+
+async def stop_services() -> None:
+    """Flushes and stops the services started by start_services()."""
+    if app.confirmation_aggregator:
+        # Send the summaries still waiting for their window instead of dropping them.
+        await app.confirmation_aggregator.flush_all()
+    if cpu_executor:
+        # Stops the worker processes and unlinks the shared memory block, if any.
+        cpu_executor.shutdown()
+    if app.loop_monitor:
+        app.loop_monitor.stop()
 
 # ==============================================================================
 # API ENDPOINTS
@@ -88,27 +366,60 @@ def health_check() -> Dict[str, str]:
     """A simple endpoint to confirm the service is up and handle HEAD requests."""
     return {"status": "ok"}
 
+app.include_router(admin_router)
+
+def webhook_services() -> Dict[str, Any]:
+    """The services process_webhook_events hands to the event handlers."""
+    return dict(
+        state_manager=app.state_manager,
+        config_manager=app.config_manager,
+        gdrive_service=app.storage_backend,
+        line_bot_api=line_bot_api,
+        channel_access_token=channel_access_token,
+        parent_folder_id=app.storage_parent_folder_id,
+        near_duplicate_detector=app.near_duplicate_detector,
+        image_transformer=app.image_transformer,
+        media_budget=app.media_budget,
+        image_set_batcher=app.image_set_batcher,
+        confirmation_aggregator=app.confirmation_aggregator,
+        note_journal=app.note_journal,
+        notes_backend=app.notes_backend,
+        upload_ledger=app.upload_ledger,
+    )
+
+async def handle_delivery(body: bytes, events: List[Event], span: Optional[tracing.Span] = None) -> None:
+    """Builds the events of a verified delivery and handles them.
+
+    The events are added to the given list as soon as they are built, so a
+    shutdown that cuts the delivery off can spool its media. The delivery is
+    traced under the given span, started by the webhook request.
+    """
+    with tracing.activate(span):
+        with metrics.stage("parse"):
+            events.extend(await asyncio.to_thread(parse_events, body))
+        await process_webhook_events(events, **webhook_services())
+
 @app.post("/webhook")
-async def handle_webhook(request: Request, background_tasks: BackgroundTasks) -> str:
-    try:
-        signature: str = request.headers['X-Line-Signature']
-        body: str = (await request.body()).decode('utf-8')
-        events = parser.parse(body, signature)
-    except InvalidSignatureError:
-        raise HTTPException(status_code=400, detail="Invalid signature")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-    for event in events:
-        background_tasks.add_task(
-            process_webhook_event,
-            event=event,
-            state_manager=app.state_manager,
-            config_manager=app.config_manager,
-            gdrive_service=app.gdrive_service,
-            line_bot_api=line_bot_api,
-            channel_access_token=channel_access_token,
-            parent_folder_id=parent_folder_id
-        )
+async def handle_webhook(request: Request) -> str:
+    """Verifies a delivery's signature, hands the raw body on and returns at once."""
+    if app.inflight.closing:
+        # With webhook redelivery enabled, LINE sends the events again once a new instance is up.
+        raise HTTPException(status_code=503, detail="Shutting down")
+    signature: Optional[str] = request.headers.get('X-Line-Signature')
+    body: bytes = await request.body()
+    with tracing.span("webhook", body_bytes=len(body)):
+        if not signature or not await signature_verifier.verify_async(body, signature):
+            raise HTTPException(status_code=400, detail="Invalid signature")
+
+        if app.event_stream:
+            # The upload workers (worker.py) build and handle the events, continuing this trace.
+            try:
+                await app.event_stream.publish(body, traceparent=tracing.traceparent())
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Could not queue events: {e}")
+            return "OK"
+
+        events: List[Event] = []
+        app.inflight.spawn(handle_delivery(body, events, tracing.start_span("process_delivery")), events)
 
-    return "OK"
\ No newline at end of file
+    return "OK"
@@ -0,0 +1,210 @@
+"""
+Administrative HTTP endpoints.
+
+The routes read the application's services from the FastAPI app instance
+(e.g. `app.upload_ledger`), so they can be mounted on any app that carries
+those attributes. Every route requires the admin bearer token.
+"""
+import asyncio
+import json
+import os
+import re
+from typing import Optional, Dict, Any, List
+from urllib.parse import quote
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from src import metrics, tracing
+from src.api_auth import require_admin_token
+from src.zip_export import list_folder_files, stream_zip
+
+router = APIRouter(dependencies=[Depends(require_admin_token)])
+
+_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# App attributes whose `stats()` are reported by GET /stats/runtime and, as gauges, by GET /metrics.
+RUNTIME_COMPONENTS = (
+    "loop_monitor",
+    "inflight",
+    "state_manager",
+    "media_budget",
+    "image_set_batcher",
+    "near_duplicate_detector",
+    "image_transformer",
+    "confirmation_aggregator",
+    "note_exporter",
+    "upload_spool",
+    "notes_backend",
+    "tracer",
+    "log_handler",
+    "profiler",
+    "memory_snapshots",
+)
+
+
+def _runtime_stats(request: Request) -> Dict[str, Any]:
+    return {
+        name: component.stats()
+        for name in RUNTIME_COMPONENTS
+        if (component := getattr(request.app, name, None)) is not None
+    }
+
+
+@router.get("/stats")
+def get_stats(request: Request, group: Optional[str] = None, date: Optional[str] = None) -> Dict[str, Any]:
+    """Returns per-group upload counts and volumes for one day from the ledger rollups."""
+    upload_ledger = getattr(request.app, "upload_ledger", None)
+    if upload_ledger is None:
+        raise HTTPException(status_code=404, detail="Upload statistics are not enabled.")
+    if date and not _DATE_PATTERN.fullmatch(date):
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD.")
+    return upload_ledger.stats(entry_date=date, group_name=group)
+
+
+@router.get("/stats/runtime")
+def get_runtime_stats(request: Request) -> Dict[str, Any]:
+    """Reports the live counters of each configured service, e.g. media budget use and spills."""
+    return _runtime_stats(request)
+
+
+@router.get("/metrics")
+def get_metrics(request: Request) -> Response:
+    """Serves the stage latency histograms, event counters and runtime stats in the Prometheus text format."""
+    components: Dict[str, Any] = {
+        name: component for name in RUNTIME_COMPONENTS
+        if (component := getattr(request.app, name, None)) is not None
+    }
+    return Response(metrics.render(components), media_type=CONTENT_TYPE_LATEST)
+
+
+@router.get("/traces")
+def get_traces(request: Request) -> List[Dict[str, Any]]:
+    """Lists the most recent kept traces, newest first, when they are held in memory."""
+    tracer = getattr(request.app, "tracer", None)
+    if tracer is None or not isinstance(tracer.exporter, tracing.InMemoryExporter):
+        raise HTTPException(status_code=404, detail="Traces are not kept in memory (see TRACE_EXPORTER).")
+    return tracer.exporter.traces()
+
+
+@router.get("/debug/profile")
+async def profile_process(
+    request: Request, seconds: float = 30, hz: int = 100, format: str = "collapsed", idle: bool = False,
+) -> Response:
+    """Samples every thread of the process for a while and returns collapsed stacks or speedscope JSON."""
+    profiler = getattr(request.app, "profiler", None)
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is not enabled.")
+    from src.profiler import MAX_SECONDS as MAX_PROFILE_SECONDS, MAX_HZ as MAX_PROFILE_HZ
+    if not 0 < seconds <= MAX_PROFILE_SECONDS or not 1 <= hz <= MAX_PROFILE_HZ:
+        raise HTTPException(
+            status_code=400, detail=f"seconds must be in (0, {MAX_PROFILE_SECONDS:g}] and hz in [1, {MAX_PROFILE_HZ}].",
+        )
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or speedscope.")
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="A profile is already running.")
+    try:
+        # The sampler sleeps between samples in its own thread; the loop keeps serving meanwhile.
+        profile = await asyncio.to_thread(profiler.run, seconds, hz, idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "speedscope":
+        return Response(
+            json.dumps(profile.speedscope()), media_type="application/json",
+            headers={"Content-Disposition": 'attachment; filename="profile.speedscope.json"'},
+        )
+    return Response(
+        profile.collapsed(), media_type="text/plain",
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed.txt"'},
+    )
+
+
+def _memory_snapshots(request: Request) -> Any:
+    memory_snapshots = getattr(request.app, "memory_snapshots", None)
+    if memory_snapshots is None:
+        raise HTTPException(status_code=404, detail="Memory snapshots are not enabled.")
+    return memory_snapshots
+
+
+@router.get("/debug/memory")
+def get_memory_status(request: Request) -> Dict[str, Any]:
+    """Reports whether allocations are traced, the snapshots kept and each service's live counts."""
+    return {**_memory_snapshots(request).status(), "subsystems": _runtime_stats(request)}
+
+
+@router.post("/debug/memory/start")
+def start_memory_tracing(request: Request, frames: int = 1) -> Dict[str, Any]:
+    """Starts tracing allocations (which slows allocation-heavy code) with `frames` frames per traceback."""
+    if not 1 <= frames <= 50:
+        raise HTTPException(status_code=400, detail="frames must be in [1, 50].")
+    memory_snapshots = _memory_snapshots(request)
+    memory_snapshots.start(frames)
+    return memory_snapshots.status()
+
+
+@router.post("/debug/memory/stop")
+def stop_memory_tracing(request: Request) -> Dict[str, Any]:
+    """Stops tracing allocations and drops the snapshots."""
+    memory_snapshots = _memory_snapshots(request)
+    memory_snapshots.stop()
+    return memory_snapshots.status()
+
+
+@router.post("/debug/memory/snapshots/{name}")
+async def take_memory_snapshot(request: Request, name: str) -> Dict[str, Any]:
+    """Takes a named snapshot of the traced allocations, with each service's live counts at that time."""
+    memory_snapshots = _memory_snapshots(request)
+    try:
+        summary: Dict[str, Any] = await asyncio.to_thread(memory_snapshots.take, name)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {**summary, "subsystems": _runtime_stats(request)}
+
+
+@router.get("/debug/memory/diff")
+async def diff_memory_snapshots(
+    request: Request, base: str, against: Optional[str] = None, group_by: str = "lineno", limit: int = 20,
+) -> Dict[str, Any]:
+    """Lists the locations whose allocations grew most from snapshot `base` to `against` (or now)."""
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback.")
+    memory_snapshots = _memory_snapshots(request)
+    try:
+        top: List[Dict[str, Any]] = await asyncio.to_thread(
+            memory_snapshots.diff, base, against, group_by, max(1, min(limit, 200))
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"No snapshot named {e}.")
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"base": base, "against": against or "now", "top": top, "subsystems": _runtime_stats(request)}
+
+
+@router.get("/export/{group}/{date}.zip")
+async def export_day_zip(request: Request, group: str, date: str) -> StreamingResponse:
+    """Streams a group's daily folder as a ZIP archive, downloading files from Drive as it goes.
+
+    Only available when the uploads are stored in Drive.
+    """
+    if not _DATE_PATTERN.fullmatch(date):
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD.")
+    gdrive_service = request.app.gdrive_service
+    if getattr(request.app, "storage_backend", gdrive_service) is not gdrive_service:
+        raise HTTPException(status_code=404, detail="ZIP export reads from Google Drive (see STORAGE_BACKEND).")
+    parent_folder_id: Optional[str] = getattr(request.app, "parent_folder_id", None)
+    group_folder_id: Optional[str] = await asyncio.to_thread(gdrive_service.find_folder, group, parent_folder_id)
+    daily_folder_id: Optional[str] = group_folder_id and await asyncio.to_thread(
+        gdrive_service.find_folder, date, group_folder_id
+    )
+    if not daily_folder_id:
+        raise HTTPException(status_code=404, detail=f"No folder for '{group}' on {date}.")
+    files: List[Dict[str, Any]] = await list_folder_files(gdrive_service, daily_folder_id)
+
+    archive_name: str = f"{group}_{date}.zip"
+    return StreamingResponse(
+        stream_zip(gdrive_service, files, max_concurrent=int(os.getenv('EXPORT_CONCURRENCY', '4'))),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(archive_name)}"},
+    )
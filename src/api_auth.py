@@ -0,0 +1,27 @@
+"""
+Bearer-token authentication for the service's administrative HTTP endpoints.
+
+Endpoints that expose statistics or data are only served when the
+`ADMIN_API_TOKEN` environment variable is set, and only to requests that
+present it as `Authorization: Bearer <token>`.
+"""
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+
+def require_admin_token(authorization: Optional[str] = Header(default=None)) -> None:
+    """A FastAPI dependency that rejects requests without the admin token.
+
+    Raises:
+        HTTPException: 403 if no admin token is configured, 401 if the
+            request's bearer token is missing or wrong.
+    """
+    expected: Optional[str] = os.getenv('ADMIN_API_TOKEN')
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin API is disabled.")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token.", headers={"WWW-Authenticate": "Bearer"})
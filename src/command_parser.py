@@ -1,12 +1,14 @@
 import re
 from typing import Optional, Dict
 
-def parse_command(text: str) -> Optional[Dict[str, str]]:
+def parse_command(text: str, search_enabled: bool = True) -> Optional[Dict[str, str]]:
     """
     Parses a text message to see if it matches a known command format.
     
     Args:
         text: The input text message from the user.
+        search_enabled: Whether `? <terms>` is a search command. When note
+            search is unavailable, such text is an ordinary note.
         
     Returns:
         A dictionary with 'action' and its parameters if it's a valid command,
@@ -18,6 +20,16 @@ def parse_command(text: str) -> Optional[Dict[str, str]]:
     if text == "!":
         return {"action": "list"}
 
+    # "!stats [group]" reports today's upload statistics
+    match = re.fullmatch(r"!stats(?:\s+(\S.*))?", text, re.IGNORECASE)
+    if match:
+        return {"action": "stats", "group": (match.group(1) or "").strip()}
+
+    # "? <terms>" searches the notes of the user's active group
+    if search_enabled and text.startswith("?"):
+        query: str = text[1:].strip()
+        return {"action": "search", "query": query} if query else None
+
     # Pattern for "add code <code> for group <group>"
     add_pattern = re.compile(
         r"add\s+code\s+([#\w-]+)\s+for\s+group\s+([\w_]+)", re.IGNORECASE
@@ -1,6 +1,9 @@
 import json
+import logging
 from typing import Optional, Dict, List, Any
 
+logger = logging.getLogger(__name__)
+
 class ConfigManager:
     """Handles loading, accessing, and modifying application configuration.
 
@@ -45,7 +48,7 @@ class ConfigManager:
     def add_secret_code(self, code: str, group: str):
         """Adds or updates a secret code in the configuration."""
         self._secret_code_map[code] = group
-        print(f"Updated config: Added/updated code '{code}' for group '{group}'")
+        logger.info("Updated config: Added/updated code '%s' for group '%s'", code, group)
 
     def remove_secret_code(self, code: str) -> bool:
         """
@@ -54,7 +57,7 @@ class ConfigManager:
         """
         if code in self._secret_code_map:
             del self._secret_code_map[code]
-            print(f"Updated config: Removed code '{code}'")
+            logger.info("Updated config: Removed code '%s'", code)
             return True
         return False
 
@@ -72,4 +75,4 @@ class ConfigManager:
         
         with open(file_path, 'w') as f:
             json.dump(self._config_data, f, indent=2)
-        print(f"Configuration saved to {file_path}")
\ No newline at end of file
+        logger.info("Configuration saved to %s", file_path)
\ No newline at end of file
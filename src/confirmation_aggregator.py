@@ -0,0 +1,166 @@
+"""
+Coalesces upload confirmations into one LINE message per user.
+
+Sending one confirmation per photo would turn a 20-photo burst into 20
+Messaging API calls, and would eat into LINE's rate limits and monthly
+message quota. The ConfirmationAggregator collects each user's outcomes
+over a short window, then sends a single summary such as
+"12 photos saved to Site A". It replies with the newest reply token while
+that token is still valid, since replies are free, and falls back to a push
+message otherwise.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List, Tuple
+
+from linebot.v3.messaging import (
+    AsyncMessagingApi,
+    PushMessageRequest,
+    ReplyMessageRequest,
+    TextMessage,
+)
+
+logger = logging.getLogger(__name__)
+
+# Singular and plural labels of the items a user can send.
+_LABELS: Dict[str, Tuple[str, str]] = {
+    "photo": ("photo", "photos"),
+    "video": ("video", "videos"),
+    "file": ("file", "files"),
+    "note": ("note", "notes"),
+}
+
+
+def _count_label(count: int, kind: str) -> str:
+    singular, plural = _LABELS.get(kind, (kind, f"{kind}s"))
+    return f"{count} {singular if count == 1 else plural}"
+
+
+@dataclass
+class _PendingConfirmation:
+    """The outcomes collected for one user during the current window."""
+    saved: Dict[Tuple[str, str], int] = field(default_factory=dict)
+    failed: Dict[Tuple[str, str], int] = field(default_factory=dict)
+    reply_token: Optional[str] = None
+    reply_token_at: float = 0.0
+    timer: Optional[asyncio.Task] = None
+
+
+class ConfirmationAggregator:
+    """Collects per-user upload outcomes and sends one summary per window.
+
+    Attributes:
+        window_seconds: How long outcomes are collected, counted from the
+            first outcome, before the summary is sent.
+        reply_token_ttl_seconds: How long a reply token is trusted. LINE
+            reply tokens expire about a minute after the event.
+    """
+    def __init__(
+        self,
+        line_bot_api: AsyncMessagingApi,
+        window_seconds: float = 3.0,
+        reply_token_ttl_seconds: float = 50.0,
+        max_concurrent_sends: int = 4,
+    ) -> None:
+        self._line_bot_api: AsyncMessagingApi = line_bot_api
+        self.window_seconds: float = window_seconds
+        self.reply_token_ttl_seconds: float = reply_token_ttl_seconds
+        self._sending = asyncio.Semaphore(max_concurrent_sends)
+        self._pending: Dict[str, _PendingConfirmation] = {}
+        self._replies: int = 0
+        self._pushes: int = 0
+        self._outcomes: int = 0
+
+    def record(
+        self,
+        user_id: str,
+        group: str,
+        kind: str,
+        reply_token: Optional[str] = None,
+        success: bool = True,
+    ) -> None:
+        """Adds one outcome to the user's pending summary.
+
+        The first outcome of a window schedules the summary to be sent once
+        the window has passed. Must be called from the event loop.
+
+        Args:
+            user_id: The LINE user who sent the item.
+            group: The group (site) the item was saved to.
+            kind: What was saved, e.g. "photo", "video", "file" or "note".
+            reply_token: The reply token of the item's event, if unused.
+            success: Whether the item was saved.
+        """
+        pending: _PendingConfirmation = self._pending.setdefault(user_id, _PendingConfirmation())
+        counts: Dict[Tuple[str, str], int] = pending.saved if success else pending.failed
+        counts[(group, kind)] = counts.get((group, kind), 0) + 1
+        self._outcomes += 1
+        if reply_token:
+            pending.reply_token = reply_token
+            pending.reply_token_at = time.monotonic()
+        if pending.timer is None:
+            pending.timer = asyncio.create_task(self._flush_after_window(user_id))
+
+    async def _flush_after_window(self, user_id: str) -> None:
+        await asyncio.sleep(self.window_seconds)
+        await self.flush(user_id)
+
+    @staticmethod
+    def format_summary(
+        saved: Dict[Tuple[str, str], int], failed: Dict[Tuple[str, str], int]
+    ) -> str:
+        """Formats collected outcomes, e.g. "12 photos saved to Site A"."""
+        lines: List[str] = []
+        for (group, kind), count in saved.items():
+            lines.append(f"✅ {_count_label(count, kind)} saved to {group}")
+        for (group, kind), count in failed.items():
+            lines.append(f"⚠️ {_count_label(count, kind)} could not be saved to {group}")
+        return "\n".join(lines)
+
+    async def flush(self, user_id: str) -> None:
+        """Sends the user's pending summary now, if there is one."""
+        pending: Optional[_PendingConfirmation] = self._pending.pop(user_id, None)
+        if pending is None:
+            return
+        if pending.timer is not None and pending.timer is not asyncio.current_task():
+            pending.timer.cancel()
+
+        text: str = self.format_summary(pending.saved, pending.failed)
+        reply_token: Optional[str] = pending.reply_token
+        if reply_token and time.monotonic() - pending.reply_token_at > self.reply_token_ttl_seconds:
+            reply_token = None
+
+        async with self._sending:
+            if reply_token:
+                try:
+                    await self._line_bot_api.reply_message(
+                        ReplyMessageRequest(reply_token=reply_token, messages=[TextMessage(text=text)])
+                    )
+                    self._replies += 1
+                    return
+                except Exception as e:
+                    logger.warning(
+                        "⚠️ Reply with confirmation failed, falling back to push: %s", e, extra={"user_id": user_id}
+                    )
+            try:
+                await self._line_bot_api.push_message(
+                    PushMessageRequest(to=user_id, messages=[TextMessage(text=text)])
+                )
+                self._pushes += 1
+            except Exception as e:
+                logger.error("❌ Failed to send confirmation: %s", e, extra={"user_id": user_id})
+
+    async def flush_all(self) -> None:
+        """Sends every pending summary immediately, e.g. before shutting down."""
+        await asyncio.gather(*(self.flush(user_id) for user_id in list(self._pending)))
+
+    def stats(self) -> Dict[str, int]:
+        """Reports how many outcomes were coalesced into how many messages."""
+        return {
+            "outcomes": self._outcomes,
+            "replies": self._replies,
+            "pushes": self._pushes,
+            "pending_users": len(self._pending),
+        }
@@ -0,0 +1,260 @@
+"""
+Reconciles the local upload ledger with what Google Drive actually holds.
+
+After an outage it is unclear which uploads reached Drive. The
+DriveReconciler walks the `<group>/<date>` folders under the parent folder,
+listing each folder with large pages and a field mask that returns only
+what the diff needs. Groups are scanned concurrently, and every Drive call
+goes through a shared rate limiter. Ledger entries whose file is not found
+are queued in the upload spool to be uploaded again. Spooled items that are
+already in Drive are removed from the spool. Spooled items that the drainer
+gave up on (typically because their LINE content expired) are listed in the
+report, since only a person can still recover them.
+
+Run it as a command:
+
+    python -m src.drive_reconciler --days 30
+
+The command first checks the upload index against the `md5Checksum`s that
+Drive reports (`UploadIndex.reconcile`). Entries whose file is gone or
+changed are dropped, so those uploads are no longer skipped as duplicates.
+
+It only reconciles Drive: with another STORAGE_BACKEND it exits without
+doing anything.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict, field
+from datetime import date, timedelta
+from typing import Optional, Dict, List, Set, Tuple, Any
+
+from src.rate_limiter import AsyncRateLimiter
+from src.upload_ledger import UploadLedger, LedgerEntry
+from src.upload_spool import UploadSpool, SpooledUpload
+
+logger = logging.getLogger(__name__)
+
+FOLDER_FIELDS: str = "id, name"
+FILE_FIELDS: str = "id, appProperties"
+
+
+@dataclass
+class ReconciliationReport:
+    """The outcome of one reconciliation run."""
+    start_date: str
+    end_date: str
+    groups_scanned: int = 0
+    folders_listed: int = 0
+    files_seen: int = 0
+    ledger_entries: int = 0
+    missing: int = 0
+    requeued: int = 0
+    already_spooled: int = 0
+    spool_recovered: int = 0
+    spool_exhausted: int = 0
+    exhausted_message_ids: List[str] = field(default_factory=list)
+    api_calls: int = 0
+    elapsed_seconds: float = 0.0
+
+
+class DriveReconciler:
+    """Diffs ledger and spool against the Drive folder tree.
+
+    Attributes:
+        max_concurrent_groups: How many group folders are scanned at once.
+        page_size: The page size of every listing (Drive allows up to 1000).
+    """
+    def __init__(
+        self,
+        gdrive_service: Any,
+        upload_ledger: UploadLedger,
+        upload_spool: UploadSpool,
+        parent_folder_id: Optional[str],
+        rate_limiter: Optional[AsyncRateLimiter] = None,
+        max_concurrent_groups: int = 8,
+        page_size: int = 1000,
+    ) -> None:
+        self._gdrive_service = gdrive_service
+        self._ledger: UploadLedger = upload_ledger
+        self._spool: UploadSpool = upload_spool
+        self._parent_folder_id: str = parent_folder_id or "root"
+        self._rate_limiter: AsyncRateLimiter = rate_limiter or AsyncRateLimiter(rate=20, burst=20)
+        self.max_concurrent_groups: int = max_concurrent_groups
+        self.page_size: int = page_size
+        self._api_calls: int = 0
+
+    async def _list_all(self, folder_id: str, fields: str, folders_only: bool = False) -> List[Dict[str, Any]]:
+        """Lists every child of a folder, one rate-limited page at a time."""
+        items: List[Dict[str, Any]] = []
+        page_token: Optional[str] = None
+        while True:
+            await self._rate_limiter.acquire()
+            self._api_calls += 1
+            page, page_token = await asyncio.to_thread(
+                self._gdrive_service.list_children_page,
+                folder_id, fields, folders_only, page_token, self.page_size,
+            )
+            items.extend(page)
+            if not page_token:
+                return items
+
+    async def _scan_group(
+        self, group_folder_id: str, dates: Set[str], report: ReconciliationReport
+    ) -> Dict[str, Set[str]]:
+        """Collects the file IDs and LINE message IDs present per date folder of a group."""
+        present: Dict[str, Set[str]] = {}
+        date_folders: List[Dict[str, Any]] = await self._list_all(group_folder_id, FOLDER_FIELDS, folders_only=True)
+        report.folders_listed += 1
+        for folder in date_folders:
+            if folder.get("name") not in dates:
+                continue
+            files: List[Dict[str, Any]] = await self._list_all(folder["id"], FILE_FIELDS)
+            report.folders_listed += 1
+            report.files_seen += len(files)
+            ids: Set[str] = present.setdefault(folder["name"], set())
+            for item in files:
+                ids.add(item["id"])
+                message_id: Optional[str] = (item.get("appProperties") or {}).get("line_message_id")
+                if message_id:
+                    ids.add(message_id)
+        return present
+
+    async def reconcile(self, start_date: str, end_date: str) -> ReconciliationReport:
+        """Compares the ledger and the spool for a date range against Drive.
+
+        Args:
+            start_date: The first day to check, as YYYY-MM-DD.
+            end_date: The last day to check (inclusive), as YYYY-MM-DD.
+
+        Returns:
+            A report of what was listed, found missing and re-queued.
+        """
+        started: float = time.monotonic()
+        self._api_calls = 0
+        report = ReconciliationReport(start_date=start_date, end_date=end_date)
+
+        entries: List[LedgerEntry] = self._ledger.entries_between(start_date, end_date)
+        spooled: List[SpooledUpload] = [
+            item for item in self._spool.items() if start_date <= item.entry_date <= end_date
+        ]
+        report.ledger_entries = len(entries)
+
+        wanted: Dict[str, Set[str]] = {}
+        for group_name, entry_date in [(e.group_name, e.entry_date) for e in entries] + [
+            (s.group_name, s.entry_date) for s in spooled
+        ]:
+            wanted.setdefault(group_name, set()).add(entry_date)
+
+        group_folders: List[Dict[str, Any]] = await self._list_all(
+            self._parent_folder_id, FOLDER_FIELDS, folders_only=True
+        )
+        report.folders_listed += 1
+        folder_ids: Dict[str, str] = {
+            folder["name"]: folder["id"] for folder in group_folders if folder.get("name") in wanted
+        }
+
+        semaphore = asyncio.Semaphore(self.max_concurrent_groups)
+
+        async def scan(group_name: str) -> Tuple[str, Dict[str, Set[str]]]:
+            async with semaphore:
+                return group_name, await self._scan_group(folder_ids[group_name], wanted[group_name], report)
+
+        present: Dict[str, Dict[str, Set[str]]] = dict(await asyncio.gather(*(scan(g) for g in folder_ids)))
+        report.groups_scanned = len(present)
+
+        def in_drive(group_name: str, entry_date: str, *ids: Optional[str]) -> bool:
+            found: Set[str] = present.get(group_name, {}).get(entry_date, set())
+            return any(i in found for i in ids if i)
+
+        queued_ids: Set[str] = {item.message_id for item in spooled}
+        for item in spooled:
+            if in_drive(item.group_name, item.entry_date, item.message_id):
+                self._spool.mark_done(item.message_id)
+                report.spool_recovered += 1
+
+        for item in self._spool.exhausted():
+            if start_date <= item.entry_date <= end_date and not in_drive(item.group_name, item.entry_date, item.message_id):
+                report.spool_exhausted += 1
+                report.exhausted_message_ids.append(item.message_id)
+        if report.spool_exhausted:
+            logger.warning(
+                "⚠️ %s spooled upload(s) are no longer retried and are still missing from Drive.",
+                report.spool_exhausted, extra={"message_ids": report.exhausted_message_ids},
+            )
+
+        upload_index = getattr(self._gdrive_service, "upload_index", None)
+        for entry in entries:
+            if in_drive(entry.group_name, entry.entry_date, entry.file_id, entry.message_id):
+                continue
+            report.missing += 1
+            if entry.message_id in queued_ids:
+                report.already_spooled += 1
+                continue
+            if upload_index:
+                # Otherwise the index would answer the retry with the missing file's ID.
+                upload_index.remove([entry.message_id])
+            self._spool.enqueue(SpooledUpload(
+                message_id=entry.message_id, user_id=entry.user_id, group_name=entry.group_name,
+                entry_date=entry.entry_date, kind=entry.kind, file_name=None, reason="missing_in_drive",
+            ))
+            report.requeued += 1
+
+        report.api_calls = self._api_calls
+        report.elapsed_seconds = round(time.monotonic() - started, 2)
+        logger.info(
+            "Reconciled %s ledger entries from %s to %s across %s groups: %s missing, %s re-queued, "
+            "%s spooled items already in Drive (%s Drive calls in %ss).",
+            report.ledger_entries, start_date, end_date, report.groups_scanned, report.missing, report.requeued,
+            report.spool_recovered, report.api_calls, report.elapsed_seconds,
+        )
+        return report
+
+
+def main() -> None:
+    """Runs a reconciliation from the command line and prints its report as JSON."""
+    from dotenv import load_dotenv
+    from src.google_drive_uploader import GoogleDriveService
+    from src.upload_index import UploadIndex
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Reconcile the upload ledger with Google Drive.")
+    parser.add_argument("--days", type=int, default=30, help="How many days back to check, including today.")
+    parser.add_argument("--rate", type=float, default=float(os.getenv("DRIVE_RATE_LIMIT", "20")),
+                        help="Maximum Drive calls per second.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Group folders scanned at once.")
+    parser.add_argument("--skip-index", action="store_true", help="Do not check the upload index's MD5 checksums.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    storage_backend_name: str = os.getenv('STORAGE_BACKEND', 'drive').lower()
+    if storage_backend_name != 'drive':
+        logger.error(
+            "STORAGE_BACKEND=%s: the reconciler compares the ledger with Google Drive only; nothing to do.",
+            storage_backend_name,
+        )
+        raise SystemExit(2)
+
+    upload_index = UploadIndex(os.getenv('UPLOAD_INDEX_PATH', 'data/upload_index.db'))
+    gdrive_service = GoogleDriveService(upload_index=upload_index)
+    index_summary: Optional[Dict[str, int]] = None
+    if not args.skip_index:
+        index_summary = upload_index.reconcile(gdrive_service)
+    reconciler = DriveReconciler(
+        gdrive_service,
+        UploadLedger(os.getenv('UPLOAD_LEDGER_PATH', 'data/upload_ledger.db')),
+        UploadSpool(os.getenv('UPLOAD_SPOOL_PATH', 'data/upload_spool.db')),
+        os.getenv('PARENT_FOLDER_ID'),
+        rate_limiter=AsyncRateLimiter(rate=args.rate, burst=max(1, int(args.rate))),
+        max_concurrent_groups=args.concurrency,
+    )
+    end: date = date.today()
+    start: date = end - timedelta(days=args.days - 1)
+    report: ReconciliationReport = asyncio.run(reconciler.reconcile(start.isoformat(), end.isoformat()))
+    print(json.dumps({**asdict(report), "upload_index": index_summary}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Splits webhook ingress from the upload workers with a Redis Stream.
+
+In stream mode, `handle_webhook` verifies the signature and appends the
+delivery's raw body to a Redis Stream, and does nothing else.
+Worker processes (`python worker.py`) read the stream through a consumer
+group and run `process_webhook_events` on each delivery. This lets ingest
+capacity and upload capacity scale separately.
+
+An entry is acknowledged only after its events have been handled. If a
+worker dies mid-delivery, its entries stay pending. Once they have been idle
+for `claim_idle_ms`, another worker claims them with XAUTOCLAIM. The default
+is longer than the 60 seconds for which `process_webhook_event` treats a
+message ID as a duplicate, so a claimed delivery is not discarded. An entry
+that has failed `max_deliveries` times is moved to a dead-letter stream
+(`<stream>:dead`), so it cannot block the group forever.
+"""
+import asyncio
+import logging
+from typing import Optional, Dict, List, Any, Callable, Awaitable, Tuple, Union
+
+from linebot.v3.webhooks import Event
+from redis.exceptions import ResponseError
+
+from src import tracing
+from src.webhook_payload import parse_events
+
+logger = logging.getLogger(__name__)
+
+BODY_FIELD: str = "body"
+TRACEPARENT_FIELD: str = "traceparent"
+
+
+class WebhookEventStream:
+    """A Redis Stream of webhook deliveries, read through one consumer group.
+
+    Attributes:
+        stream_name: The Redis key of the stream.
+        group_name: The consumer group the workers share.
+        max_length: The approximate number of entries the stream keeps.
+    """
+    def __init__(
+        self,
+        redis_client: Any,
+        stream_name: str = "line:webhook-events",
+        group_name: str = "upload-workers",
+        max_length: int = 100_000,
+    ) -> None:
+        """Initializes the stream.
+
+        Args:
+            redis_client: An asyncio Redis client (`redis.asyncio`).
+            stream_name: The Redis key of the stream.
+            group_name: The consumer group the workers share.
+            max_length: The approximate number of entries the stream keeps.
+        """
+        self._redis: Any = redis_client
+        self.stream_name: str = stream_name
+        self.group_name: str = group_name
+        self.max_length: int = max_length
+
+    @property
+    def dead_letter_name(self) -> str:
+        return f"{self.stream_name}:dead"
+
+    async def ensure_group(self) -> None:
+        """Creates the stream and its consumer group if they do not exist yet."""
+        try:
+            await self._redis.xgroup_create(self.stream_name, self.group_name, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def publish(self, body: Union[bytes, str], traceparent: Optional[str] = None) -> str:
+        """Appends a verified webhook body to the stream and returns the entry ID.
+
+        A traceparent is stored with the body, so the worker that handles the
+        delivery continues the webhook request's trace.
+        """
+        fields: Dict[str, Union[bytes, str]] = {BODY_FIELD: body}
+        if traceparent:
+            fields[TRACEPARENT_FIELD] = traceparent
+        entry_id = await self._redis.xadd(
+            self.stream_name, fields, maxlen=self.max_length, approximate=True
+        )
+        return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+
+def _decode(value: Any) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def _body(fields: Dict[Any, Any]) -> str:
+    return _decode(fields.get(BODY_FIELD, fields.get(BODY_FIELD.encode())))
+
+
+def _traceparent(fields: Dict[Any, Any]) -> Optional[str]:
+    value = fields.get(TRACEPARENT_FIELD, fields.get(TRACEPARENT_FIELD.encode()))
+    return _decode(value) if value else None
+
+
+def parse_entry(fields: Dict[Any, Any]) -> List[Event]:
+    """Builds the events of a stream entry. The body was verified before it was published."""
+    return parse_events(_body(fields))
+
+
+class StreamWorker:
+    """Consumes the webhook stream as one member of its consumer group.
+
+    Attributes:
+        consumer_name: This worker's name within the group.
+        batch_size: How many entries are read, and handled concurrently, at once.
+        block_ms: How long a read waits for new entries.
+        claim_idle_ms: How long an entry must have been pending before another
+            worker may claim it.
+        max_deliveries: After this many failed deliveries an entry is
+            dead-lettered.
+    """
+    def __init__(
+        self,
+        stream: WebhookEventStream,
+        consumer_name: str,
+        handler: Callable[[List[Event]], Awaitable[None]],
+        batch_size: int = 10,
+        block_ms: int = 5000,
+        claim_idle_ms: int = 120_000,
+        max_deliveries: int = 5,
+    ) -> None:
+        self.stream: WebhookEventStream = stream
+        self.consumer_name: str = consumer_name
+        self.batch_size: int = batch_size
+        self.block_ms: int = block_ms
+        self.claim_idle_ms: int = claim_idle_ms
+        self.max_deliveries: int = max_deliveries
+        self._handler = handler
+        self._redis: Any = stream._redis
+        self._running: bool = False
+        self._processed: int = 0
+        self._failed: int = 0
+        self._claimed: int = 0
+        self._dead_lettered: int = 0
+
+    async def _deliveries(self, entry_id: str) -> int:
+        pending: List[Dict[str, Any]] = await self._redis.xpending_range(
+            self.stream.stream_name, self.stream.group_name, min=entry_id, max=entry_id, count=1
+        )
+        return int(pending[0]["times_delivered"]) if pending else 0
+
+    async def _handle(self, entry_id: Any, fields: Dict[Any, Any]) -> None:
+        entry_id = _decode(entry_id)
+        try:
+            with tracing.span("process_delivery", traceparent=_traceparent(fields), entry_id=entry_id):
+                # Building the event models is CPU-bound; it runs in a thread to keep the loop free.
+                await self._handler(await asyncio.to_thread(parse_entry, fields))
+        except Exception as e:
+            self._failed += 1
+            deliveries: int = await self._deliveries(entry_id)
+            if deliveries < self.max_deliveries:
+                # Left pending; it is claimed again once it has been idle for claim_idle_ms.
+                logger.error("❌ Stream entry failed (delivery %s): %s", deliveries, e, extra={"entry_id": entry_id})
+                return
+            logger.error(
+                "❌ Stream entry failed %s times; moving it to %s: %s", deliveries, self.stream.dead_letter_name, e,
+                extra={"entry_id": entry_id},
+            )
+            await self._redis.xadd(
+                self.stream.dead_letter_name,
+                {BODY_FIELD: _body(fields), "entry_id": entry_id, "error": str(e)},
+            )
+            self._dead_lettered += 1
+        else:
+            self._processed += 1
+        await self._redis.xack(self.stream.stream_name, self.stream.group_name, entry_id)
+
+    async def _handle_all(self, entries: List[Tuple[Any, Dict[Any, Any]]]) -> int:
+        entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+        await asyncio.gather(*(self._handle(entry_id, fields) for entry_id, fields in entries))
+        return len(entries)
+
+    async def claim_stale(self) -> int:
+        """Claims and handles entries left pending by workers that stopped or stalled.
+
+        Returns:
+            The number of entries claimed.
+        """
+        claimed: int = 0
+        start_id: Any = "0-0"
+        while True:
+            response: List[Any] = await self._redis.xautoclaim(
+                self.stream.stream_name, self.stream.group_name, self.consumer_name,
+                min_idle_time=self.claim_idle_ms, start_id=start_id, count=self.batch_size,
+            )
+            start_id, entries = response[0], response[1]
+            if entries:
+                logger.info("Claimed %s stale stream entries for %s.", len(entries), self.consumer_name)
+            claimed += await self._handle_all(entries)
+            if _decode(start_id) == "0-0":
+                break
+        self._claimed += claimed
+        return claimed
+
+    async def read_new(self, block_ms: Optional[int] = None) -> int:
+        """Reads and handles one batch of new entries, waiting up to block_ms for them.
+
+        Returns:
+            The number of entries handled.
+        """
+        response: List[Any] = await self._redis.xreadgroup(
+            self.stream.group_name, self.consumer_name, {self.stream.stream_name: ">"},
+            count=self.batch_size, block=self.block_ms if block_ms is None else block_ms,
+        )
+        handled: int = 0
+        for _, entries in response or []:
+            handled += await self._handle_all(entries)
+        return handled
+
+    async def run(self) -> None:
+        """Consumes the stream until stop() is called, claiming stale entries between reads."""
+        await self.stream.ensure_group()
+        self._running = True
+        logger.info("Worker %s is consuming %s.", self.consumer_name, self.stream.stream_name)
+        loop = asyncio.get_running_loop()
+        next_claim: float = 0.0
+        while self._running:
+            try:
+                if loop.time() >= next_claim:
+                    await self.claim_stale()
+                    next_claim = loop.time() + self.claim_idle_ms / 1000
+                await self.read_new()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("❌ Reading %s failed: %s", self.stream.stream_name, e)
+                await asyncio.sleep(1)
+
+    def stop(self) -> None:
+        """Makes run() return after the batch in progress."""
+        self._running = False
+
+    def stats(self) -> Dict[str, int]:
+        """Reports the entries processed, failed, claimed and dead-lettered by this worker."""
+        return {
+            "processed": self._processed,
+            "failed": self._failed,
+            "claimed": self._claimed,
+            "dead_lettered": self._dead_lettered,
+        }
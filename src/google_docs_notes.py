@@ -0,0 +1,138 @@
+"""
+A notes backend that appends to daily Google Docs in place.
+
+`GoogleDriveService.append_text_to_file` downloads the whole notes file and
+uploads it again to add one line. Its cost grows with the size of the day's
+log, and two concurrent writers can overwrite each other's line. This
+backend keeps each daily log as a Google Doc instead. It appends with a
+single `documents.batchUpdate` that inserts the line at the end of the
+document body, so an append costs the same however many notes the day
+already holds. Appends to the same document are serialised. The text
+handler calls the backend from worker threads, so each thread builds its
+own Docs client.
+"""
+import logging
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from src import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_MIME_TYPE: str = "application/vnd.google-apps.document"
+
+
+class GoogleDocsNotesBackend:
+    """Writes notes to per-day Google Docs.
+
+    It offers the same `append_text_to_file` call as GoogleDriveService, so
+    the text handler can use either backend.
+
+    Attributes:
+        docs_service: The Google Docs API service object of the calling thread.
+    """
+    def __init__(
+        self,
+        gdrive_service: Any,
+        docs_service: Optional[Any] = None,
+        credentials: Optional[Any] = None,
+    ) -> None:
+        """Initializes the backend.
+
+        Args:
+            gdrive_service: The GoogleDriveService used to find and create the
+                documents inside the daily folders.
+            docs_service: A ready Docs API service, used by every thread. If
+                omitted, each thread builds one from credentials.
+            credentials: The OAuth2 credentials used to build the Docs service.
+        """
+        self._gdrive_service = gdrive_service
+        self._docs_service: Optional[Any] = docs_service
+        self._credentials: Optional[Any] = credentials
+        self._thread_local = threading.local()
+        self._document_ids: Dict[Tuple[str, str], str] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+
+    @property
+    def docs_service(self) -> Any:
+        if self._docs_service is not None:
+            return self._docs_service
+        service: Optional[Any] = getattr(self._thread_local, 'docs_service', None)
+        if service is None:
+            service = build('docs', 'v1', credentials=self._credentials, cache_discovery=False, static_discovery=True)
+            self._thread_local.docs_service = service
+        return service
+
+    @staticmethod
+    def _document_name(file_name: str) -> str:
+        return file_name[:-len(".txt")] if file_name.endswith(".txt") else file_name
+
+    def find_or_create_document(self, file_name: str, folder_id: str) -> str:
+        """Returns the ID of the Google Doc for a daily log, creating it if needed."""
+        name: str = self._document_name(file_name)
+        key: Tuple[str, str] = (folder_id, name)
+        with self._registry_lock:
+            document_id: Optional[str] = self._document_ids.get(key)
+            metrics.record_cache_lookup("docs_document_id", hit=document_id is not None)
+            if document_id:
+                return document_id
+
+            service: Any = self._gdrive_service.service
+            query: str = (
+                f"name='{name}' and '{folder_id}' in parents and "
+                f"mimeType='{DOCUMENT_MIME_TYPE}' and trashed=false"
+            )
+            files: List[Dict[str, Any]] = service.files().list(q=query, fields='files(id)').execute().get('files', [])
+            if files:
+                document_id = files[0].get('id')
+            else:
+                file_metadata: Dict[str, Any] = {'name': name, 'parents': [folder_id], 'mimeType': DOCUMENT_MIME_TYPE}
+                document_id = service.files().create(body=file_metadata, fields='id').execute().get('id')
+                logger.info("Created notes document '%s' with ID: %s", name, document_id)
+            self._document_ids[key] = document_id
+            return document_id
+
+    def _lock_for(self, document_id: str) -> threading.Lock:
+        with self._registry_lock:
+            return self._locks.setdefault(document_id, threading.Lock())
+
+    def append_to_document(self, document_id: str, text: str) -> None:
+        """Appends text as a new paragraph at the end of a document's body."""
+        with self._lock_for(document_id):
+            self.docs_service.documents().batchUpdate(
+                documentId=document_id,
+                body={'requests': [{'insertText': {'endOfSegmentLocation': {}, 'text': f"{text}\n"}}]},
+            ).execute()
+
+    def stats(self) -> Dict[str, int]:
+        """Reports how many document IDs and per-document locks are cached."""
+        return {"cached_document_ids": len(self._document_ids), "document_locks": len(self._locks)}
+
+    @tracing.traced("docs.append_text_to_file")
+    def append_text_to_file(self, file_name: str, text_to_append: str, folder_id: str) -> None:
+        """Appends a timestamped line of text to the daily notes document.
+
+        Args:
+            file_name: The name of the daily log (e.g. "2025-08-30_notes.txt");
+                the document is named without the ".txt" extension.
+            text_to_append: The line of text to add.
+            folder_id: The ID of the folder containing the document.
+        """
+        timestamp: str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        formatted_text: str = f"[{timestamp}] {text_to_append}"
+        document_id: str = self.find_or_create_document(file_name, folder_id)
+        try:
+            self.append_to_document(document_id, formatted_text)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            # The cached document was deleted; look it up (or create it) again.
+            with self._registry_lock:
+                self._document_ids.pop((folder_id, self._document_name(file_name)), None)
+            self.append_to_document(self.find_or_create_document(file_name, folder_id), formatted_text)
+        logger.info("Appended note to document '%s'.", self._document_name(file_name))
@@ -6,18 +6,23 @@ logic for authentication, token management, folder creation, and file uploads,
 including appending text content to existing files.
 """
 import logging
+import hashlib
 import io
 import os.path
-from typing import Optional, Any, List, Dict
-from google.auth.transport.requests import Request
+from typing import Optional, Any, List, Dict, Tuple, BinaryIO, Union, Iterator
+from google.auth.transport.requests import Request, AuthorizedSession
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
 import shutil
+import threading
 import dotenv
 from datetime import datetime
 
+from src.upload_index import UploadIndex, IndexedUpload
+from src import metrics, tracing
+
 dotenv.load_dotenv()
 
 class GoogleDriveService:
@@ -32,25 +37,66 @@ class GoogleDriveService:
         SCOPES: A list of strings defining the required API permissions.
         CREDENTIALS_FILE: The path to the Google Cloud credentials JSON file.
         TOKEN_FILE: The path to the generated token JSON file for authentication.
-        service: The authenticated Google Drive API service object.
+        HASH_CHUNK_SIZE: The read size used when hashing content before upload.
+        RESUMABLE_UPLOAD_URL: The Drive endpoint that starts resumable upload sessions.
+        service: The authenticated Google Drive API service object of the
+            calling thread.
+        upload_index: The optional local index used to make uploads idempotent.
     """
     SCOPES: List[str] = ['https://www.googleapis.com/auth/drive']
     CREDENTIALS_FILE: str = os.getenv('CREDENTIALS_FILE_PATH', 'credentials.json')
     TOKEN_FILE: str = os.getenv('TOKEN_FILE_PATH', 'token.json')
+    HASH_CHUNK_SIZE: int = 1024 * 1024
+    RESUMABLE_UPLOAD_URL: str = 'https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&fields=id,name,size,md5Checksum'
+
+    def __init__(self, upload_index: Optional[UploadIndex] = None) -> None:
+        """Initializes the service and handles user authentication.
 
-    def __init__(self) -> None:
-        """Initializes the service and handles user authentication."""
+        Args:
+            upload_index: An optional index of previous uploads. When given,
+                uploads that were already completed are not repeated.
+        """
+        self.upload_index: Optional[UploadIndex] = upload_index
         if os.getenv('ENV') == 'production':
             writable_path: str = '/tmp/token.json'
             os.makedirs(os.path.dirname(writable_path), exist_ok=True)
             shutil.copy(self.TOKEN_FILE, writable_path)
             self.TOKEN_FILE = writable_path
-            logging.info(f"Running in production. Using writable token at {self.TOKEN_FILE}")
+            logging.info("Running in production. Using writable token at %s", self.TOKEN_FILE)
         
         creds: Credentials = self._get_credentials()
-        self.service: Any = build('drive', 'v3', credentials=creds)
+        self._credentials: Credentials = creds
+        self._thread_local = threading.local()
+        self._owner_thread: int = threading.get_ident()
+        # The discovery document bundled with googleapiclient is used, so building needs no request.
+        self.service = build('drive', 'v3', credentials=creds, cache_discovery=False, static_discovery=True)
         logging.info("Google Drive Service initialized successfully.")
 
+    @property
+    def service(self) -> Any:
+        """The Drive API service object owned by the calling thread.
+
+        The HTTP transport of a service object is not thread-safe. Calls made
+        from worker threads (via `asyncio.to_thread`) therefore each get
+        their own service object, built on first use.
+        """
+        if threading.get_ident() == self._owner_thread:
+            return self._service
+        service: Optional[Any] = getattr(self._thread_local, 'service', None)
+        if service is None:
+            service = build('drive', 'v3', credentials=self._credentials, cache_discovery=False, static_discovery=True)
+            self._thread_local.service = service
+        return service
+
+    @service.setter
+    def service(self, service: Any) -> None:
+        self._service: Any = service
+
+    @property
+    def credentials(self) -> Credentials:
+        """The OAuth2 credentials, for building other Google API clients."""
+        return self._credentials
+
     def _get_credentials(self) -> Credentials:
         """Handles the OAuth2 authentication flow.
 
@@ -77,6 +123,7 @@ class GoogleDriveService:
                 token.write(creds.to_json())
         return creds
 
+    @tracing.traced("drive.find_or_create_folder")
     def find_or_create_folder(self, folder_name: str, parent_folder_id: Optional[str] = None) -> str:
         """Finds a folder by name within a parent folder, creating it if it doesn't exist.
 
@@ -111,30 +158,363 @@ class GoogleDriveService:
             folder: Dict[str, Any] = self.service.files().create(body=file_metadata, fields='id').execute()
             return folder.get('id')
 
-    def upload_file(self, file_name: str, file_content: bytes, folder_id: str) -> str:
+    @classmethod
+    def _compute_digests(cls, stream: BinaryIO) -> Tuple[str, str, int]:
+        """Computes SHA-256 and MD5 digests of a stream in a single chunked pass.
+
+        The stream is rewound afterwards so it can be handed to the uploader.
+
+        Returns:
+            A tuple of (sha256 hex digest, md5 hex digest, size in bytes).
+        """
+        sha256 = hashlib.sha256()
+        md5 = hashlib.md5()
+        size: int = 0
+        stream.seek(0)
+        while True:
+            chunk: bytes = stream.read(cls.HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            md5.update(chunk)
+            size += len(chunk)
+        stream.seek(0)
+        return sha256.hexdigest(), md5.hexdigest(), size
+
+    @tracing.traced("drive.upload_file")
+    def upload_file(
+        self,
+        file_name: str,
+        file_content: Union[bytes, memoryview, BinaryIO],
+        folder_id: str,
+        message_id: Optional[str] = None,
+        app_properties: Optional[Dict[str, str]] = None,
+        mime_type: str = 'image/jpeg',
+    ) -> str:
         """Uploads file content to a specified folder in Google Drive.
 
+        The file is tagged with `appProperties` holding the LINE message ID
+        and the SHA-256 of its content. If an upload index is configured, a
+        message that was already uploaded, or identical content already
+        present in the same folder, is not uploaded again.
+
         Args:
             file_name: The desired name for the file in Google Drive.
-            file_content: The raw binary content of the file.
+            file_content: The raw binary content of the file, or a seekable
+                file object to stream it from (e.g. a spilled media buffer).
             folder_id: The ID of the parent folder where the file will be uploaded.
+            message_id: The LINE message ID the content belongs to, if any.
+            app_properties: Extra `appProperties` to store on the new file.
+            mime_type: The MIME type of the content.
 
         Returns:
-            The ID of the newly uploaded file.
+            The ID of the newly uploaded (or previously uploaded) file.
         """
-        file_metadata: Dict[str, Any] = {'name': file_name, 'parents': [folder_id]}
-        media = MediaIoBaseUpload(io.BytesIO(file_content), mimetype='image/jpeg', resumable=True)
-        request: Any = self.service.files().create(body=file_metadata, media_body=media, fields='id')
+        stream: BinaryIO = (
+            io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray, memoryview)) else file_content
+        )
+        sha256, md5, size = self._compute_digests(stream)
+
+        if self.upload_index:
+            existing: Optional[IndexedUpload] = None
+            if message_id:
+                existing = self.upload_index.find_by_message_id(message_id)
+            if existing is None:
+                existing = self.upload_index.find_by_hash(sha256, folder_id)
+            metrics.record_cache_lookup("upload_index", hit=existing is not None)
+            if existing:
+                logging.info("Skipping upload of '%s': already stored as file ID %s.", file_name, existing.file_id)
+                if message_id and existing.message_id != message_id:
+                    self.upload_index.record(IndexedUpload(
+                        message_id=message_id, sha256=sha256, md5=existing.md5, size=size,
+                        file_id=existing.file_id, folder_id=folder_id, file_name=existing.file_name,
+                    ))
+                return existing.file_id
+
+        properties: Dict[str, str] = dict(app_properties or {})
+        properties['sha256'] = sha256
+        if message_id:
+            properties['line_message_id'] = message_id
+
+        file_metadata: Dict[str, Any] = {
+            'name': file_name,
+            'parents': [folder_id],
+            'appProperties': properties,
+        }
+        media = MediaIoBaseUpload(stream, mimetype=mime_type, resumable=True)
+        request: Any = self.service.files().create(body=file_metadata, media_body=media, fields='id, md5Checksum')
         
         response: Optional[Dict[str, Any]] = None
         while response is None:
-            status, response = request.next_chunk()
-            if status:
-                logging.info(f"Uploaded {int(status.progress() * 100)}%.")
+            _, response = request.next_chunk()
         
-        logging.info(f"File '{file_name}' uploaded successfully with ID: {response.get('id')}")
-        return response.get('id')
+        file_id: str = response.get('id')
+        logging.info("File '%s' uploaded successfully with ID: %s", file_name, file_id)
+
+        if self.upload_index and message_id:
+            self.upload_index.record(IndexedUpload(
+                message_id=message_id, sha256=sha256, md5=response.get('md5Checksum') or md5,
+                size=size, file_id=file_id, folder_id=folder_id, file_name=file_name,
+            ))
+        return file_id
+
+    def _session(self) -> AuthorizedSession:
+        """Returns an authorized HTTP session, owned by the calling thread, for raw requests.
+
+        Resumable uploads and downloads run in worker threads via
+        `asyncio.to_thread`, so each thread gets its own session.
+        """
+        session: Optional[AuthorizedSession] = getattr(self._thread_local, 'session', None)
+        if session is None:
+            session = AuthorizedSession(self._credentials)
+            self._thread_local.session = session
+        return session
+
+    @tracing.traced("drive.start_resumable_upload")
+    def start_resumable_upload(
+        self,
+        file_name: str,
+        folder_id: str,
+        mime_type: str,
+        total_size: Optional[int] = None,
+        app_properties: Optional[Dict[str, str]] = None,
+    ) -> str:
+        """Opens a Drive resumable upload session for content sent in chunks.
+
+        Args:
+            file_name: The desired name for the file in Google Drive.
+            folder_id: The ID of the parent folder.
+            mime_type: The MIME type of the content.
+            total_size: The content size in bytes, if known in advance.
+            app_properties: `appProperties` to store on the new file.
+
+        Returns:
+            The session URI, valid for about a week, to send chunks to.
+        """
+        headers: Dict[str, str] = {'X-Upload-Content-Type': mime_type}
+        if total_size is not None:
+            headers['X-Upload-Content-Length'] = str(total_size)
+        metadata: Dict[str, Any] = {'name': file_name, 'parents': [folder_id], 'mimeType': mime_type}
+        if app_properties:
+            metadata['appProperties'] = app_properties
+
+        response = self._session().post(self.RESUMABLE_UPLOAD_URL, json=metadata, headers=headers)
+        response.raise_for_status()
+        logging.info("Started resumable upload session for '%s'.", file_name)
+        return response.headers['Location']
+
+    @tracing.traced("drive.upload_resumable_chunk")
+    def upload_resumable_chunk(
+        self, session_uri: str, chunk: bytes, offset: int, total_size: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Sends one chunk of a resumable upload.
+
+        Every chunk except the last must be a multiple of 256 KiB.
+
+        Args:
+            session_uri: The URI returned by start_resumable_upload.
+            chunk: The bytes to send.
+            offset: The position of the chunk's first byte in the file.
+            total_size: The full size, required on the final chunk.
+
+        Returns:
+            The created file resource (id, name, size, md5Checksum) once the
+            upload is complete, otherwise None.
+        """
+        total: str = str(total_size) if total_size is not None else '*'
+        if chunk:
+            headers: Dict[str, str] = {'Content-Range': f'bytes {offset}-{offset + len(chunk) - 1}/{total}'}
+        else:
+            # Finalizes an upload whose size only became known after the last full chunk.
+            headers = {'Content-Range': f'bytes */{total}'}
+        response = self._session().put(session_uri, data=chunk, headers=headers)
+        if response.status_code == 308:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    @tracing.traced("drive.query_resumable_upload")
+    def query_resumable_upload(self, session_uri: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Asks Drive how much of an interrupted resumable upload it has stored.
+
+        Args:
+            session_uri: The URI returned by start_resumable_upload.
+
+        Returns:
+            A tuple of (next byte offset to send, file resource if the upload
+            had already completed). An offset of -1 means the session expired
+            and the upload must start over.
+        """
+        response = self._session().put(session_uri, headers={'Content-Range': 'bytes */*'})
+        if response.status_code == 308:
+            received: Optional[str] = response.headers.get('Range')
+            return (int(received.split('-')[1]) + 1 if received else 0), None
+        if response.status_code in (200, 201):
+            return 0, response.json()
+        if response.status_code in (404, 410):
+            return -1, None
+        response.raise_for_status()
+        return -1, None
+
+    @tracing.traced("drive.set_app_properties")
+    def set_app_properties(self, file_id: str, app_properties: Dict[str, str]) -> None:
+        """Adds or updates `appProperties` on an existing file."""
+        self.service.files().update(fileId=file_id, body={'appProperties': app_properties}, fields='id').execute()
+
+    @tracing.traced("drive.list_file_checksums")
+    def list_file_checksums(self, folder_id: str) -> Dict[str, Optional[str]]:
+        """Lists the MD5 checksums of all non-trashed files in a folder.
+
+        Args:
+            folder_id: The ID of the folder to list.
+
+        Returns:
+            A mapping of file ID to Drive's `md5Checksum` (None for files
+            without binary content, such as Google Docs).
+        """
+        checksums: Dict[str, Optional[str]] = {}
+        page_token: Optional[str] = None
+        while True:
+            response: Dict[str, Any] = self.service.files().list(
+                q=f"'{folder_id}' in parents and trashed=false",
+                fields='nextPageToken, files(id, md5Checksum)',
+                pageSize=1000,
+                pageToken=page_token,
+            ).execute()
+            for item in response.get('files', []):
+                checksums[item.get('id')] = item.get('md5Checksum')
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return checksums
     
+    @tracing.traced("drive.read_text_file")
+    def read_text_file(self, file_name: str, folder_id: str) -> Optional[Tuple[str, str]]:
+        """Reads a text file in a Google Drive folder by name.
+
+        Args:
+            file_name: The name of the text file.
+            folder_id: The ID of the folder containing the file.
+
+        Returns:
+            The file's ID and its text, or None if there is no such file.
+        """
+        query: str = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
+        response: Dict[str, Any] = self.service.files().list(q=query, fields='files(id)').execute()
+        files: List[Dict[str, Any]] = response.get('files', [])
+        if not files:
+            return None
+        file_id: str = files[0].get('id')
+        content: bytes = self.service.files().get_media(fileId=file_id).execute()
+        return file_id, content.decode('utf-8', errors='replace')
+
+    @tracing.traced("drive.write_text_file")
+    def write_text_file(self, file_name: str, content: str, folder_id: str, file_id: Optional[str] = None) -> str:
+        """Creates or overwrites a text file in Google Drive.
+
+        Args:
+            file_name: The name of the text file.
+            content: The full text the file should contain.
+            folder_id: The ID of the folder containing the file.
+            file_id: The file's ID if it is already known; otherwise the
+                file is looked up by name and created if missing.
+
+        Returns:
+            The ID of the written file.
+        """
+        if file_id is None:
+            query: str = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
+            response: Dict[str, Any] = self.service.files().list(q=query, fields='files(id)').execute()
+            files: List[Dict[str, Any]] = response.get('files', [])
+            if files:
+                file_id = files[0].get('id')
+
+        media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype='text/plain')
+        if file_id:
+            self.service.files().update(fileId=file_id, media_body=media).execute()
+            logging.info("Rewrote text file '%s'.", file_name)
+            return file_id
+
+        file_metadata: Dict[str, Any] = {'name': file_name, 'parents': [folder_id], 'mimeType': 'text/plain'}
+        created: Dict[str, Any] = self.service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        logging.info("Created new text file '%s'.", file_name)
+        return created.get('id')
+
+    @tracing.traced("drive.list_children_page")
+    def list_children_page(
+        self,
+        folder_id: str,
+        fields: str,
+        folders_only: bool = False,
+        page_token: Optional[str] = None,
+        page_size: int = 1000,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lists one page of a folder's non-trashed children.
+
+        Args:
+            folder_id: The ID of the folder to list.
+            fields: The field mask of each returned file, e.g. "id, name".
+            folders_only: If True, only subfolders are listed.
+            page_token: The token of the page to fetch; None for the first page.
+            page_size: The number of files per page (Drive allows up to 1000).
+
+        Returns:
+            The page's files and the next page token (None on the last page).
+        """
+        query: str = f"'{folder_id}' in parents and trashed=false"
+        if folders_only:
+            query += " and mimeType='application/vnd.google-apps.folder'"
+        response: Dict[str, Any] = self.service.files().list(
+            q=query,
+            fields=f'nextPageToken, files({fields})',
+            pageSize=page_size,
+            pageToken=page_token,
+        ).execute()
+        return response.get('files', []), response.get('nextPageToken')
+
+    @tracing.traced("drive.find_folder")
+    def find_folder(self, folder_name: str, parent_folder_id: Optional[str] = None) -> Optional[str]:
+        """Finds a folder by name within a parent folder without creating it.
+
+        Returns:
+            The ID of the folder, or None if there is no such folder.
+        """
+        query: str = (
+            f"mimeType='application/vnd.google-apps.folder' and name='{folder_name}' and trashed=false"
+            f" and '{parent_folder_id or 'root'}' in parents"
+        )
+        files: List[Dict[str, Any]] = self.service.files().list(
+            q=query, spaces='drive', fields='files(id)'
+        ).execute().get('files', [])
+        return files[0].get('id') if files else None
+
+    def iter_file_content(
+        self, file_id: str, chunk_size: int = 1024 * 1024, export_mime_type: Optional[str] = None
+    ) -> Iterator[bytes]:
+        """Downloads a file's content as a stream of chunks.
+
+        Only one chunk is held in memory at a time. Each thread uses its own
+        HTTP session, so files can be downloaded from several worker threads.
+
+        Args:
+            file_id: The ID of the file to download.
+            chunk_size: The maximum size of each yielded chunk.
+            export_mime_type: For native Google files (e.g. Google Docs), which
+                have no content of their own, the format to export them as.
+
+        Raises:
+            requests.HTTPError: If Drive rejects the download.
+        """
+        session: AuthorizedSession = self._session()
+        url: str = f"https://www.googleapis.com/drive/v3/files/{file_id}"
+        params: Dict[str, str] = {'alt': 'media'}
+        if export_mime_type:
+            url += "/export"
+            params = {'mimeType': export_mime_type}
+        with session.get(url, params=params, stream=True) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size=chunk_size)
+
+    @tracing.traced("drive.append_text_to_file")
     def append_text_to_file(self, file_name: str, text_to_append: str, folder_id: str) -> None:
         """Appends a timestamped line of text to a file in Google Drive.
 
@@ -161,9 +541,9 @@ class GoogleDriveService:
             
             media = MediaIoBaseUpload(io.BytesIO(new_content), mimetype='text/plain', resumable=True)
             self.service.files().update(fileId=file_id, media_body=media).execute()
-            logging.info(f"Appended text to existing file '{file_name}'.")
+            logging.info("Appended text to existing file '%s'.", file_name)
         else:
             file_metadata: Dict[str, Any] = {'name': file_name, 'parents': [folder_id], 'mimeType': 'text/plain'}
             media = MediaIoBaseUpload(io.BytesIO(formatted_text.encode('utf-8')), mimetype='text/plain')
             self.service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-            logging.info(f"Created new file '{file_name}' with initial text.")
\ No newline at end of file
+            logging.info("Created new file '%s' with initial text.", file_name)
\ No newline at end of file
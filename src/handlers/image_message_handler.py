@@ -2,14 +2,23 @@ import logging
 import aiohttp
 import asyncio
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, Union, BinaryIO, Tuple
 
 from linebot.v3.webhooks import MessageEvent
 from src.state_manager import StateManager
 from src.google_drive_uploader import GoogleDriveService
+from src.near_duplicate_detector import NearDuplicateDetector, NearDuplicateMatch
+from src.image_transformer import ImageTransformer, ImageFormat, DEFAULT_FORMAT, detect_image_format
+from src.media_buffer import MediaMemoryBudget, MediaBuffer
+from src.image_set_batcher import ImageSetBatcher, ImageSetBatch, UPLOADED, SKIPPED, FAILED
+from src.confirmation_aggregator import ConfirmationAggregator
+from src.upload_ledger import UploadLedger, event_latency_ms
+from src import metrics
 
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+
 async def download_image_content(image_message_id: str, channel_access_token: str) -> Optional[bytes]:
     """Downloads image content from LINE's content endpoint with retry logic."""
     headers: Dict[str, str] = {"Authorization": f"Bearer {channel_access_token}"}
@@ -22,47 +31,332 @@ async def download_image_content(image_message_id: str, channel_access_token: st
                     if resp.status == 200:
                         return await resp.read()
                     else:
-                        logger.error(f"❌ Failed to fetch image. Status: {resp.status}, Response: {await resp.text()}")
+                        response_text: str = await resp.text()
+                        logger.error(
+                            "❌ Failed to fetch image. Status: %s, Response: %.500s", resp.status, response_text,
+                            extra={"message_id": image_message_id},
+                        )
                         return None 
             except aiohttp.ClientError as e:
-                logger.warning(f"⚠️ Attempt {attempt + 1}/3 failed to download image due to a connection error: {e}")
+                logger.warning(
+                    "⚠️ Attempt %s/3 failed to download image due to a connection error: %s", attempt + 1, e,
+                    extra={"message_id": image_message_id},
+                )
                 if attempt < 2:
                     await asyncio.sleep(1)
             except Exception as e:
-                logger.error(f"An unexpected error occurred while fetching image content: {e}")
+                logger.error(
+                    "An unexpected error occurred while fetching image content: %s", e,
+                    extra={"message_id": image_message_id},
+                )
                 return None
             
-    logger.error(f"❌ Failed to download image after 3 attempts for message ID {image_message_id}.")
+    logger.error("❌ Failed to download image after 3 attempts.", extra={"message_id": image_message_id})
+    return None
+
+async def download_content_to_buffer(
+    message_id: str, channel_access_token: str, media_budget: MediaMemoryBudget
+) -> Optional[MediaBuffer]:
+    """Streams message content from LINE into a memory-budgeted buffer.
+
+    Content above the budget's per-item threshold, or downloaded while the
+    budget is exhausted, is spilled to a temporary file instead of the heap.
+    """
+    headers: Dict[str, str] = {"Authorization": f"Bearer {channel_access_token}"}
+    content_url: str = f"https://api-data.line.me/v2/bot/message/{message_id}/content"
+
+    async with aiohttp.ClientSession() as session:
+        for attempt in range(3):
+            media_buffer: Optional[MediaBuffer] = None
+            try:
+                async with session.get(content_url, headers=headers) as resp:
+                    if resp.status != 200:
+                        response_text: str = await resp.text()
+                        logger.error(
+                            "❌ Failed to fetch content. Status: %s, Response: %.500s", resp.status, response_text,
+                            extra={"message_id": message_id},
+                        )
+                        return None
+                    media_buffer = media_budget.new_buffer(resp.content_length)
+                    async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        media_buffer.write(chunk)
+                    return media_buffer
+            except aiohttp.ClientError as e:
+                if media_buffer:
+                    media_buffer.close()
+                logger.warning(
+                    "⚠️ Attempt %s/3 failed to download content due to a connection error: %s", attempt + 1, e,
+                    extra={"message_id": message_id},
+                )
+                if attempt < 2:
+                    await asyncio.sleep(1)
+            except Exception as e:
+                if media_buffer:
+                    media_buffer.close()
+                logger.error(
+                    "An unexpected error occurred while fetching content: %s", e, extra={"message_id": message_id}
+                )
+                return None
+
+    logger.error("❌ Failed to download content after 3 attempts.", extra={"message_id": message_id})
     return None
 
+def resolve_daily_folder(
+    gdrive_service: GoogleDriveService, active_group: str, parent_folder_id: Optional[str]
+) -> str:
+    """Finds or creates today's folder inside the group's folder (blocking; run it in a thread)."""
+    group_folder_id: str = gdrive_service.find_or_create_folder(active_group, parent_folder_id=parent_folder_id)
+    today_str: str = datetime.now().strftime("%Y-%m-%d")
+    return gdrive_service.find_or_create_folder(today_str, parent_folder_id=group_folder_id)
+
+async def _upload_image(
+    event: MessageEvent,
+    active_group: str,
+    image_content: Union[bytes, memoryview],
+    gdrive_service: GoogleDriveService,
+    parent_folder_id: Optional[str],
+    near_duplicate_detector: Optional[NearDuplicateDetector],
+    image_transformer: Optional[ImageTransformer],
+    original_stream: Optional[BinaryIO] = None,
+    daily_folder_id: Optional[str] = None,
+    file_stem: Optional[str] = None,
+    upload_ledger: Optional[UploadLedger] = None,
+) -> str:
+    """Runs the optional image stages and uploads the result to the daily folder.
+
+    Args:
+        original_stream: A file object over the original content. When given,
+            an untransformed image is uploaded from it instead of from
+            image_content.
+        daily_folder_id: The destination folder if it is already known.
+        file_stem: The file name without extension; defaults to the message ID.
+        upload_ledger: If given, the upload is recorded in this ledger.
+
+    Returns:
+        UPLOADED, or SKIPPED if the image was a skipped near-duplicate.
+    """
+    app_properties: Optional[Dict[str, str]] = None
+    if near_duplicate_detector:
+        with metrics.stage("near_duplicate_check"):
+            match: Optional[NearDuplicateMatch] = await near_duplicate_detector.check(
+                active_group, image_content, event.message.id
+            )
+        if match and near_duplicate_detector.action == "skip":
+            logger.info(
+                "Skipping image %s: near-duplicate of %s (similarity %.2f) in group '%s'.",
+                event.message.id, match.message_id, match.similarity, active_group,
+            )
+            return SKIPPED
+        if match:
+            app_properties = {
+                "near_duplicate_of": match.message_id,
+                "similarity": f"{match.similarity:.3f}",
+            }
+
+    upload_source: Union[bytes, memoryview, BinaryIO] = (
+        original_stream if original_stream is not None else image_content
+    )
+    upload_size: int = len(image_content)
+    image_format: ImageFormat = detect_image_format(image_content) or DEFAULT_FORMAT
+    if image_transformer:
+        with metrics.stage("image_transform"):
+            transformed = await image_transformer.transform(image_content)
+        if transformed.transformed:
+            upload_source = transformed.content
+            upload_size = len(transformed.content)
+        image_format = transformed.image_format
+
+    if daily_folder_id is None:
+        with metrics.stage("folder_resolution"):
+            daily_folder_id = await asyncio.to_thread(resolve_daily_folder, gdrive_service, active_group, parent_folder_id)
+
+    # Drive calls run in a worker thread so that other photos (e.g. of the same image set) proceed meanwhile.
+    file_name: str = f"{file_stem or event.message.id}.{image_format.extension}"
+    with metrics.stage("upload"):
+        file_id: str = await asyncio.to_thread(
+            gdrive_service.upload_file,
+            file_name, upload_source, daily_folder_id,
+            message_id=event.message.id, app_properties=app_properties,
+            mime_type=image_format.mime_type
+        )
+    metrics.record_upload("photo", upload_size, active_group)
+    if near_duplicate_detector:
+        near_duplicate_detector.remember(event.message.id)
+    if upload_ledger:
+        upload_ledger.record(
+            event.message.id, event.source.user_id, active_group, "photo",
+            upload_size, file_id, event_latency_ms(event)
+        )
+    return UPLOADED
+
+async def _download_and_upload(
+    event: MessageEvent,
+    active_group: str,
+    gdrive_service: GoogleDriveService,
+    channel_access_token: str,
+    parent_folder_id: Optional[str],
+    near_duplicate_detector: Optional[NearDuplicateDetector],
+    image_transformer: Optional[ImageTransformer],
+    media_budget: Optional[MediaMemoryBudget],
+    daily_folder_id: Optional[str] = None,
+    file_stem: Optional[str] = None,
+    upload_ledger: Optional[UploadLedger] = None,
+) -> str:
+    """Downloads one image and uploads it, returning UPLOADED, SKIPPED or FAILED."""
+    if media_budget:
+        with metrics.stage("download"):
+            media_buffer: Optional[MediaBuffer] = await download_content_to_buffer(
+                event.message.id, channel_access_token, media_budget
+            )
+        if not media_buffer:
+            return FAILED
+        with media_buffer, media_buffer.view() as content_view:
+            return await _upload_image(
+                event, active_group, content_view, gdrive_service, parent_folder_id,
+                near_duplicate_detector, image_transformer, original_stream=media_buffer.stream(),
+                daily_folder_id=daily_folder_id, file_stem=file_stem, upload_ledger=upload_ledger
+            )
+
+    with metrics.stage("download"):
+        image_content: Optional[bytes] = await download_image_content(event.message.id, channel_access_token)
+    if not image_content:
+        return FAILED
+    return await _upload_image(
+        event, active_group, image_content, gdrive_service, parent_folder_id,
+        near_duplicate_detector, image_transformer,
+        daily_folder_id=daily_folder_id, file_stem=file_stem, upload_ledger=upload_ledger
+    )
+
+def _confirm(
+    confirmation_aggregator: Optional[ConfirmationAggregator], event: MessageEvent, active_group: str, outcome: str
+) -> None:
+    """Adds a photo's outcome to the user's pending confirmation; skipped photos are not reported."""
+    if confirmation_aggregator and outcome != SKIPPED:
+        confirmation_aggregator.record(
+            event.source.user_id, active_group, "photo",
+            reply_token=event.reply_token, success=outcome == UPLOADED
+        )
+
+async def _handle_image_set_member(
+    event: MessageEvent,
+    image_set_batcher: ImageSetBatcher,
+    state_manager: StateManager,
+    gdrive_service: GoogleDriveService,
+    channel_access_token: str,
+    parent_folder_id: Optional[str],
+    near_duplicate_detector: Optional[NearDuplicateDetector],
+    image_transformer: Optional[ImageTransformer],
+    media_budget: Optional[MediaMemoryBudget],
+    confirmation_aggregator: Optional[ConfirmationAggregator],
+    upload_ledger: Optional[UploadLedger],
+) -> None:
+    """Handles one photo of an image set as part of the set's batch."""
+    image_set = event.message.image_set
+    user_id: str = event.source.user_id
+    batch: ImageSetBatch = image_set_batcher.batch_for(image_set.id, image_set.total)
+
+    async def resolve_destination() -> Optional[Tuple[str, str]]:
+        active_group: Optional[str] = await asyncio.to_thread(state_manager.get_active_group, user_id)
+        if not active_group:
+            logger.warning(
+                "Image set received but the user has no active session. Ignoring.",
+                extra={"image_set_id": image_set.id, "user_id": user_id},
+            )
+            return None
+        logger.info(
+            "Image set %s of %s photos received from user %s with active session for group '%s'.",
+            image_set.id, image_set.total, user_id, active_group,
+        )
+        with metrics.stage("folder_resolution"):
+            return active_group, await asyncio.to_thread(
+                resolve_daily_folder, gdrive_service, active_group, parent_folder_id
+            )
+
+    outcome: str = FAILED
+    destination: Optional[Tuple[str, str]] = None
+    try:
+        destination = await batch.destination(resolve_destination)
+        if destination is None:
+            outcome = SKIPPED
+            return
+        active_group, daily_folder_id = destination
+        file_stem: Optional[str] = None
+        if image_set_batcher.name_by_index and image_set.index is not None:
+            file_stem = image_set_batcher.file_stem(image_set.id, image_set.index, image_set.total)
+        async with batch.slots:
+            outcome = await _download_and_upload(
+                event, active_group, gdrive_service, channel_access_token, parent_folder_id,
+                near_duplicate_detector, image_transformer, media_budget,
+                daily_folder_id=daily_folder_id, file_stem=file_stem, upload_ledger=upload_ledger
+            )
+    except Exception as e:
+        logger.error(
+            "❌ Failed to process image of image set: %s", e,
+            extra={"message_id": event.message.id, "image_set_id": image_set.id},
+        )
+    finally:
+        image_set_batcher.complete(batch, outcome)
+        if destination is not None:
+            _confirm(confirmation_aggregator, event, destination[0], outcome)
+
 async def handle_image_message(
     event: MessageEvent,
     state_manager: StateManager,
     gdrive_service: GoogleDriveService,
     channel_access_token: str,
-    parent_folder_id: Optional[str]
+    parent_folder_id: Optional[str],
+    near_duplicate_detector: Optional[NearDuplicateDetector] = None,
+    image_transformer: Optional[ImageTransformer] = None,
+    media_budget: Optional[MediaMemoryBudget] = None,
+    image_set_batcher: Optional[ImageSetBatcher] = None,
+    confirmation_aggregator: Optional[ConfirmationAggregator] = None,
+    upload_ledger: Optional[UploadLedger] = None,
 ) -> None:
     """
     Handles all logic for incoming image message events.
+
+    If a near-duplicate detector is given, images that nearly duplicate a
+    recent image of the same group are either skipped or uploaded with
+    `near_duplicate_of` app properties, depending on the detector's action.
+    If an image transformer is given, the image is resized and re-encoded
+    before upload. The file extension and MIME type always follow the real
+    image format. If a media budget is given, the image is streamed into a
+    budgeted buffer that may spill to disk, and uploaded from that buffer.
+    If an image set batcher is given, photos sent together as an image set
+    share one session lookup and folder resolution, and the set is
+    summarised once its last photo has been handled. If a confirmation
+    aggregator is given, the outcome is added to the user's next summary
+    message. If an upload ledger is given, every upload is recorded in it.
     """
     if not event.source or not event.source.user_id:
         return
 
+    image_set = getattr(event.message, "image_set", None)
+    if image_set_batcher and image_set and image_set.id and image_set.total:
+        await _handle_image_set_member(
+            event, image_set_batcher, state_manager, gdrive_service, channel_access_token,
+            parent_folder_id, near_duplicate_detector, image_transformer, media_budget,
+            confirmation_aggregator, upload_ledger
+        )
+        return
+
     user_id: str = event.source.user_id
-    active_group: Optional[str] = state_manager.get_active_group(user_id)
+    # Sessions may be kept in Redis, so the lookup runs in a thread like the other blocking calls.
+    active_group: Optional[str] = await asyncio.to_thread(state_manager.get_active_group, user_id)
     
     if active_group:
-        logger.info(f"Image received from user {user_id} with active session for group '{active_group}'.")
-        
-        image_content: Optional[bytes] = await download_image_content(event.message.id, channel_access_token)
-        
-        if image_content:            
-            group_folder_id: str = gdrive_service.find_or_create_folder(active_group, parent_folder_id=parent_folder_id)
-            today_str: str = datetime.now().strftime("%Y-%m-%d")
-            daily_folder_id: str = gdrive_service.find_or_create_folder(today_str, parent_folder_id=group_folder_id)
-
-            file_name: str = f"{event.message.id}.jpg"
-            gdrive_service.upload_file(file_name, image_content, daily_folder_id)
-            
+        logger.info("Image received from user %s with active session for group '%s'.", user_id, active_group)
+        outcome: str = FAILED
+        try:
+            outcome = await _download_and_upload(
+                event, active_group, gdrive_service, channel_access_token, parent_folder_id,
+                near_duplicate_detector, image_transformer, media_budget,
+                upload_ledger=upload_ledger
+            )
+        finally:
+            _confirm(confirmation_aggregator, event, active_group, outcome)
     else:
-        logger.warning(f"Image received from user {user_id} but they have no active session. Ignoring.")
\ No newline at end of file
+        logger.warning(
+            "Image received but the user has no active session. Ignoring.",
+            extra={"message_id": event.message.id, "user_id": user_id},
+        )
\ No newline at end of file
@@ -0,0 +1,480 @@
+"""
+Handles video and file messages by streaming them into Google Drive.
+
+Videos and documents can be far larger than photos, so their content is
+never held in memory as a whole. It is streamed from LINE in small pieces
+and forwarded in fixed-size chunks to a Drive resumable upload session. The
+session URI is persisted, so an interrupted upload (a dropped connection, a
+redelivered event, a restart) resumes from the last byte Drive confirmed
+instead of starting again. With a StorageBackend other than Drive, the
+content is streamed into a temporary file and stored from there.
+"""
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import tempfile
+from typing import Optional, Dict, Any, AsyncIterator, Tuple
+
+import aiohttp
+import requests
+
+from linebot.v3.webhooks import MessageEvent, VideoMessageContent, FileMessageContent
+from src.state_manager import StateManager
+from src.google_drive_uploader import GoogleDriveService
+from src.upload_index import IndexedUpload
+from src.storage_backends import StorageBackend
+from src.confirmation_aggregator import ConfirmationAggregator
+from src.handlers.image_message_handler import resolve_daily_folder
+from src.upload_ledger import UploadLedger, event_latency_ms
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+# Drive requires every chunk but the last to be a multiple of 256 KiB.
+RESUMABLE_CHUNK_SIZE: int = 32 * 256 * 1024
+TRANSCODING_POLL_INTERVAL_SECONDS: float = 2.0
+TRANSCODING_TIMEOUT_SECONDS: float = 300.0
+
+
+async def wait_for_content_ready(
+    session: aiohttp.ClientSession,
+    message_id: str,
+    channel_access_token: str,
+    timeout: float = TRANSCODING_TIMEOUT_SECONDS,
+    interval: float = TRANSCODING_POLL_INTERVAL_SECONDS,
+) -> bool:
+    """Polls LINE's transcoding-status endpoint until the content can be downloaded.
+
+    Videos are transcoded by LINE after they are sent; downloading before
+    the status is "succeeded" fails. The polling interval doubles up to 15
+    seconds between attempts.
+
+    Returns:
+        True once the content is ready, False if transcoding failed or did
+        not finish within the timeout.
+    """
+    headers: Dict[str, str] = {"Authorization": f"Bearer {channel_access_token}"}
+    status_url: str = f"https://api-data.line.me/v2/bot/message/{message_id}/content/transcoding"
+    loop = asyncio.get_running_loop()
+    deadline: float = loop.time() + timeout
+    delay: float = interval
+
+    while True:
+        async with session.get(status_url, headers=headers) as resp:
+            if resp.status != 200:
+                response_text: str = await resp.text()
+                logger.error(
+                    "❌ Failed to check transcoding status. Status: %s, Response: %.500s", resp.status, response_text,
+                    extra={"message_id": message_id},
+                )
+                return False
+            status: Optional[str] = (await resp.json()).get("status")
+
+        if status == "succeeded":
+            return True
+        if status == "failed":
+            logger.error("❌ LINE could not transcode the content.", extra={"message_id": message_id})
+            return False
+        if loop.time() + delay > deadline:
+            logger.error(
+                "❌ Content was not ready after %.0f seconds.", timeout, extra={"message_id": message_id}
+            )
+            return False
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 15.0)
+
+
+async def _skip_bytes(chunks: AsyncIterator[bytes], count: int) -> AsyncIterator[bytes]:
+    """Drops the first count bytes of a chunk stream."""
+    async for chunk in chunks:
+        if count >= len(chunk):
+            count -= len(chunk)
+            continue
+        yield chunk[count:]
+        count = 0
+
+
+async def _hash_chunks(chunks: AsyncIterator[bytes], digest: Any) -> AsyncIterator[bytes]:
+    """Updates digest with every chunk as it streams past."""
+    async for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+async def upload_chunks_resumable(
+    gdrive_service: GoogleDriveService,
+    session_uri: str,
+    chunks: AsyncIterator[bytes],
+    offset: int = 0,
+    total_size: Optional[int] = None,
+    chunk_size: int = RESUMABLE_CHUNK_SIZE,
+) -> Dict[str, Any]:
+    """Forwards a stream of bytes to a resumable session in fixed-size chunks.
+
+    At most one chunk is buffered, so memory use does not depend on the size
+    of the file. Drive calls run in a thread to keep the event loop free.
+
+    Args:
+        gdrive_service: The service holding the authorized session.
+        session_uri: The resumable session to upload into.
+        chunks: The content, starting at offset.
+        offset: The byte offset Drive expects next.
+        total_size: The full content size, if known.
+        chunk_size: The chunk size; must be a multiple of 256 KiB.
+
+    Returns:
+        The created file resource.
+    """
+    pending = bytearray()
+    async for data in chunks:
+        pending += data
+        while len(pending) >= chunk_size:
+            piece: bytes = bytes(pending[:chunk_size])
+            del pending[:chunk_size]
+            result = await asyncio.to_thread(
+                gdrive_service.upload_resumable_chunk, session_uri, piece, offset, total_size
+            )
+            offset += len(piece)
+            if result:
+                return result
+
+    return await asyncio.to_thread(
+        gdrive_service.upload_resumable_chunk, session_uri, bytes(pending), offset, offset + len(pending)
+    )
+
+
+def _parse_total_size(resp: aiohttp.ClientResponse) -> Optional[int]:
+    """Reads the full content size from a 200 or 206 response."""
+    if resp.status == 206:
+        content_range: str = resp.headers.get("Content-Range", "")
+        total: str = content_range.rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    return resp.content_length
+
+
+async def stream_content_to_drive(
+    message_id: str,
+    channel_access_token: str,
+    gdrive_service: GoogleDriveService,
+    folder_id: str,
+    file_name: Optional[str] = None,
+    chunk_size: int = RESUMABLE_CHUNK_SIZE,
+) -> Optional[str]:
+    """Streams message content from LINE into a Drive resumable upload.
+
+    A previously interrupted session for the same message is resumed from
+    the offset Drive reports. If LINE honours the Range header only the
+    missing bytes are downloaded; otherwise the already-uploaded prefix is
+    read and discarded.
+
+    Args:
+        message_id: The LINE message ID whose content is uploaded.
+        channel_access_token: The access token for downloading content.
+        gdrive_service: The Google Drive service.
+        folder_id: The destination folder.
+        file_name: The file name in Drive; derived from the message ID and
+            the content's MIME type when None.
+        chunk_size: The resumable upload chunk size.
+
+    Returns:
+        The Drive file ID, or None if the content could not be uploaded.
+    """
+    upload_index = gdrive_service.upload_index
+    if upload_index:
+        existing: Optional[IndexedUpload] = upload_index.find_by_message_id(message_id)
+        if existing:
+            logger.info("Content of message %s already uploaded as file ID %s.", message_id, existing.file_id)
+            return existing.file_id
+
+    headers: Dict[str, str] = {"Authorization": f"Bearer {channel_access_token}"}
+    content_url: str = f"https://api-data.line.me/v2/bot/message/{message_id}/content"
+    session_uri: Optional[str] = upload_index.get_resumable_session(message_id) if upload_index else None
+
+    async with aiohttp.ClientSession() as session:
+        for attempt in range(3):
+            offset: int = 0
+            if session_uri:
+                offset, completed = await asyncio.to_thread(gdrive_service.query_resumable_upload, session_uri)
+                if completed:
+                    return await _finish_upload(gdrive_service, message_id, folder_id, completed, None)
+                if offset < 0:
+                    logger.warning("⚠️ Resumable session expired; starting over.", extra={"message_id": message_id})
+                    session_uri, offset = None, 0
+                else:
+                    logger.info("Resuming upload of message %s at byte %s.", message_id, offset)
+
+            request_headers: Dict[str, str] = dict(headers)
+            if offset:
+                request_headers["Range"] = f"bytes={offset}-"
+            digest = hashlib.sha256() if offset == 0 else None
+            try:
+                async with session.get(content_url, headers=request_headers) as resp:
+                    if resp.status not in (200, 206):
+                        response_text: str = await resp.text()
+                        logger.error(
+                            "❌ Failed to fetch content. Status: %s, Response: %.500s", resp.status, response_text,
+                            extra={"message_id": message_id},
+                        )
+                        return None
+                    total_size: Optional[int] = _parse_total_size(resp)
+                    mime_type: str = resp.content_type or "application/octet-stream"
+
+                    if session_uri is None:
+                        name: str = file_name or f"{message_id}{mimetypes.guess_extension(mime_type) or ''}"
+                        session_uri = await asyncio.to_thread(
+                            gdrive_service.start_resumable_upload, name, folder_id, mime_type,
+                            total_size, {"line_message_id": message_id},
+                        )
+                        if upload_index:
+                            upload_index.save_resumable_session(message_id, session_uri)
+
+                    chunks: AsyncIterator[bytes] = resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE)
+                    if offset and resp.status == 200:
+                        chunks = _skip_bytes(chunks, offset)
+                    if digest is not None:
+                        chunks = _hash_chunks(chunks, digest)
+                    result: Dict[str, Any] = await upload_chunks_resumable(
+                        gdrive_service, session_uri, chunks, offset, total_size, chunk_size
+                    )
+            except (aiohttp.ClientError, requests.RequestException, asyncio.TimeoutError) as e:
+                logger.warning(
+                    "⚠️ Attempt %s/3 to stream the content was interrupted: %s", attempt + 1, e,
+                    extra={"message_id": message_id},
+                )
+                if attempt < 2:
+                    await asyncio.sleep(1)
+                continue
+
+            return await _finish_upload(
+                gdrive_service, message_id, folder_id, result, digest.hexdigest() if digest else None
+            )
+
+    logger.error(
+        "❌ Failed to stream the content after 3 attempts; the session is kept for resumption.",
+        extra={"message_id": message_id},
+    )
+    return None
+
+
+async def stream_content_to_storage(
+    message_id: str,
+    channel_access_token: str,
+    storage_backend: StorageBackend,
+    folder_id: str,
+    file_name: Optional[str] = None,
+) -> Optional[Tuple[str, int]]:
+    """Streams message content from LINE into a temporary file and stores it in a backend.
+
+    Content of a message already in the backend's upload index is not
+    downloaded again.
+
+    Args:
+        message_id: The LINE message ID whose content is stored.
+        channel_access_token: The access token for downloading content.
+        storage_backend: The backend to store the content in.
+        folder_id: The destination folder.
+        file_name: The file name; derived from the message ID and the
+            content's MIME type when None.
+
+    Returns:
+        The stored file's ID and the number of bytes stored, or None if the
+        content could not be stored.
+    """
+    upload_index = storage_backend.upload_index
+    if upload_index:
+        existing: Optional[IndexedUpload] = upload_index.find_by_message_id(message_id)
+        if existing:
+            logger.info("Content of message %s already stored with ID: %s", message_id, existing.file_id)
+            return existing.file_id, existing.size
+
+    headers: Dict[str, str] = {"Authorization": f"Bearer {channel_access_token}"}
+    content_url: str = f"https://api-data.line.me/v2/bot/message/{message_id}/content"
+
+    async with aiohttp.ClientSession() as session:
+        for attempt in range(3):
+            with tempfile.TemporaryFile() as spool_file:
+                try:
+                    async with session.get(content_url, headers=headers) as resp:
+                        if resp.status != 200:
+                            response_text: str = await resp.text()
+                            logger.error(
+                                "❌ Failed to fetch content. Status: %s, Response: %.500s", resp.status, response_text,
+                                extra={"message_id": message_id},
+                            )
+                            return None
+                        mime_type: str = resp.content_type or "application/octet-stream"
+                        async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            spool_file.write(chunk)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning(
+                        "⚠️ Attempt %s/3 to download the content was interrupted: %s", attempt + 1, e,
+                        extra={"message_id": message_id},
+                    )
+                    if attempt < 2:
+                        await asyncio.sleep(1)
+                    continue
+
+                size: int = spool_file.tell()
+                spool_file.seek(0)
+                name: str = file_name or f"{message_id}{mimetypes.guess_extension(mime_type) or ''}"
+                file_id: str = await asyncio.to_thread(
+                    storage_backend.upload_file, name, spool_file, folder_id,
+                    message_id=message_id, mime_type=mime_type,
+                )
+                logger.info("Content of message %s stored with ID: %s (%s bytes)", message_id, file_id, size)
+                return file_id, size
+
+    logger.error("❌ Failed to download the content after 3 attempts.", extra={"message_id": message_id})
+    return None
+
+
+async def _finish_upload(
+    gdrive_service: GoogleDriveService,
+    message_id: str,
+    folder_id: str,
+    result: Dict[str, Any],
+    sha256: Optional[str],
+) -> str:
+    """Records a completed streamed upload and forgets its resumable session.
+
+    The SHA-256 is only known once the whole stream has passed, so it is
+    attached to the file's `appProperties` after the upload completes. An
+    upload resumed mid-way never saw its first bytes, so it has no SHA-256:
+    the file gets no `sha256` property and is indexed with an empty hash.
+    Such files are matched by message ID and by Drive's `md5Checksum` only.
+    """
+    file_id: str = result.get("id")
+    if sha256:
+        await asyncio.to_thread(gdrive_service.set_app_properties, file_id, {"sha256": sha256})
+    upload_index = gdrive_service.upload_index
+    if upload_index:
+        upload_index.clear_resumable_session(message_id)
+        upload_index.record(IndexedUpload(
+            message_id=message_id, sha256=sha256 or "", md5=result.get("md5Checksum") or "",
+            size=int(result.get("size") or 0), file_id=file_id, folder_id=folder_id, file_name=result.get("name") or "",
+        ))
+    logger.info("Content of message %s streamed to Drive with ID: %s", message_id, file_id)
+    return file_id
+
+
+async def _handle_media_message(
+    event: MessageEvent,
+    state_manager: StateManager,
+    gdrive_service: GoogleDriveService,
+    channel_access_token: str,
+    parent_folder_id: Optional[str],
+    file_name: Optional[str],
+    wait_for_transcoding: bool,
+    kind: str,
+    confirmation_aggregator: Optional[ConfirmationAggregator] = None,
+    upload_ledger: Optional[UploadLedger] = None,
+) -> None:
+    """Shared flow for video and file messages."""
+    if not event.source or not event.source.user_id:
+        return
+
+    user_id: str = event.source.user_id
+    active_group: Optional[str] = await asyncio.to_thread(state_manager.get_active_group, user_id)
+    if not active_group:
+        logger.warning(
+            "Media received but the user has no active session. Ignoring.",
+            extra={"message_id": event.message.id, "user_id": user_id},
+        )
+        return
+
+    logger.info("Media message %s received from user %s for group '%s'.", event.message.id, user_id, active_group)
+    file_id: Optional[str] = None
+    try:
+        if wait_for_transcoding:
+            with metrics.stage("transcoding_wait"):
+                async with aiohttp.ClientSession() as session:
+                    if not await wait_for_content_ready(session, event.message.id, channel_access_token):
+                        return
+
+        with metrics.stage("folder_resolution"):
+            # Folder lookups are blocking API calls; they run in a thread so other deliveries proceed.
+            daily_folder_id: str = await asyncio.to_thread(
+                resolve_daily_folder, gdrive_service, active_group, parent_folder_id
+            )
+
+        # Content is streamed from LINE into storage, so download and upload are one stage.
+        size: int = getattr(event.message, "file_size", None) or 0
+        with metrics.stage("stream_upload"):
+            if isinstance(gdrive_service, StorageBackend):
+                stored: Optional[Tuple[str, int]] = await stream_content_to_storage(
+                    event.message.id, channel_access_token, gdrive_service, daily_folder_id, file_name=file_name
+                )
+                if stored:
+                    file_id, size = stored
+            else:
+                file_id = await stream_content_to_drive(
+                    event.message.id, channel_access_token, gdrive_service, daily_folder_id, file_name=file_name
+                )
+                indexed: Optional[IndexedUpload] = (
+                    gdrive_service.upload_index.find_by_message_id(event.message.id)
+                    if file_id and upload_ledger and gdrive_service.upload_index else None
+                )
+                size = indexed.size if indexed else size
+        if file_id:
+            if upload_ledger:
+                upload_ledger.record(
+                    event.message.id, user_id, active_group, kind, size, file_id, event_latency_ms(event)
+                )
+            metrics.record_upload(kind, size, active_group)
+    finally:
+        if confirmation_aggregator:
+            confirmation_aggregator.record(
+                user_id, active_group, kind, reply_token=event.reply_token, success=file_id is not None
+            )
+
+
+async def handle_video_message(
+    event: MessageEvent,
+    state_manager: StateManager,
+    gdrive_service: GoogleDriveService,
+    channel_access_token: str,
+    parent_folder_id: Optional[str],
+    confirmation_aggregator: Optional[ConfirmationAggregator] = None,
+    upload_ledger: Optional[UploadLedger] = None,
+) -> None:
+    """
+    Handles incoming video messages.
+
+    Waits for LINE to finish transcoding, then streams the video to the
+    user's daily folder. Videos hosted by an external provider are ignored,
+    since LINE does not serve their content.
+    """
+    message: VideoMessageContent = event.message
+    if message.content_provider and message.content_provider.type != "line":
+        logger.warning(
+            "Video is hosted externally; it cannot be downloaded from LINE. Ignoring.",
+            extra={"message_id": message.id},
+        )
+        return
+    await _handle_media_message(
+        event, state_manager, gdrive_service, channel_access_token, parent_folder_id,
+        file_name=None, wait_for_transcoding=True, kind="video",
+        confirmation_aggregator=confirmation_aggregator, upload_ledger=upload_ledger,
+    )
+
+
+async def handle_file_message(
+    event: MessageEvent,
+    state_manager: StateManager,
+    gdrive_service: GoogleDriveService,
+    channel_access_token: str,
+    parent_folder_id: Optional[str],
+    confirmation_aggregator: Optional[ConfirmationAggregator] = None,
+    upload_ledger: Optional[UploadLedger] = None,
+) -> None:
+    """
+    Handles incoming file messages (e.g. PDFs), keeping the original file name.
+    """
+    message: FileMessageContent = event.message
+    await _handle_media_message(
+        event, state_manager, gdrive_service, channel_access_token, parent_folder_id,
+        file_name=message.file_name, wait_for_transcoding=False, kind="file",
+        confirmation_aggregator=confirmation_aggregator, upload_ledger=upload_ledger,
+    )
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from datetime import datetime
 from typing import Optional, Dict, Any, List
@@ -13,9 +14,78 @@ from src.state_manager import StateManager
 from src.config_manager import ConfigManager
 from src.google_drive_uploader import GoogleDriveService
 from src.command_parser import parse_command
+from src.confirmation_aggregator import ConfirmationAggregator
+from src.note_journal import NoteJournal, JournalNote
+from src.google_docs_notes import GoogleDocsNotesBackend
+from src.upload_ledger import UploadLedger, event_latency_ms
+from src import metrics
 
 logger = logging.getLogger(__name__)
 CONFIG_FILE: str = "config.json"
+SEARCH_RESULT_LIMIT: int = 5
+SEARCH_SNIPPET_LENGTH: int = 120
+
+def _append_note_to_drive(
+    note: str, group_name: str, gdrive_service: GoogleDriveService, notes_backend: Any,
+    parent_folder_id: Optional[str]
+) -> None:
+    """Appends a note to the group's daily log in Drive. Blocking; runs in a worker thread."""
+    today_str: str = datetime.now().strftime("%Y-%m-%d")
+    group_folder_id: str = gdrive_service.find_or_create_folder(group_name, parent_folder_id)
+    daily_folder_id: str = gdrive_service.find_or_create_folder(today_str, parent_folder_id=group_folder_id)
+    notes_backend.append_text_to_file(f"{today_str}_notes.txt", note, daily_folder_id)
+
+def _search_notes(
+    query: str, user_id: str, state_manager: Optional[StateManager], note_journal: Optional[NoteJournal]
+) -> str:
+    """Searches the notes of the user's active group and formats the top matches."""
+    if note_journal is None:
+        return "Note search is not enabled."
+    active_group: Optional[str] = state_manager.get_active_group(user_id) if state_manager else None
+    if not active_group:
+        return "Send your site code first to search that site's notes."
+
+    notes: List[JournalNote] = note_journal.search(active_group, query, limit=SEARCH_RESULT_LIMIT)
+    logger.info("User %s searched notes of '%s' for '%s': %s match(es).", user_id, active_group, query, len(notes))
+    if not notes:
+        return f"No notes in {active_group} match '{query}'."
+
+    lines: List[str] = [f"Notes in {active_group} matching '{query}':"]
+    for note in notes:
+        text: str = note.text if len(note.text) <= SEARCH_SNIPPET_LENGTH else note.text[:SEARCH_SNIPPET_LENGTH] + "…"
+        lines.append(f"[{datetime.fromtimestamp(note.created_at).strftime('%Y-%m-%d %H:%M')}] {text}")
+    return "\n".join(lines)
+
+def _format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def _format_stats(
+    group: str, user_id: str, state_manager: Optional[StateManager], upload_ledger: Optional[UploadLedger]
+) -> str:
+    """Formats today's ledger rollups for one group, or for every group."""
+    if upload_ledger is None:
+        return "Upload statistics are not enabled."
+    if not group and state_manager:
+        group = state_manager.get_active_group(user_id) or ""
+
+    stats: Dict[str, Any] = upload_ledger.stats(group_name=group or None)
+    logger.info("User %s requested statistics for '%s'.", user_id, group or 'all groups')
+    if not stats["groups"]:
+        return f"No uploads recorded for {group or 'any group'} on {stats['date']}."
+
+    lines: List[str] = [f"📊 {stats['date']}"]
+    for group_name, kinds in sorted(stats["groups"].items()):
+        lines.append(f"{group_name}:")
+        for kind, rollup in sorted(kinds.items()):
+            lines.append(
+                f"  {kind}: {rollup['count']} ({_format_bytes(rollup['bytes'])}), "
+                f"avg {rollup['avg_latency_ms'] / 1000:.1f}s"
+            )
+    return "\n".join(lines)
 
 async def _handle_command(
     command: Dict[str, str],
@@ -23,8 +93,11 @@ async def _handle_command(
     config_manager: ConfigManager,
     line_bot_api: AsyncMessagingApi,
     event: MessageEvent,
+    state_manager: Optional[StateManager] = None,
+    note_journal: Optional[NoteJournal] = None,
+    upload_ledger: Optional[UploadLedger] = None,
 ) -> None:
-    """Handles administrative commands."""
+    """Handles administrative, search and statistics commands."""
     action: Optional[str] = command.get("action")
     reply_text: str = ""
 
@@ -36,38 +109,40 @@ async def _handle_command(
             header: str = "รายชื่อไซต์ก่อสร้าง:\n"
             lines: List[str] = [f"{code}  {group}" for code, group in all_codes.items()]
             reply_text = header + "\n".join(lines)
-        logger.info(f"User {user_id} listed all codes.")
+        logger.info("User %s listed all codes.", user_id)
+
+    elif action == "search":
+        reply_text = await asyncio.to_thread(_search_notes, command["query"], user_id, state_manager, note_journal)
+
+    elif action == "stats":
+        reply_text = await asyncio.to_thread(_format_stats, command["group"], user_id, state_manager, upload_ledger)
     
     elif action in ["add", "remove"]:
         if not config_manager.is_admin(user_id):
             reply_text = "Error: You do not have permission to use this command."
-            logger.warning(
-                f"Non-admin user {user_id} attempted to use command '{action}'."
-            )
+            logger.warning("Non-admin user attempted to use command '%s'.", action, extra={"user_id": user_id})
         elif action == "add":
             code: str = command["code"]
             group: str = command["group"]
             config_manager.add_secret_code(code, group)
             config_manager.save_config(CONFIG_FILE)
             reply_text = f"Success: Code {code} has been added for group {group}."
-            logger.info(f"Admin {user_id} added code {code} for group {group}.")
+            logger.info("Admin %s added code %s for group %s.", user_id, code, group)
         elif action == "remove":
             code = command["code"]
             was_removed: bool = config_manager.remove_secret_code(code)
             if was_removed:
                 config_manager.save_config(CONFIG_FILE)
                 reply_text = f"Success: Code {code} has been removed."
-                logger.info(f"Admin {user_id} removed code {code}.")
+                logger.info("Admin %s removed code %s.", user_id, code)
             else:
                 reply_text = (
                     f"Error: Code {code} was not found and could not be removed."
                 )
-                logger.warning(
-                    f"Admin {user_id} tried to remove non-existent code {code}."
-                )
+                logger.warning("Admin tried to remove non-existent code %s.", code, extra={"user_id": user_id})
     else:
         reply_text = "Error: Unknown command."
-        logger.error(f"Unknown command action '{action}' from user {user_id}.")
+        logger.error("Unknown command action '%s'.", action, extra={"user_id": user_id})
 
     await line_bot_api.reply_message(
         ReplyMessageRequest(
@@ -82,6 +157,10 @@ async def handle_text_message(
     gdrive_service: GoogleDriveService,
     line_bot_api: AsyncMessagingApi,
     parent_folder_id: Optional[str],
+    confirmation_aggregator: Optional[ConfirmationAggregator] = None,
+    note_journal: Optional[NoteJournal] = None,
+    notes_backend: Optional[GoogleDocsNotesBackend] = None,
+    upload_ledger: Optional[UploadLedger] = None,
 ) -> None:
     """Orchestrates responses to incoming text messages.
 
@@ -98,16 +177,28 @@ code)
         gdrive_service: The service for interacting with Google Drive.
         line_bot_api: The LINE Messaging API client.
         parent_folder_id: The ID of the root folder in Google Drive, if configured.
+        confirmation_aggregator: If given, saved notes are confirmed to the
+            user in a coalesced summary message.
+        note_journal: If given, notes are written to this local journal and
+            exported to Drive in the background instead of being appended to
+            the Drive file directly. It also answers `? <terms>` searches.
+        notes_backend: If given, notes are appended in place to the daily
+            Google Doc instead of the daily text file.
+        upload_ledger: If given, saved notes are recorded in this ledger, and
+            it answers `!stats [group]`.
     """
     if not event.source or not event.source.user_id:
         return
 
     user_id: str = event.source.user_id
     text: str = event.message.text
-    command: Optional[Dict[str, str]] = parse_command(text)
+    command: Optional[Dict[str, str]] = parse_command(text, search_enabled=note_journal is not None)
 
     if command:
-        await _handle_command(command, user_id, config_manager, line_bot_api, event)
+        await _handle_command(
+            command, user_id, config_manager, line_bot_api, event,
+            state_manager=state_manager, note_journal=note_journal, upload_ledger=upload_ledger
+        )
         return
 
     note_to_save: Optional[str] = None
@@ -127,7 +218,7 @@ code)
     # If a definitive matching code was found, process it.
     if matching_code:
         group_from_code = all_codes[matching_code]
-        state_manager.set_pending_upload(user_id, group_from_code)
+        await asyncio.to_thread(state_manager.set_pending_upload, user_id, group_from_code)
         active_group = group_from_code
 
         # Extract the note, stripping the code and any leading space.
@@ -135,31 +226,38 @@ code)
         if note:
             note_to_save = note
 
-        logger.info(
-            f"Session started/refreshed for user {user_id} to group '{active_group}'."
-        )
+        logger.info("Session started/refreshed for user %s to group '%s'.", user_id, active_group)
     # --- END: NEW & CORRECTED LOGIC ---
 
     # If no secret code was found in the message, check if there's an active session.
     # This block remains NECESSARY for subsequent notes.
     if not active_group:
-        active_group = state_manager.get_active_group(user_id)
+        active_group = await asyncio.to_thread(state_manager.get_active_group, user_id)
         if active_group:
             note_to_save = text
 
     # If there's an active group and a note to save, proceed to upload.
     if active_group and note_to_save:
-        logger.info(f"Saving note for user {user_id} in group '{active_group}'.")
-        today_str: str = datetime.now().strftime("%Y-%m-%d")
-        daily_log_filename: str = f"{today_str}_notes.txt"
-
-        group_folder_id: str = gdrive_service.find_or_create_folder(
-            active_group, parent_folder_id
-        )
-        daily_folder_id: str = gdrive_service.find_or_create_folder(
-            today_str, parent_folder_id=group_folder_id
-        )
-
-        gdrive_service.append_text_to_file(
-            daily_log_filename, note_to_save, daily_folder_id
-        )
\ No newline at end of file
+        logger.info("Saving note for user %s in group '%s'.", user_id, active_group)
+        saved: bool = False
+        try:
+            with metrics.stage("note_append"):
+                if note_journal:
+                    note_journal.append(active_group, user_id, note_to_save, message_id=event.message.id)
+                else:
+                    await asyncio.to_thread(
+                        _append_note_to_drive, note_to_save, active_group,
+                        gdrive_service, notes_backend or gdrive_service, parent_folder_id
+                    )
+            saved = True
+            metrics.record_upload("note", len(note_to_save.encode("utf-8")), active_group)
+            if upload_ledger:
+                upload_ledger.record(
+                    event.message.id, user_id, active_group, "note",
+                    len(note_to_save.encode("utf-8")), None, event_latency_ms(event)
+                )
+        finally:
+            if confirmation_aggregator:
+                confirmation_aggregator.record(
+                    user_id, active_group, "note", reply_token=event.reply_token, success=saved
+                )
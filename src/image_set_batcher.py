@@ -0,0 +1,153 @@
+"""
+Groups the photos of a LINE image set (album) into one batch.
+
+When a user sends several photos at once, LINE delivers one event per photo.
+The events share an image set ID and carry the photo's index and the set's
+total. An ImageSetBatcher collects those events so the session lookup and
+the destination folder are resolved once per set. It also bounds how many
+photos of a set are downloaded and processed at the same time, and logs a
+single summary once the last photo of the set has been handled.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+UPLOADED: str = "uploaded"
+SKIPPED: str = "skipped"
+FAILED: str = "failed"
+
+
+@dataclass(frozen=True)
+class ImageSetSummary:
+    """The outcome of all photos of one image set."""
+    set_id: str
+    total: int
+    uploaded: int
+    skipped: int
+    failed: int
+    elapsed_seconds: float
+    complete: bool
+
+
+class ImageSetBatch:
+    """The state shared by the photos of one image set while they are processed.
+
+    Attributes:
+        set_id: The LINE image set ID.
+        total: The number of photos in the set.
+        slots: Bounds how many photos of the set are processed concurrently.
+    """
+    def __init__(self, set_id: str, total: int, fan_out: int) -> None:
+        self.set_id: str = set_id
+        self.total: int = total
+        self.slots = asyncio.Semaphore(fan_out)
+        self.started_at: float = time.monotonic()
+        self.last_seen: float = self.started_at
+        self._destination: Optional[asyncio.Future] = None
+        self._outcomes: Dict[str, int] = {UPLOADED: 0, SKIPPED: 0, FAILED: 0}
+
+    async def destination(self, resolve: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the set's destination, calling resolve only for the first photo.
+
+        Photos that arrive while the first one is still resolving wait for
+        its result instead of resolving again. If resolving fails, the next
+        photo tries again.
+        """
+        if self._destination is None:
+            self._destination = asyncio.ensure_future(resolve())
+        future: asyncio.Future = self._destination
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            if self._destination is future:
+                self._destination = None
+            raise
+
+    @property
+    def handled(self) -> int:
+        """The number of photos of the set that have been handled so far."""
+        return sum(self._outcomes.values())
+
+    def record(self, outcome: str) -> None:
+        """Counts the outcome of one photo of the set."""
+        self._outcomes[outcome] += 1
+        self.last_seen = time.monotonic()
+
+    def summary(self) -> ImageSetSummary:
+        """Summarises the outcomes recorded so far."""
+        return ImageSetSummary(
+            set_id=self.set_id,
+            total=self.total,
+            uploaded=self._outcomes[UPLOADED],
+            skipped=self._outcomes[SKIPPED],
+            failed=self._outcomes[FAILED],
+            elapsed_seconds=time.monotonic() - self.started_at,
+            complete=self.handled >= self.total,
+        )
+
+
+class ImageSetBatcher:
+    """Tracks the image sets currently being received.
+
+    Attributes:
+        fan_out: How many photos of one set are processed at the same time.
+        name_by_index: If True, photos of a set are named after the set ID
+            and their index in the set instead of their message ID.
+        max_age_seconds: Sets that have not seen a photo for this long are
+            summarised as incomplete and dropped.
+    """
+    def __init__(self, fan_out: int = 4, name_by_index: bool = False, max_age_seconds: float = 600.0) -> None:
+        self.fan_out: int = fan_out
+        self.name_by_index: bool = name_by_index
+        self.max_age_seconds: float = max_age_seconds
+        self._batches: Dict[str, ImageSetBatch] = {}
+
+    def _expire(self) -> None:
+        now: float = time.monotonic()
+        for set_id, batch in list(self._batches.items()):
+            if now - batch.last_seen > self.max_age_seconds:
+                del self._batches[set_id]
+                self._log_summary(batch.summary())
+
+    def batch_for(self, set_id: str, total: int) -> ImageSetBatch:
+        """Returns the batch of an image set, starting a new one for its first photo."""
+        self._expire()
+        batch: Optional[ImageSetBatch] = self._batches.get(set_id)
+        if batch is None:
+            batch = ImageSetBatch(set_id, total, self.fan_out)
+            self._batches[set_id] = batch
+        return batch
+
+    def stats(self) -> Dict[str, int]:
+        """Reports how many image sets are still open."""
+        return {"open_sets": len(self._batches)}
+
+    def file_stem(self, set_id: str, index: int, total: int) -> str:
+        """Returns the file name (without extension) of a photo named by its set index."""
+        return f"{set_id}_{index:0{len(str(total))}d}"
+
+    def complete(self, batch: ImageSetBatch, outcome: str) -> Optional[ImageSetSummary]:
+        """Records the outcome of one photo and finishes the set after its last photo.
+
+        Returns:
+            The set's summary if this was its last photo, otherwise None.
+        """
+        batch.record(outcome)
+        if batch.handled < batch.total:
+            return None
+        self._batches.pop(batch.set_id, None)
+        summary: ImageSetSummary = batch.summary()
+        self._log_summary(summary)
+        return summary
+
+    @staticmethod
+    def _log_summary(summary: ImageSetSummary) -> None:
+        state: str = "completed" if summary.complete else "expired incomplete"
+        logger.info(
+            "📚 Image set %s %s: %s uploaded, %s skipped, %s failed of %s in %.1fs.",
+            summary.set_id, state, summary.uploaded, summary.skipped, summary.failed, summary.total, summary.elapsed_seconds,
+        )
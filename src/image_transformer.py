@@ -0,0 +1,231 @@
+"""
+Recompresses and resizes photos before they are uploaded.
+
+LINE returns photos at whatever size the phone sent, and for archival
+purposes a bounded dimension and quality often halves the bytes we upload.
+This module detects the real image format from its magic bytes and, when
+enabled, re-encodes the image in a process pool so decoding and encoding
+never block the event loop. The original is kept whenever the transform
+would not save a configurable minimum.
+"""
+import asyncio
+import importlib.util
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Dict, Tuple, Union
+
+# Pillow is optional; the transformer is disabled without it. It is imported where images are
+# decoded, in the worker processes, so importing this module does not load it.
+PILLOW_AVAILABLE: bool = importlib.util.find_spec("PIL") is not None
+
+from src.shared_memory_executor import CpuExecutor, SharedMemoryResult, run_cpu_stage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ImageFormat:
+    """The detected format of an encoded image."""
+    name: str
+    mime_type: str
+    extension: str
+
+
+JPEG = ImageFormat("JPEG", "image/jpeg", "jpg")
+PNG = ImageFormat("PNG", "image/png", "png")
+GIF = ImageFormat("GIF", "image/gif", "gif")
+WEBP = ImageFormat("WEBP", "image/webp", "webp")
+HEIC = ImageFormat("HEIC", "image/heic", "heic")
+TIFF = ImageFormat("TIFF", "image/tiff", "tif")
+BMP = ImageFormat("BMP", "image/bmp", "bmp")
+
+# LINE serves photos as JPEG unless told otherwise, so it is the fallback.
+DEFAULT_FORMAT: ImageFormat = JPEG
+
+_HEIF_BRANDS: Tuple[bytes, ...] = (b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1")
+
+
+def detect_image_format(content: bytes) -> Optional[ImageFormat]:
+    """Identifies an image format from the first bytes of its content.
+
+    Args:
+        content: The encoded image bytes.
+
+    Returns:
+        The detected ImageFormat, or None if the signature is not recognised.
+    """
+    header: bytes = bytes(content[:16])
+    if header.startswith(b"\xff\xd8\xff"):
+        return JPEG
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return PNG
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return GIF
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return WEBP
+    if header[4:8] == b"ftyp" and header[8:12] in _HEIF_BRANDS:
+        return HEIC
+    if header.startswith((b"II*\x00", b"MM\x00*")):
+        return TIFF
+    if header.startswith(b"BM"):
+        return BMP
+    return None
+
+
+def transform_image(content: bytes, max_dimension: int, quality: int, strip_metadata: bool) -> bytes:
+    """Resizes an image to fit max_dimension and re-encodes it as JPEG.
+
+    This runs in worker processes, so it must stay a module-level function.
+    Images with transparency are re-encoded as optimised PNG instead.
+
+    Args:
+        content: The encoded image bytes.
+        max_dimension: The largest allowed width or height in pixels.
+        quality: The JPEG quality (1-95).
+        strip_metadata: If True, EXIF data is dropped after the orientation
+            has been applied to the pixels.
+
+    Returns:
+        The re-encoded image bytes.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(content)) as image:
+        if image.format == "JPEG":
+            # Let the JPEG decoder downscale by a power of two while decoding.
+            image.draft("RGB", (max_dimension, max_dimension))
+        exif: Optional[bytes] = image.info.get("exif")
+        icc_profile: Optional[bytes] = image.info.get("icc_profile")
+
+        if strip_metadata:
+            image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        options: Dict[str, object] = {"optimize": True}
+        if icc_profile:
+            options["icc_profile"] = icc_profile
+        if exif and not strip_metadata:
+            options["exif"] = exif
+
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            image.save(output, format="PNG", **options)
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=quality, progressive=True, **options)
+        return output.getvalue()
+
+
+@dataclass(frozen=True)
+class TransformedImage:
+    """The result of passing an image through the transformer."""
+    content: bytes
+    image_format: ImageFormat
+    transformed: bool
+
+
+class ImageTransformer:
+    """Runs the optional resize/re-encode stage between download and upload.
+
+    At most `max_pending` images are queued for the worker pool at a time;
+    further callers wait, which keeps memory bounded during bursts.
+
+    Attributes:
+        max_dimension: The largest allowed width or height in pixels.
+        quality: The JPEG quality used for re-encoding.
+        strip_metadata: Whether EXIF metadata is removed.
+        min_savings: The minimum fraction of bytes a transform must save for
+            its output to replace the original.
+    """
+    def __init__(
+        self,
+        max_dimension: int = 2048,
+        quality: int = 85,
+        strip_metadata: bool = False,
+        min_savings: float = 0.1,
+        max_pending: int = 8,
+        executor: Optional[CpuExecutor] = None,
+        max_workers: Optional[int] = None,
+    ) -> None:
+        if not PILLOW_AVAILABLE:
+            raise RuntimeError("Pillow is required for image transformation.")
+        self.max_dimension: int = max_dimension
+        self.quality: int = quality
+        self.strip_metadata: bool = strip_metadata
+        self.min_savings: float = min_savings
+        self._pending = asyncio.Semaphore(max_pending)
+        self._executor: CpuExecutor = executor or ProcessPoolExecutor(max_workers=max_workers)
+        self._owns_executor: bool = executor is None
+
+        self._bytes_in: int = 0
+        self._bytes_out: int = 0
+        self._transformed: int = 0
+        self._kept_original: int = 0
+        self._failures: int = 0
+
+    def _keep_original(self, content: bytes, image_format: Optional[ImageFormat]) -> TransformedImage:
+        self._kept_original += 1
+        self._bytes_out += len(content)
+        return TransformedImage(content, image_format or DEFAULT_FORMAT, transformed=False)
+
+    async def transform(self, content: bytes) -> TransformedImage:
+        """Resizes and re-encodes an image if that saves enough bytes.
+
+        Unrecognised formats, images that fail to decode and transforms that
+        save less than `min_savings` all return the original content.
+
+        Args:
+            content: The downloaded image bytes.
+
+        Returns:
+            The content to upload together with its real format.
+        """
+        self._bytes_in += len(content)
+        image_format: Optional[ImageFormat] = detect_image_format(content)
+        if image_format is None or image_format in (GIF, HEIC):
+            # Unknown content, animations and formats Pillow cannot decode are left untouched.
+            return self._keep_original(content, image_format)
+
+        async with self._pending:
+            try:
+                result: Union[bytes, SharedMemoryResult] = await run_cpu_stage(
+                    self._executor, transform_image, content,
+                    self.max_dimension, self.quality, self.strip_metadata,
+                )
+            except Exception as e:
+                self._failures += 1
+                logger.warning("⚠️ Image transform failed, uploading original: %s", e)
+                return self._keep_original(content, image_format)
+
+        if isinstance(result, SharedMemoryResult):
+            # Check the savings on the shared view first; only an accepted result is copied out.
+            # The copy frees the slot before the (much slower) Drive upload instead of holding
+            # it for the upload's duration, which would stall the other CPU stages.
+            with result:
+                if len(result) > len(content) * (1.0 - self.min_savings):
+                    return self._keep_original(content, image_format)
+                result = result.tobytes()
+        elif len(result) > len(content) * (1.0 - self.min_savings):
+            return self._keep_original(content, image_format)
+
+        self._transformed += 1
+        self._bytes_out += len(result)
+        logger.debug("Transformed image from %s to %s bytes.", len(content), len(result))
+        return TransformedImage(result, detect_image_format(result) or JPEG, transformed=True)
+
+    def stats(self) -> Dict[str, float]:
+        """Reports how many images were transformed and the bytes saved."""
+        return {
+            "transformed": self._transformed,
+            "kept_original": self._kept_original,
+            "failures": self._failures,
+            "bytes_in": self._bytes_in,
+            "bytes_out": self._bytes_out,
+            "savings_ratio": 1.0 - self._bytes_out / self._bytes_in if self._bytes_in else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        """Shuts down the worker pool if this transformer created it."""
+        if self._owns_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
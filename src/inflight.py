@@ -0,0 +1,165 @@
+"""
+Tracks the webhook deliveries being handled, so a shutdown can wait for them.
+
+Each delivery's events are handled in a task of their own. On shutdown the
+tracker stops taking new deliveries, gives the running ones until a deadline
+to finish, and cancels whatever is still running after that. The media
+events of the cancelled deliveries that did not make it into the ledger are
+put in the upload spool with reason "shutdown", so the SpoolDrainer uploads
+them after the next start. A Drive upload cut off mid-way keeps its
+resumable session in the upload index, so the retry resumes it.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional, Dict, List, Any, Coroutine
+
+from linebot.v3.webhooks import (
+    Event, MessageEvent, ImageMessageContent, VideoMessageContent, FileMessageContent
+)
+
+from src.state_manager import StateManager
+from src.upload_ledger import UploadLedger
+from src.upload_spool import UploadSpool, SpooledUpload
+
+logger = logging.getLogger(__name__)
+
+MEDIA_KINDS = (
+    (ImageMessageContent, "photo"),
+    (VideoMessageContent, "video"),
+    (FileMessageContent, "file"),
+)
+
+
+def _media_kind(event: Event) -> Optional[str]:
+    if not isinstance(event, MessageEvent):
+        return None
+    for content_type, kind in MEDIA_KINDS:
+        if isinstance(event.message, content_type):
+            return kind
+    return None
+
+
+class InFlightTracker:
+    """The webhook deliveries currently being handled.
+
+    Attributes:
+        closing: Set once shutdown has begun; no new deliveries are accepted.
+    """
+    def __init__(self) -> None:
+        self.closing: bool = False
+        self._tasks: Dict[asyncio.Task, List[Event]] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def stats(self) -> Dict[str, int]:
+        """Reports the deliveries being handled."""
+        return {"deliveries": len(self._tasks)}
+
+    def spawn(self, handling: Coroutine[Any, Any, None], events: List[Event]) -> asyncio.Task:
+        """Handles a delivery in a tracked task.
+
+        Args:
+            handling: The coroutine that handles the delivery's events.
+            events: The delivery's events, handed to the spool if shutdown cuts it off.
+        """
+        if self.closing:
+            handling.close()
+            raise RuntimeError("The service is shutting down.")
+        task: asyncio.Task = asyncio.create_task(handling)
+        self._tasks[task] = events
+        task.add_done_callback(self._forget)
+        return task
+
+    def _forget(self, task: asyncio.Task) -> None:
+        self._tasks.pop(task, None)
+        if not task.cancelled() and task.exception():
+            logger.error("❌ Handling a webhook delivery failed: %s", task.exception())
+
+    async def drain(self, timeout: float) -> List[Event]:
+        """Stops accepting deliveries and waits up to timeout seconds for the running ones.
+
+        Returns:
+            The events of the deliveries that were cancelled at the deadline.
+        """
+        self.closing = True
+        pending: Dict[asyncio.Task, List[Event]] = dict(self._tasks)
+        if not pending:
+            return []
+        _, unfinished = await asyncio.wait(pending, timeout=timeout)
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+        return [event for task in unfinished for event in pending[task]]
+
+
+def spool_unfinished(
+    events: List[Event],
+    state_manager: StateManager,
+    spool: UploadSpool,
+    upload_ledger: Optional[UploadLedger] = None,
+) -> int:
+    """Queues the media of events whose handling was cut off for upload after the next start.
+
+    Text messages are left out; they cannot be fetched from LINE again.
+
+    Args:
+        events: The events of the cancelled deliveries.
+        state_manager: The manager for user sessions, which gives each item its group.
+        spool: The spool the items are added to.
+        upload_ledger: If given, items already in the ledger are skipped.
+
+    Returns:
+        The number of items added to the spool.
+    """
+    today_str: str = datetime.now().strftime("%Y-%m-%d")
+    handed_off: int = 0
+    for event in events:
+        kind: Optional[str] = _media_kind(event)
+        if not kind or not event.source or not event.source.user_id:
+            continue
+        message_id: str = event.message.id
+        if upload_ledger and upload_ledger.contains(message_id):
+            continue
+        group: Optional[str] = state_manager.get_active_group(event.source.user_id)
+        if not group:
+            continue
+        if spool.enqueue(SpooledUpload(
+            message_id=message_id, user_id=event.source.user_id, group_name=group, entry_date=today_str,
+            kind=kind, file_name=getattr(event.message, "file_name", None), reason="shutdown",
+        )):
+            handed_off += 1
+    return handed_off
+
+
+async def drain_on_shutdown(
+    tracker: InFlightTracker,
+    timeout: float,
+    state_manager: StateManager,
+    spool: UploadSpool,
+    upload_ledger: Optional[UploadLedger] = None,
+) -> Dict[str, Any]:
+    """Drains the in-flight deliveries and spools the media of those cut off.
+
+    Returns:
+        The drain's duration in seconds, the deliveries still running when
+        it began, and the number of items handed to the spool.
+    """
+    started: float = time.monotonic()
+    in_flight: int = len(tracker)
+    unfinished: List[Event] = await tracker.drain(timeout)
+    handed_off: int = (
+        await asyncio.to_thread(spool_unfinished, unfinished, state_manager, spool, upload_ledger) if unfinished else 0
+    )
+    result: Dict[str, Any] = {
+        "duration_seconds": round(time.monotonic() - started, 3),
+        "in_flight": in_flight,
+        "handed_off": handed_off,
+    }
+    logger.info(
+        "Drained %s in-flight deliveries in %ss; %s unfinished uploads handed to the spool.",
+        in_flight, result["duration_seconds"], handed_off,
+    )
+    return result
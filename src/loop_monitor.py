@@ -0,0 +1,107 @@
+"""
+Watches the event loop for lag and for blocking calls.
+
+The handlers mix async code with synchronous Drive, Docs and Redis calls.
+One of those called on the loop instead of through `asyncio.to_thread`
+stalls every delivery in the process.
+
+A watchdog thread schedules a no-op callback on the loop every `interval`
+seconds and times how long it takes to run. That time is the loop's lag,
+recorded in the `line_event_loop_lag_seconds` histogram. If the callback
+has not run after `block_threshold` seconds, the loop is blocked. The
+watchdog then logs, once per stall, a warning with the loop thread's
+current stack (the blocking call) and the IDs bound to the running task
+(message, user, trace; see `structured_logging.bind`). When the loop runs
+again, the length of the stall is added to the stats.
+
+The cost is one callback per interval on the loop and a mostly sleeping
+thread, so the monitor is on by default.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional, Dict, Any
+
+from src import metrics, structured_logging
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """Measures the event loop's lag and reports the stack of calls that block it.
+
+    Attributes:
+        interval: Seconds between two lag measurements.
+        block_threshold: A callback that waits longer than this means the loop is blocked.
+    """
+    def __init__(self, interval: float = 0.25, block_threshold: float = 0.5) -> None:
+        self.interval: float = interval
+        self.block_threshold: float = block_threshold
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_lag: float = 0.0
+        self._max_lag: float = 0.0
+        self._blocks: int = 0
+        self._longest_block: float = 0.0
+
+    def start(self) -> None:
+        """Starts watching the running loop; call it from the loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(self.interval):
+            answered = threading.Event()
+            sent: float = time.monotonic()
+            try:
+                self._loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:  # The loop was closed.
+                return
+            if not answered.wait(self.block_threshold):
+                self._report_block(time.monotonic() - sent)
+                while not answered.wait(0.1):
+                    if self._stopping.is_set():
+                        return
+                self._longest_block = max(self._longest_block, time.monotonic() - sent)
+            self._record_lag(time.monotonic() - sent)
+
+    def _record_lag(self, lag: float) -> None:
+        metrics.LOOP_LAG_SECONDS.observe(lag)
+        self._last_lag = lag
+        self._max_lag = max(self._max_lag, lag)
+
+    def _report_block(self, blocked: float) -> None:
+        self._blocks += 1
+        metrics.LOOP_BLOCKS.inc()
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack: str = "".join(traceback.format_stack(frame)) if frame else "(no stack)"
+        task = asyncio.current_task(self._loop)
+        fields: Dict[str, Any] = structured_logging.fields_of(task)
+        logger.warning(
+            "⚠️ Event loop blocked for over %.2fs in %s; current stack:\n%s",
+            blocked, task.get_name() if task else "a callback", stack,
+            extra={**fields, "blocked_seconds": round(blocked, 3)},
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Reports the latest and largest lag, and how often and how long the loop was blocked."""
+        return {
+            "lag_ms": round(self._last_lag * 1000, 3),
+            "max_lag_ms": round(self._max_lag * 1000, 3),
+            "blocks": self._blocks,
+            "longest_block_ms": round(self._longest_block * 1000, 3),
+        }
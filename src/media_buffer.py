@@ -0,0 +1,167 @@
+"""
+Memory-budgeted buffers for in-flight media content.
+
+Holding every downloaded file as `bytes` means a few concurrent large images
+(or videos) can push a small container out of memory. A MediaMemoryBudget
+caps the bytes that in-flight media may keep on the heap. A MediaBuffer
+keeps small content in memory while the budget allows, and spills to an
+anonymous temporary file when the item is above the per-item threshold or
+the budget is exhausted. Spilled content is exposed through `mmap`, so it
+can be hashed, transformed or uploaded without being read back into the heap.
+"""
+import contextlib
+import io
+import logging
+import mmap
+import tempfile
+import threading
+from typing import Optional, Dict, BinaryIO, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class MediaMemoryBudget:
+    """A process-wide budget for media bytes held in memory.
+
+    Attributes:
+        max_bytes: The total number of bytes in-flight media may keep in memory.
+        spill_threshold: Items larger than this always go to disk.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, spill_threshold: int = 8 * 1024 * 1024) -> None:
+        self.max_bytes: int = max_bytes
+        self.spill_threshold: int = spill_threshold
+        self._lock = threading.Lock()
+        self._in_use: int = 0
+        self._peak: int = 0
+        self._buffers: int = 0
+        self._spills: int = 0
+        self._spilled_bytes: int = 0
+
+    def try_reserve(self, size: int) -> bool:
+        """Reserves size bytes of the budget if they are available."""
+        with self._lock:
+            if self._in_use + size > self.max_bytes:
+                return False
+            self._in_use += size
+            self._peak = max(self._peak, self._in_use)
+            return True
+
+    def release(self, size: int) -> None:
+        """Returns previously reserved bytes to the budget."""
+        with self._lock:
+            self._in_use -= size
+
+    def _record_spill(self, size: int) -> None:
+        with self._lock:
+            self._spills += 1
+            self._spilled_bytes += size
+
+    def _track_buffer(self, delta: int) -> None:
+        with self._lock:
+            self._buffers += delta
+
+    def new_buffer(self, expected_size: Optional[int] = None) -> "MediaBuffer":
+        """Creates a buffer, spilling up front if the expected size is too large.
+
+        Args:
+            expected_size: The content size if known (e.g. from Content-Length).
+        """
+        spill: bool = expected_size is not None and expected_size > self.spill_threshold
+        return MediaBuffer(self, spill=spill)
+
+    def stats(self) -> Dict[str, int]:
+        """Reports current and peak budget use and how often media spilled to disk."""
+        with self._lock:
+            return {
+                "budget_bytes": self.max_bytes,
+                "in_use_bytes": self._in_use,
+                "peak_bytes": self._peak,
+                "buffers_in_flight": self._buffers,
+                "spills": self._spills,
+                "spilled_bytes": self._spilled_bytes,
+            }
+
+
+class MediaBuffer:
+    """Holds one item of downloaded media, in memory or in a temporary file.
+
+    Content is written with `write()`. Afterwards it can be read as a
+    memoryview with `view()` or as a file object with `stream()`. Always
+    `close()` the buffer (or use it as a context manager) so its share of
+    the budget is returned.
+    """
+    def __init__(self, budget: MediaMemoryBudget, spill: bool = False) -> None:
+        self._budget = budget
+        self._reserved: int = 0
+        self._file: BinaryIO = io.BytesIO()
+        self._spilled: bool = False
+        self.size: int = 0
+        budget._track_buffer(1)
+        if spill:
+            self._spill()
+
+    @property
+    def spilled(self) -> bool:
+        """Whether the content lives in a temporary file rather than memory."""
+        return self._spilled
+
+    def _spill(self) -> None:
+        disk_file: BinaryIO = tempfile.TemporaryFile()
+        if self.size:
+            disk_file.write(self._file.getbuffer())
+        self._file.close()
+        self._file = disk_file
+        self._spilled = True
+        self._budget.release(self._reserved)
+        self._reserved = 0
+        self._budget._record_spill(self.size)
+        logger.debug("Media buffer spilled to disk at %s bytes.", self.size)
+
+    def write(self, chunk: bytes) -> None:
+        """Appends a chunk, spilling to disk if memory can no longer hold it."""
+        if not self._spilled:
+            if self.size + len(chunk) > self._budget.spill_threshold or not self._budget.try_reserve(len(chunk)):
+                self._spill()
+            else:
+                self._reserved += len(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    @contextlib.contextmanager
+    def view(self) -> Iterator[memoryview]:
+        """Exposes the content as a memoryview without copying it.
+
+        In-memory content is viewed directly; spilled content is memory-mapped.
+        The view is only valid inside the `with` block.
+        """
+        if not self._spilled:
+            with self._file.getbuffer() as buffer:
+                yield buffer
+            return
+        if self.size == 0:
+            yield memoryview(b"")
+            return
+        self._file.flush()
+        with mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as buffer:
+                yield buffer
+
+    def stream(self) -> BinaryIO:
+        """Returns the underlying file object rewound to the start, for uploads."""
+        self._file.seek(0)
+        return self._file
+
+    def close(self) -> None:
+        """Releases the buffer's memory or temporary file. Safe to call twice."""
+        if self._file.closed:
+            return
+        self._file.close()
+        self._budget.release(self._reserved)
+        self._reserved = 0
+        self._budget._track_buffer(-1)
+
+    def __enter__(self) -> "MediaBuffer":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
@@ -0,0 +1,130 @@
+"""
+Named tracemalloc snapshots of the running process, for finding leaks.
+
+tracemalloc is off until `start()` is called (through
+`POST /debug/memory/start`). Until then it costs nothing. While it is on,
+every allocation records its traceback, which slows allocation-heavy code
+such as image handling by up to 2x and takes memory of its own.
+`stop()` turns it off again and drops the snapshots.
+
+A leak hunt starts tracing and takes a snapshot. It lets traffic run, takes
+another and compares the two with `diff()`. The diff lists the source
+lines (or files) whose live allocations grew the most. Snapshots leave out
+allocations made by tracemalloc itself and by the import machinery. The
+most recent MAX_SNAPSHOTS are kept.
+"""
+import threading
+import tracemalloc
+from collections import OrderedDict
+from typing import Optional, Dict, List, Any
+
+MAX_SNAPSHOTS: int = 10
+
+_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def _location(traceback: tracemalloc.Traceback, group_by: str) -> Any:
+    if group_by == "traceback":
+        return [str(frame) for frame in traceback]
+    if group_by == "filename":
+        return traceback[0].filename
+    return str(traceback[0])
+
+
+class MemorySnapshots:
+    """Starts and stops tracemalloc and keeps named snapshots to compare."""
+    def __init__(self) -> None:
+        self._snapshots: "OrderedDict[str, tracemalloc.Snapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1) -> None:
+        """Starts tracing allocations, keeping `frames` frames of each traceback."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self) -> None:
+        """Stops tracing and drops the snapshots, freeing the memory both use."""
+        tracemalloc.stop()
+        with self._lock:
+            self._snapshots.clear()
+
+    def take(self, name: str) -> Dict[str, Any]:
+        """Takes a snapshot under the given name, replacing one of the same name.
+
+        Raises:
+            RuntimeError: tracemalloc is not tracing.
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("Memory tracing is not started.")
+        snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+        with self._lock:
+            self._snapshots.pop(name, None)
+            self._snapshots[name] = snapshot
+            while len(self._snapshots) > MAX_SNAPSHOTS:
+                self._snapshots.popitem(last=False)
+        return {"name": name, **self._summary(snapshot)}
+
+    def diff(
+        self, base: str, against: Optional[str] = None, group_by: str = "lineno", limit: int = 20,
+    ) -> List[Dict[str, Any]]:
+        """Compares snapshot `against` (a fresh one if omitted) with `base`.
+
+        Returns the `limit` locations whose allocations grew most, by
+        "lineno", "filename" or "traceback".
+
+        Raises:
+            KeyError: A snapshot of that name does not exist.
+            RuntimeError: tracemalloc is not tracing and `against` is omitted.
+        """
+        with self._lock:
+            base_snapshot: tracemalloc.Snapshot = self._snapshots[base]
+            against_snapshot: Optional[tracemalloc.Snapshot] = self._snapshots[against] if against else None
+        if against_snapshot is None:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("Memory tracing is not started.")
+            against_snapshot = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+        return [
+            {
+                "location": _location(difference.traceback, group_by),
+                "size_diff_bytes": difference.size_diff,
+                "size_bytes": difference.size,
+                "count_diff": difference.count_diff,
+                "count": difference.count,
+            }
+            for difference in against_snapshot.compare_to(base_snapshot, group_by)[:limit]
+        ]
+
+    @staticmethod
+    def _summary(snapshot: tracemalloc.Snapshot) -> Dict[str, Any]:
+        return {
+            "traced_bytes": sum(trace.size for trace in snapshot.traces),
+            "allocations": len(snapshot.traces),
+        }
+
+    def status(self) -> Dict[str, Any]:
+        """Whether tracing is on, the memory traced now and at peak, and the snapshots kept."""
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            names: List[str] = list(self._snapshots)
+        return {
+            "tracing": self.tracing,
+            "traced_bytes": current,
+            "peak_traced_bytes": peak,
+            "tracemalloc_overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "snapshots": names,
+        }
+
+    def stats(self) -> Dict[str, int]:
+        current, _ = tracemalloc.get_traced_memory()
+        with self._lock:
+            kept: int = len(self._snapshots)
+        return {"tracing": int(self.tracing), "traced_bytes": current, "snapshots": kept}
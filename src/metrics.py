@@ -0,0 +1,121 @@
+"""
+Prometheus metrics of the webhook pipeline.
+
+The handlers time their stages (LINE download, folder resolution, upload,
+note append, Redis de-duplication, ...) into one histogram labelled by
+stage, and count events, uploaded bytes and cache lookups. The event loop's
+lag is recorded by `src.loop_monitor`. Recording is a
+lock-protected add, a few microseconds per call, so it is always on. Each
+stage is also recorded as a span of the current trace (see `src.tracing`).
+
+Label values come from small fixed sets (stage names, event types, kinds),
+except the group label of `line_uploaded_bytes_total`. That one stays empty
+unless group labels are enabled with `configure(group_labels=True)`, since
+every group would add its own series.
+
+`render()` returns the text exposition served by `GET /metrics`. Besides
+the metrics above, it reports the `stats()` of the app's runtime
+components (media budget, spool, in-flight deliveries, sessions, ...) as
+gauges, read at scrape time.
+"""
+import re
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import GCCollector, PlatformCollector, ProcessCollector
+from prometheus_client.core import GaugeMetricFamily
+
+from src import tracing
+
+REGISTRY = CollectorRegistry()
+ProcessCollector(registry=REGISTRY)
+PlatformCollector(registry=REGISTRY)
+GCCollector(registry=REGISTRY)
+
+# From 5 ms (a Redis round trip) to 2 minutes (a large video).
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_SECONDS = Histogram(
+    "line_stage_seconds", "Time spent in one stage of handling a webhook event.",
+    ["stage"], buckets=STAGE_BUCKETS, registry=REGISTRY,
+)
+EVENT_SECONDS = Histogram(
+    "line_event_seconds", "Time spent handling one webhook event, by message type.",
+    ["type"], buckets=STAGE_BUCKETS, registry=REGISTRY,
+)
+EVENTS = Counter(
+    "line_events", "Webhook events by message type and outcome.",
+    ["type", "outcome"], registry=REGISTRY,
+)
+UPLOADED_BYTES = Counter(
+    "line_uploaded_bytes", "Bytes saved, by kind (and group, if enabled).",
+    ["kind", "group"], registry=REGISTRY,
+)
+CACHE_LOOKUPS = Counter(
+    "line_cache_lookups", "Lookups in the de-duplication and ID caches, by cache and result.",
+    ["cache", "result"], registry=REGISTRY,
+)
+
+LOOP_LAG_SECONDS = Histogram(
+    "line_event_loop_lag_seconds", "How long a callback scheduled on the event loop waited to run.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0), registry=REGISTRY,
+)
+LOOP_BLOCKS = Counter(
+    "line_event_loop_blocks", "Times the event loop was blocked for longer than the threshold.",
+    registry=REGISTRY,
+)
+
+_group_labels: bool = False
+
+
+def configure(group_labels: bool = False) -> None:
+    """Sets whether uploaded bytes are also labelled with the group name."""
+    global _group_labels
+    _group_labels = group_labels
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times a stage and traces it as a span; use as `with metrics.stage("upload"): ...`."""
+    with tracing.span(name), STAGE_SECONDS.labels(name).time():
+        yield
+
+
+def record_upload(kind: str, size: int, group: Optional[str] = None) -> None:
+    """Counts the bytes of a saved photo, video, file or note."""
+    UPLOADED_BYTES.labels(kind, group if _group_labels and group else "").inc(size)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+_NAME_PATTERN = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class RuntimeStatsCollector:
+    """Reports the numeric `stats()` of runtime components as gauges.
+
+    A component named "upload_spool" whose stats() include "queued" is
+    reported as `line_upload_spool_queued`.
+    """
+    def __init__(self, components: Dict[str, Any]) -> None:
+        self._components: Dict[str, Any] = components
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        for component_name, component in self._components.items():
+            for stat_name, value in component.stats().items():
+                if isinstance(value, (int, float)):
+                    name: str = _NAME_PATTERN.sub("_", f"line_{component_name}_{stat_name}")
+                    yield GaugeMetricFamily(name, f"{stat_name} of {component_name}.", value=float(value))
+
+
+def render(components: Optional[Dict[str, Any]] = None) -> bytes:
+    """Renders the metrics, and the given components' stats, in the Prometheus text format."""
+    output: bytes = generate_latest(REGISTRY)
+    if components:
+        runtime_registry = CollectorRegistry()
+        runtime_registry.register(RuntimeStatsCollector(components))
+        output += generate_latest(runtime_registry)
+    return output
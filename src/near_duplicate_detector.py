@@ -0,0 +1,269 @@
+"""
+Detects near-duplicate photos before they are uploaded.
+
+Site workers often send the same shot twice or forward one photo to several
+sites. This module computes a perceptual difference hash (dHash) of each
+image in a process pool, so decoding never blocks the event loop, and checks
+it against the recent hashes of the same group using a BK-tree. Images whose
+similarity is above a configurable threshold can then be skipped or tagged.
+"""
+import importlib.util
+import io
+import logging
+import math
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Dict, List, Tuple, Deque, Any
+
+# Pillow is optional; the detector is disabled without it. It is imported where images are
+# decoded, in the worker processes, so importing this module does not load it.
+PILLOW_AVAILABLE: bool = importlib.util.find_spec("PIL") is not None
+
+from src.shared_memory_executor import CpuExecutor, run_cpu_stage
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE: int = 8
+HASH_BITS: int = HASH_SIZE * HASH_SIZE
+
+
+def compute_dhash(content: bytes, hash_size: int = HASH_SIZE) -> int:
+    """Computes the difference hash (dHash) of an image.
+
+    The image is reduced to a (hash_size + 1) x hash_size grayscale
+    thumbnail, and each bit records whether a pixel is brighter than its
+    right-hand neighbour. This runs in worker processes, so it must stay a
+    module-level function.
+
+    Args:
+        content: The encoded image bytes (any format Pillow can read).
+        hash_size: The number of rows and bits per row of the hash.
+
+    Returns:
+        The hash as an integer of hash_size * hash_size bits.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(content)) as image:
+        # Let the JPEG decoder downscale while decoding; far cheaper than a full decode.
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        thumbnail = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels: bytes = thumbnail.tobytes()
+
+    value: int = 0
+    for row in range(hash_size):
+        offset: int = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """Returns the number of differing bits between two hashes."""
+    return (first ^ second).bit_count()
+
+
+class BKTree:
+    """A Burkhard-Keller tree for Hamming-distance lookups over integer hashes.
+
+    Each node stores a hash and a payload; children are keyed by their
+    distance to the parent, which lets a search prune every subtree outside
+    [d - max_distance, d + max_distance].
+    """
+    def __init__(self) -> None:
+        self._root: Optional[Tuple[int, Any, Dict[int, Any]]] = None
+        self._size: int = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, payload: Any) -> None:
+        """Inserts a hash together with its payload."""
+        self._size += 1
+        if self._root is None:
+            self._root = (value, payload, {})
+            return
+        node = self._root
+        while True:
+            distance: int = hamming_distance(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, payload, {})
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Finds all stored hashes within max_distance of value.
+
+        Returns:
+            A list of (distance, payload) tuples sorted by distance.
+        """
+        if self._root is None:
+            return []
+        matches: List[Tuple[int, Any]] = []
+        pending = [self._root]
+        while pending:
+            node = pending.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                matches.append((distance, node[1]))
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+@dataclass(frozen=True)
+class NearDuplicateMatch:
+    """Describes an earlier image that a new image nearly duplicates."""
+    message_id: str
+    distance: int
+    similarity: float
+
+
+class NearDuplicateDetector:
+    """Tracks recent perceptual hashes per group and flags near-duplicates.
+
+    Only the most recent `window_size` images of each group are compared
+    against. When old hashes fall out of the window, that group's BK-tree is
+    rebuilt lazily on the next lookup.
+
+    Attributes:
+        ACTIONS: The supported actions for a detected near-duplicate.
+        action: Either "skip" (do not upload) or "tag" (upload with a marker).
+        max_distance: The largest Hamming distance treated as a near-duplicate.
+    """
+    ACTIONS: Tuple[str, ...] = ("skip", "tag")
+    STATS_LOG_INTERVAL: int = 100
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.9,
+        action: str = "skip",
+        window_size: int = 200,
+        executor: Optional[CpuExecutor] = None,
+        max_workers: Optional[int] = None,
+    ) -> None:
+        if not PILLOW_AVAILABLE:
+            raise RuntimeError("Pillow is required for near-duplicate detection.")
+        if action not in self.ACTIONS:
+            raise ValueError(f"Unknown near-duplicate action '{action}'. Expected one of {self.ACTIONS}.")
+        if not 0.0 < similarity_threshold <= 1.0:
+            raise ValueError("similarity_threshold must be in (0, 1].")
+
+        self.action: str = action
+        self.max_distance: int = math.floor((1.0 - similarity_threshold) * HASH_BITS)
+        self._window_size: int = window_size
+        self._executor: CpuExecutor = executor or ProcessPoolExecutor(max_workers=max_workers)
+        self._owns_executor: bool = executor is None
+        self._recent: Dict[str, Deque[Tuple[int, str]]] = {}
+        self._trees: Dict[str, BKTree] = {}
+        # Hashes of checked images waiting for their upload to succeed, by message ID.
+        self._unconfirmed: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+
+        self._started_at: float = time.monotonic()
+        self._processed: int = 0
+        self._duplicates: int = 0
+        self._failures: int = 0
+        self._hash_seconds: float = 0.0
+
+    def _tree_for(self, group_name: str) -> BKTree:
+        tree: Optional[BKTree] = self._trees.get(group_name)
+        if tree is None:
+            tree = BKTree()
+            for value, message_id in self._recent.get(group_name, ()):
+                tree.add(value, message_id)
+            self._trees[group_name] = tree
+        return tree
+
+    def _remember(self, group_name: str, value: int, message_id: str) -> None:
+        recent = self._recent.setdefault(group_name, deque())
+        recent.append((value, message_id))
+        if len(recent) > self._window_size:
+            recent.popleft()
+            # The tree cannot delete nodes; drop it and rebuild from the window on demand.
+            self._trees.pop(group_name, None)
+        elif group_name in self._trees:
+            self._trees[group_name].add(value, message_id)
+
+    async def check(self, group_name: str, content: bytes, message_id: str) -> Optional[NearDuplicateMatch]:
+        """Checks an image against the recent images of its group.
+
+        Hashing runs in the executor. An image that is not a near-duplicate
+        is only compared against once `remember` confirms its upload, so an
+        image whose upload failed does not block its own retry. Earlier
+        images with the same message ID (e.g. a redelivered event) are
+        never reported as matches. If the image cannot be decoded, it is
+        treated as unique so the upload still happens.
+
+        Args:
+            group_name: The group the image is being uploaded to.
+            content: The encoded image bytes.
+            message_id: The LINE message ID of the image.
+
+        Returns:
+            The closest earlier match if the image is a near-duplicate,
+            otherwise None.
+        """
+        started: float = time.perf_counter()
+        try:
+            value: int = await run_cpu_stage(self._executor, compute_dhash, content)
+        except Exception as e:
+            self._failures += 1
+            logger.warning("⚠️ Could not compute perceptual hash: %s", e, extra={"message_id": message_id})
+            return None
+        finally:
+            self._hash_seconds += time.perf_counter() - started
+
+        self._processed += 1
+        matches = [
+            (distance, original_id)
+            for distance, original_id in self._tree_for(group_name).search(value, self.max_distance)
+            if original_id != message_id
+        ]
+        match: Optional[NearDuplicateMatch] = None
+        if matches:
+            distance, original_id = matches[0]
+            match = NearDuplicateMatch(
+                message_id=original_id,
+                distance=distance,
+                similarity=1.0 - distance / HASH_BITS,
+            )
+            self._duplicates += 1
+        else:
+            self._unconfirmed[message_id] = (group_name, value)
+            while len(self._unconfirmed) > self._window_size:
+                self._unconfirmed.popitem(last=False)
+
+        if self._processed % self.STATS_LOG_INTERVAL == 0:
+            logger.info("Near-duplicate detection stats.", extra=self.stats())
+        return match
+
+    def remember(self, message_id: str) -> None:
+        """Adds a checked image to its group's window once it has been uploaded."""
+        unconfirmed: Optional[Tuple[str, int]] = self._unconfirmed.pop(message_id, None)
+        if unconfirmed:
+            group_name, value = unconfirmed
+            self._remember(group_name, value, message_id)
+
+    def stats(self) -> Dict[str, float]:
+        """Reports throughput and the skip (or tag) rate so far."""
+        elapsed: float = time.monotonic() - self._started_at
+        rate: float = self._duplicates / self._processed if self._processed else 0.0
+        return {
+            "processed": self._processed,
+            "near_duplicates": self._duplicates,
+            "failures": self._failures,
+            "skip_rate": rate if self.action == "skip" else 0.0,
+            "tag_rate": rate if self.action == "tag" else 0.0,
+            "images_per_second": self._processed / elapsed if elapsed > 0 else 0.0,
+            "avg_hash_ms": 1000 * self._hash_seconds / self._processed if self._processed else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        """Shuts down the worker pool if this detector created it."""
+        if self._owns_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,383 @@
+"""
+A local, append-only journal of notes, exported to Drive in the background.
+
+Saving a note used to mean downloading the day's `_notes.txt` file from
+Drive, appending one line and uploading the whole file again. The
+NoteJournal instead makes a local SQLite (WAL) database the source of truth.
+A note is a single insert, indexed by group, date and user. Notes are also
+indexed in an FTS5 table as they arrive, so they can be searched locally.
+A NoteExporter periodically renders each day that received new notes into its
+`<date>_notes.txt` file and uploads it, so Drive traffic grows with the
+number of flushes rather than the number of notes. A day whose file already
+exists in Drive without having been exported (e.g. written by the old
+append path) is first seeded into the journal from that file, so the
+export keeps its earlier notes.
+"""
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Dict, List, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+NOTE_LINE = re.compile(r"^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] ?(.*)$")
+
+
+@dataclass(frozen=True)
+class JournalNote:
+    """A single note stored in the journal."""
+    id: int
+    group_name: str
+    note_date: str
+    user_id: str
+    message_id: Optional[str]
+    created_at: float
+    text: str
+
+
+def render_notes(notes: List[JournalNote]) -> str:
+    """Renders notes in the format of the daily `_notes.txt` files.
+
+    Each note becomes a `[YYYY-MM-DD HH:MM:SS] text` line, as written by
+    `GoogleDriveService.append_text_to_file`.
+    """
+    return "\n".join(
+        f"[{datetime.fromtimestamp(note.created_at).strftime('%Y-%m-%d %H:%M:%S')}] {note.text}"
+        for note in notes
+    )
+
+
+class NoteJournal:
+    """A SQLite-backed, append-only store of notes.
+
+    The journal is safe to share between threads; all access goes through a
+    single connection guarded by a lock.
+    """
+    def __init__(self, db_path: str) -> None:
+        if db_path != ":memory:" and os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Each insert is already durable in the WAL; a full fsync per commit is not needed.
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS notes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    group_name TEXT NOT NULL,
+                    note_date TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    message_id TEXT UNIQUE,
+                    created_at REAL NOT NULL,
+                    text TEXT NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_notes_group_date ON notes (group_name, note_date, id)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_notes_user ON notes (user_id, created_at)"
+            )
+            has_search_index: bool = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'notes_fts'"
+            ).fetchone() is not None
+            # The trigram tokenizer matches substrings, which also works for Thai text without word breaks.
+            self._conn.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+                    text, content='notes', content_rowid='id', tokenize='trigram'
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN
+                    INSERT INTO notes_fts (rowid, text) VALUES (new.id, new.text);
+                END
+                """
+            )
+            if not has_search_index:
+                self._conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS note_exports (
+                    group_name TEXT NOT NULL,
+                    note_date TEXT NOT NULL,
+                    exported_through INTEGER NOT NULL,
+                    file_id TEXT,
+                    PRIMARY KEY (group_name, note_date)
+                )
+                """
+            )
+
+    @staticmethod
+    def _to_note(row: sqlite3.Row) -> JournalNote:
+        return JournalNote(
+            id=row["id"],
+            group_name=row["group_name"],
+            note_date=row["note_date"],
+            user_id=row["user_id"],
+            message_id=row["message_id"],
+            created_at=row["created_at"],
+            text=row["text"],
+        )
+
+    def append(
+        self,
+        group_name: str,
+        user_id: str,
+        text: str,
+        message_id: Optional[str] = None,
+        created_at: Optional[float] = None,
+    ) -> Optional[int]:
+        """Appends a note to the journal.
+
+        A note whose message ID is already in the journal (e.g. from a
+        redelivered event) is not stored twice.
+
+        Returns:
+            The ID of the new note, or None if it was already journaled.
+        """
+        created_at = created_at if created_at is not None else time.time()
+        note_date: str = datetime.fromtimestamp(created_at).strftime("%Y-%m-%d")
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                INSERT OR IGNORE INTO notes (group_name, note_date, user_id, message_id, created_at, text)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (group_name, note_date, user_id, message_id, created_at, text),
+            )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def notes_for_day(self, group_name: str, note_date: str) -> List[JournalNote]:
+        """Returns a group's notes of one day, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM notes WHERE group_name = ? AND note_date = ? ORDER BY created_at, id",
+                (group_name, note_date),
+            ).fetchall()
+        return [self._to_note(row) for row in rows]
+
+    def seed_day(self, group_name: str, note_date: str, content: str) -> int:
+        """Imports the notes of an existing daily `_notes.txt` file.
+
+        Each `[YYYY-MM-DD HH:MM:SS] text` line becomes a note; lines without
+        a timestamp continue the note before them. Seeded notes get message
+        IDs derived from their position, so seeding a day twice stores them
+        once.
+
+        Returns:
+            The number of notes imported.
+        """
+        day_start: float = datetime.strptime(note_date, "%Y-%m-%d").timestamp()
+        parsed: List[Tuple[float, str]] = []
+        for line in content.splitlines():
+            match = NOTE_LINE.match(line)
+            if match:
+                created_at: float = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S").timestamp()
+                parsed.append((created_at, match.group(2)))
+            elif parsed:
+                parsed[-1] = (parsed[-1][0], f"{parsed[-1][1]}\n{line}")
+            elif line.strip():
+                parsed.append((day_start, line))
+        imported: int = 0
+        with self._lock, self._conn:
+            for index, (created_at, text) in enumerate(parsed):
+                cursor = self._conn.execute(
+                    """
+                    INSERT OR IGNORE INTO notes (group_name, note_date, user_id, message_id, created_at, text)
+                    VALUES (?, ?, '', ?, ?, ?)
+                    """,
+                    (group_name, note_date, f"seed:{group_name}:{note_date}:{index}", created_at, text),
+                )
+                imported += cursor.rowcount
+        return imported
+
+    def notes_by_user(self, user_id: str, limit: int = 50) -> List[JournalNote]:
+        """Returns a user's most recent notes, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM notes WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+                (user_id, limit),
+            ).fetchall()
+        return [self._to_note(row) for row in rows]
+
+    def search(self, group_name: str, query: str, limit: int = 5) -> List[JournalNote]:
+        """Finds a group's notes containing every term of query, best matches first.
+
+        Terms shorter than three characters cannot use the trigram index, so
+        such queries fall back to a substring scan of the group's notes.
+
+        Args:
+            group_name: The group whose notes are searched.
+            query: The search terms, separated by whitespace.
+            limit: The maximum number of notes returned.
+        """
+        terms: List[str] = query.split()
+        if not terms:
+            return []
+        with self._lock:
+            if all(len(term) >= 3 for term in terms):
+                match: str = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+                rows = self._conn.execute(
+                    """
+                    SELECT notes.* FROM notes_fts
+                    JOIN notes ON notes.id = notes_fts.rowid
+                    WHERE notes_fts MATCH ? AND notes.group_name = ?
+                    ORDER BY bm25(notes_fts), notes.id DESC
+                    LIMIT ?
+                    """,
+                    (match, group_name, limit),
+                ).fetchall()
+            else:
+                conditions: str = " AND ".join("instr(lower(text), ?) > 0" for _ in terms)
+                rows = self._conn.execute(
+                    f"SELECT * FROM notes WHERE group_name = ? AND {conditions} ORDER BY id DESC LIMIT ?",
+                    (group_name, *[term.lower() for term in terms], limit),
+                ).fetchall()
+        return [self._to_note(row) for row in rows]
+
+    def pending_exports(self) -> List[Tuple[str, str, int]]:
+        """Lists the (group, date, latest note ID) of days with notes not yet exported."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT n.group_name, n.note_date, MAX(n.id) AS latest_id
+                FROM notes n
+                LEFT JOIN note_exports e
+                    ON e.group_name = n.group_name AND e.note_date = n.note_date
+                GROUP BY n.group_name, n.note_date
+                HAVING MAX(n.id) > COALESCE(MAX(e.exported_through), 0)
+                ORDER BY n.note_date, n.group_name
+                """
+            ).fetchall()
+        return [(row["group_name"], row["note_date"], row["latest_id"]) for row in rows]
+
+    def export_file_id(self, group_name: str, note_date: str) -> Optional[str]:
+        """Returns the Drive file a day's notes were last exported to, if any."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id FROM note_exports WHERE group_name = ? AND note_date = ?",
+                (group_name, note_date),
+            ).fetchone()
+        return row["file_id"] if row else None
+
+    def mark_exported(self, group_name: str, note_date: str, through_id: int, file_id: str) -> None:
+        """Records that a day's notes up to through_id are in Drive file file_id."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO note_exports (group_name, note_date, exported_through, file_id)
+                VALUES (?, ?, ?, ?)
+                """,
+                (group_name, note_date, through_id, file_id),
+            )
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class NoteExporter:
+    """Periodically renders journaled notes into the daily Drive text files.
+
+    Only days that received notes since their last export are uploaded, and
+    each is uploaded once per flush however many notes it received.
+
+    Attributes:
+        interval_seconds: The time between export flushes.
+    """
+    def __init__(
+        self,
+        journal: NoteJournal,
+        gdrive_service: Any,
+        parent_folder_id: Optional[str],
+        interval_seconds: float = 60.0,
+    ) -> None:
+        self.journal: NoteJournal = journal
+        self.interval_seconds: float = interval_seconds
+        self._gdrive_service = gdrive_service
+        self._parent_folder_id: Optional[str] = parent_folder_id
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._flushes: int = 0
+        self._files_written: int = 0
+
+    def _export_day(self, group_name: str, note_date: str) -> None:
+        """Writes a day's notes to its Drive file. Blocking; runs in a worker thread."""
+        group_folder_id: str = self._gdrive_service.find_or_create_folder(
+            group_name, parent_folder_id=self._parent_folder_id
+        )
+        daily_folder_id: str = self._gdrive_service.find_or_create_folder(
+            note_date, parent_folder_id=group_folder_id
+        )
+        file_name: str = f"{note_date}_notes.txt"
+        file_id: Optional[str] = self.journal.export_file_id(group_name, note_date)
+        if file_id is None:
+            existing: Optional[Tuple[str, str]] = self._gdrive_service.read_text_file(file_name, daily_folder_id)
+            if existing:
+                file_id, content = existing
+                seeded: int = self.journal.seed_day(group_name, note_date, content)
+                logger.info("Seeded %s existing note(s) of '%s' for %s from Drive.", seeded, group_name, note_date)
+        notes: List[JournalNote] = self.journal.notes_for_day(group_name, note_date)
+        file_id = self._gdrive_service.write_text_file(file_name, render_notes(notes), daily_folder_id, file_id=file_id)
+        self.journal.mark_exported(group_name, note_date, max(note.id for note in notes), file_id)
+        self._files_written += 1
+
+    async def flush(self) -> int:
+        """Exports every day with new notes now.
+
+        A day that fails to export is retried on the next flush.
+
+        Returns:
+            The number of daily files written.
+        """
+        async with self._flush_lock:
+            written: int = 0
+            for group_name, note_date, _ in self.journal.pending_exports():
+                try:
+                    await asyncio.to_thread(self._export_day, group_name, note_date)
+                    written += 1
+                except Exception as e:
+                    logger.error("❌ Failed to export notes of '%s' for %s: %s", group_name, note_date, e)
+            self._flushes += 1
+            if written:
+                logger.info("Exported notes to %s daily file(s).", written)
+            return written
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            await self.flush()
+
+    def start(self) -> None:
+        """Starts the periodic export loop on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the export loop and runs a final flush."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """Reports how many flushes ran and how many daily files they wrote."""
+        return {"flushes": self._flushes, "files_written": self._files_written}
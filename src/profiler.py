@@ -0,0 +1,176 @@
+"""
+Samples the stacks of every thread of the running process.
+
+`GET /debug/profile` runs a SamplingProfiler for a few seconds. A sampling
+thread reads the current frame of every thread (`sys._current_frames()`)
+`hz` times a second. That covers the event loop, background tasks (they
+run on the loop thread), `asyncio.to_thread` and executor threads, and the
+log and loop monitor threads. The CPU stages in the process pool run in
+other processes and are not sampled.
+
+A sample costs a walk of each thread's stack while holding the GIL, about
+10 microseconds for this app. The rate and duration are capped at MAX_HZ
+and MAX_SECONDS, and only one profile runs at a time. The sampler needs the
+GIL to take a sample, so while other threads run Python code it samples
+less often than `hz`; the profile's name gives the actual sample count.
+
+The result is either collapsed stacks (`thread;outer (file:line);...;inner
+(file:line) count`, the input of flamegraph.pl and speedscope) or a
+speedscope JSON document with one sampled profile per thread. Samples of
+threads that are only waiting (in a lock, select or an idle executor) are
+left out unless `idle` is set.
+"""
+import os
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Any, Tuple
+
+MAX_SECONDS: float = 120.0
+MAX_HZ: int = 250
+
+Frame = Tuple[str, str, int]  # (function, file, line)
+Stack = Tuple[Frame, ...]  # Outermost frame first.
+
+# Innermost Python frames of a thread that is waiting rather than working.
+_IDLE_FRAMES = frozenset({
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),  # concurrent.futures: an idle executor thread.
+    ("queue.py", "get"),
+})
+
+
+def _stack(frame: Any) -> Stack:
+    frames: List[Frame] = []
+    while frame is not None:
+        frames.append((frame.f_code.co_name, frame.f_code.co_filename, frame.f_lineno))
+        frame = frame.f_back
+    return tuple(reversed(frames))
+
+
+def _is_idle(stack: Stack) -> bool:
+    function, file_name, _ = stack[-1]
+    return (os.path.basename(file_name), function) in _IDLE_FRAMES
+
+
+def _frame_name(frame: Frame) -> str:
+    function, file_name, line = frame
+    return f"{function} ({_short_path(file_name)}:{line})"
+
+
+_PATH_PREFIXES: Tuple[str, ...] = ("site-packages" + os.sep, sysconfig.get_paths()["stdlib"] + os.sep)
+
+
+def _short_path(file_name: str) -> str:
+    """Shortens paths under the working directory, site-packages or the standard library."""
+    for marker in (*_PATH_PREFIXES, os.getcwd() + os.sep):
+        if marker in file_name:
+            return file_name.split(marker, 1)[1]
+    return file_name
+
+
+class Profile:
+    """The samples of one profiling run, counted per thread and stack."""
+    def __init__(self, samples: Dict[Tuple[str, Stack], int], hz: int, duration: float) -> None:
+        self.samples: Dict[Tuple[str, Stack], int] = samples
+        self.hz: int = hz
+        self.duration: float = duration
+
+    @property
+    def sample_count(self) -> int:
+        return sum(self.samples.values())
+
+    def collapsed(self) -> str:
+        """The samples as collapsed stacks, one `thread;frame;...;frame count` line per stack."""
+        lines: List[str] = [
+            ";".join([thread_name.replace(";", ":"), *map(_frame_name, stack)]) + f" {count}"
+            for (thread_name, stack), count in sorted(self.samples.items(), key=lambda item: -item[1])
+        ]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def speedscope(self) -> Dict[str, Any]:
+        """The samples as a speedscope document, with one sampled profile per thread."""
+        frame_index: Dict[Frame, int] = {}
+        frames: List[Dict[str, Any]] = []
+        profiles: Dict[str, Dict[str, Any]] = {}
+        interval: float = 1.0 / self.hz
+        for (thread_name, stack), count in self.samples.items():
+            indices: List[int] = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": _short_path(frame[1]), "line": frame[2]})
+                indices.append(frame_index[frame])
+            profile = profiles.setdefault(thread_name, {
+                "type": "sampled", "name": thread_name, "unit": "seconds",
+                "startValue": 0, "endValue": 0.0, "samples": [], "weights": [],
+            })
+            profile["samples"].append(indices)
+            profile["weights"].append(count * interval)
+            profile["endValue"] += count * interval
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.sample_count} samples over {self.duration:.1f}s at {self.hz} Hz",
+            "exporter": "line-uploader",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
+
+
+class SamplingProfiler:
+    """Samples all threads' stacks for a given time; one run at a time."""
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._runs: int = 0
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, seconds: float, hz: int = 100, idle: bool = False) -> Profile:
+        """Samples for `seconds` (blocking the calling thread) and returns the profile.
+
+        Raises:
+            RuntimeError: Another profile is running.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running.")
+        try:
+            seconds, hz = min(seconds, MAX_SECONDS), max(1, min(hz, MAX_HZ))
+            return self._sample(seconds, hz, idle)
+        finally:
+            self._runs += 1
+            self._lock.release()
+
+    def _sample(self, seconds: float, hz: int, idle: bool) -> Profile:
+        own_thread: int = threading.get_ident()
+        samples: Counter = Counter()
+        interval: float = 1.0 / hz
+        started: float = time.monotonic()
+        next_sample: float = started
+        while (now := time.monotonic()) - started < seconds:
+            names: Dict[int, str] = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, stack in self._stacks(own_thread).items():
+                if stack and (idle or not _is_idle(stack)):
+                    samples[(names.get(thread_id, f"thread-{thread_id}"), stack)] += 1
+            next_sample += interval
+            # If a sample ran late, the next one is taken right away rather than in a burst to catch up.
+            next_sample = max(next_sample, now)
+            time.sleep(max(0.0, next_sample - time.monotonic()))
+        return Profile(dict(samples), hz, time.monotonic() - started)
+
+    @staticmethod
+    def _stacks(own_thread: int) -> Dict[int, Stack]:
+        # Only the stacks are kept; holding on to the frames would keep their locals alive.
+        return {
+            thread_id: _stack(frame)
+            for thread_id, frame in sys._current_frames().items() if thread_id != own_thread
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": int(self.running), "profiles_run": self._runs}
@@ -0,0 +1,61 @@
+"""
+An asyncio token-bucket rate limiter for outgoing API calls.
+
+Google Drive enforces per-user request quotas. Jobs that fan out over many
+folders at once share one AsyncRateLimiter, so their combined request rate
+stays below the quota however many coroutines are running.
+"""
+import asyncio
+import time
+from typing import Dict
+
+
+class AsyncRateLimiter:
+    """Allows at most `rate` acquisitions per second, with bursts up to `burst`.
+
+    Attributes:
+        rate: The sustained number of acquisitions per second.
+        burst: The bucket size, i.e. how many calls may start at once.
+    """
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive.")
+        self.rate: float = rate
+        self.burst: int = max(1, burst)
+        self._tokens: float = float(self.burst)
+        self._updated: float = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._acquired: int = 0
+        self._waited_seconds: float = 0.0
+
+    def _refill(self) -> None:
+        now: float = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Waits until a token is available and takes it.
+
+        Waiters are served in arrival order, since the lock is held while
+        sleeping for the next token.
+        """
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                wait: float = (1 - self._tokens) / self.rate
+                self._waited_seconds += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= 1
+            self._acquired += 1
+
+    async def __aenter__(self) -> "AsyncRateLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        return None
+
+    def stats(self) -> Dict[str, float]:
+        """Reports how many calls were admitted and how long they waited in total."""
+        return {"acquired": self._acquired, "waited_seconds": round(self._waited_seconds, 3)}
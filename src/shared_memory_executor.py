@@ -0,0 +1,211 @@
+"""
+A process-pool executor that passes image bytes through shared memory.
+
+With a plain ProcessPoolExecutor, every CPU-bound image stage pickles the
+multi-megabyte input to a worker and pickles the result back. This executor
+instead keeps a ring of fixed-size slots in one `multiprocessing.shared_memory`
+block. The input is copied into a free slot once, the worker receives only
+the slot's offset and length, and a bytes-like result is written back into
+the same slot and returned to the caller as a memoryview, without copying.
+Callers decide whether to copy it out. The ImageTransformer, for example,
+inspects the result in place and copies out only a result it accepts, so that
+the slot is free again before the upload starts.
+
+On Linux the block lives in /dev/shm. A block larger than the free space
+there is still created, but writing past the free space kills the process
+with SIGBUS. The executor therefore checks the space when it starts. Docker
+gives containers a 64 MB /dev/shm unless `shm_size` is set.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Any, Callable, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+SHM_PATH: str = "/dev/shm"
+
+# The shared memory block as seen from inside a worker process.
+_worker_memory: Optional[SharedMemory] = None
+
+
+def _attach_worker(name: str) -> None:
+    """Worker initializer: maps the parent's shared memory block once."""
+    global _worker_memory
+    # Workers share the parent's resource tracker, so attaching here does not
+    # add a second owner; only the parent unlinks the block on shutdown.
+    _worker_memory = SharedMemory(name=name)
+
+
+def shared_memory_available(path: str = SHM_PATH) -> Optional[int]:
+    """Returns the bytes free for shared memory blocks, or None where they are not kept in /dev/shm."""
+    try:
+        stats = os.statvfs(path)
+    except (OSError, AttributeError):  # No /dev/shm (e.g. macOS), or no statvfs (Windows).
+        return None
+    return stats.f_bavail * stats.f_frsize
+
+
+@dataclass(frozen=True)
+class _InSlot:
+    """Marks a result that the worker wrote back into its input slot."""
+    length: int
+
+
+def _run_in_slot(func: Callable[..., Any], offset: int, length: int, capacity: int, args: Tuple[Any, ...]) -> Any:
+    """Runs func over a slot of the shared block inside a worker process."""
+    view = _worker_memory.buf[offset:offset + length]
+    try:
+        result = func(view, *args)
+        if isinstance(result, (bytes, bytearray, memoryview)) and len(result) <= capacity:
+            _worker_memory.buf[offset:offset + len(result)] = result
+            return _InSlot(len(result))
+        return result
+    finally:
+        view.release()
+
+
+class SharedMemoryResult:
+    """A bytes-like result that still lives in a shared memory slot.
+
+    The slot stays reserved until the result is released, so callers should
+    use it as a context manager, or call `release()` once they are done with
+    `view`.
+    """
+    def __init__(self, executor: "SharedMemoryExecutor", slot: int, view: memoryview) -> None:
+        self._executor = executor
+        self._slot = slot
+        self.view: memoryview = view
+
+    def __len__(self) -> int:
+        return self.view.nbytes
+
+    def tobytes(self) -> bytes:
+        """Copies the result out of shared memory."""
+        return self.view.tobytes()
+
+    def release(self) -> None:
+        """Returns the slot to the executor. Safe to call more than once."""
+        if self._slot is None:
+            return
+        self.view.release()
+        self._executor._release(self._slot)
+        self._slot = None
+
+    def __enter__(self) -> "SharedMemoryResult":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class SharedMemoryExecutor:
+    """Runs CPU-bound stages in worker processes over shared-memory slots.
+
+    Content larger than a slot falls back to the regular pickled path. The
+    number of slots also bounds how many items can be in flight; further
+    callers wait for a free slot.
+
+    Attributes:
+        slot_count: The number of slots in the ring.
+        slot_size: The capacity of each slot in bytes.
+
+    Raises:
+        RuntimeError: The slots do not fit in the free space of /dev/shm.
+    """
+    def __init__(self, slot_count: int = 8, slot_size: int = 16 * 1024 * 1024, max_workers: Optional[int] = None) -> None:
+        self.slot_count: int = slot_count
+        self.slot_size: int = slot_size
+        size: int = slot_count * slot_size
+        available: Optional[int] = shared_memory_available()
+        if available is not None and size > available:
+            raise RuntimeError(
+                f"The shared memory executor needs {size / 2**20:.0f} MB but {SHM_PATH} has only "
+                f"{available / 2**20:.0f} MB free. Lower SHARED_MEMORY_SLOTS or SHARED_MEMORY_SLOT_MB, "
+                "or give the container more shared memory (shm_size in docker-compose.yml)."
+            )
+        self._memory = SharedMemory(create=True, size=size)
+        self._free: asyncio.Queue = asyncio.Queue()
+        for slot in range(slot_count):
+            self._free.put_nowait(slot)
+        self._pool = ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_attach_worker, initargs=(self._memory.name,)
+        )
+
+    def _release(self, slot: int) -> None:
+        self._free.put_nowait(slot)
+
+    async def run(self, func: Callable[..., Any], content: Any, *args: Any) -> Any:
+        """Runs func(view_of_content, *args) in a worker process.
+
+        func must be a module-level function that accepts any bytes-like
+        object. A bytes-like return value that fits in the slot comes back
+        as a SharedMemoryResult; any other value is returned as-is.
+
+        Args:
+            func: The stage function to run.
+            content: The bytes-like input, e.g. downloaded image content.
+            *args: Extra picklable arguments for func.
+
+        Returns:
+            The function's result.
+        """
+        loop = asyncio.get_running_loop()
+        if len(content) > self.slot_size:
+            logger.debug("Content of %s bytes exceeds the slot size; using the pickled path.", len(content))
+            return await loop.run_in_executor(self._pool, func, bytes(content), *args)
+
+        slot: int = await self._free.get()
+        offset: int = slot * self.slot_size
+        self._memory.buf[offset:offset + len(content)] = content
+        future = self._pool.submit(_run_in_slot, func, offset, len(content), self.slot_size, args)
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # The worker may still be writing into the slot; free it only once it has finished.
+            future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release, slot))
+            raise
+        except BaseException:
+            self._release(slot)
+            raise
+
+        if isinstance(result, _InSlot):
+            return SharedMemoryResult(self, slot, self._memory.buf[offset:offset + result.length])
+        self._release(slot)
+        return result
+
+    def shutdown(self) -> None:
+        """Stops the workers and frees the shared memory block."""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        try:
+            self._memory.close()
+        except BufferError:
+            logger.warning("Shared memory results were not released before shutdown.")
+        self._memory.unlink()
+
+
+CpuExecutor = Union[Executor, SharedMemoryExecutor]
+
+
+async def run_cpu_stage(executor: CpuExecutor, func: Callable[..., Any], content: Any, *args: Any) -> Any:
+    """Runs an image stage function on either kind of CPU executor.
+
+    Args:
+        executor: A concurrent.futures Executor or a SharedMemoryExecutor.
+        func: The module-level stage function.
+        content: The bytes-like input.
+        *args: Extra arguments for func.
+
+    Returns:
+        The function's result; a SharedMemoryResult when the shared memory
+        path returned bytes.
+    """
+    if isinstance(executor, SharedMemoryExecutor):
+        return await executor.run(func, content, *args)
+    if isinstance(content, memoryview):
+        # Views (e.g. over a spilled media buffer) cannot be pickled to a worker.
+        content = content.tobytes()
+    return await asyncio.get_running_loop().run_in_executor(executor, func, content, *args)
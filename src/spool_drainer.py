@@ -0,0 +1,136 @@
+"""
+Drains the upload spool in the background.
+
+Each due item's content is downloaded from LINE again and streamed into the
+group's folder for the item's original date. Drive folder lookups run in a
+worker thread, so a drain pass does not block the event loop. LINE keeps
+message content only for a limited time, so items queued long after the
+message was sent keep failing; once an item has used up its attempts it is
+logged and left in the spool, where reconciliation reports it.
+"""
+import asyncio
+import logging
+from typing import Optional, Dict, Any
+
+from src.handlers.media_message_handler import stream_content_to_drive, stream_content_to_storage
+from src.storage_backends import StorageBackend
+from src.upload_spool import UploadSpool
+
+logger = logging.getLogger(__name__)
+
+
+async def drain_spool(
+    spool: UploadSpool,
+    gdrive_service: Any,
+    channel_access_token: str,
+    parent_folder_id: Optional[str],
+    upload_ledger: Optional[Any] = None,
+    limit: int = 50,
+) -> Dict[str, int]:
+    """Uploads the spool's due items again, streaming each from LINE.
+
+    Args:
+        spool: The spool to drain.
+        gdrive_service: The storage the items go to: the Google Drive service
+            or another StorageBackend.
+        channel_access_token: The access token for downloading content.
+        parent_folder_id: The root Google Drive folder ID for uploads.
+        upload_ledger: If given, ledger entries get the new Drive file IDs.
+        limit: The maximum number of items handled in this pass.
+
+    Returns:
+        The number of items uploaded and failed.
+    """
+    uploaded: int = 0
+    failed: int = 0
+    for item in spool.due(limit):
+        try:
+            group_folder_id: str = await asyncio.to_thread(
+                gdrive_service.find_or_create_folder, item.group_name, parent_folder_id=parent_folder_id
+            )
+            daily_folder_id: str = await asyncio.to_thread(
+                gdrive_service.find_or_create_folder, item.entry_date, parent_folder_id=group_folder_id
+            )
+            file_id: Optional[str]
+            if isinstance(gdrive_service, StorageBackend):
+                stored = await stream_content_to_storage(
+                    item.message_id, channel_access_token, gdrive_service, daily_folder_id, file_name=item.file_name
+                )
+                file_id = stored[0] if stored else None
+            else:
+                file_id = await stream_content_to_drive(
+                    item.message_id, channel_access_token, gdrive_service, daily_folder_id, file_name=item.file_name
+                )
+        except Exception as e:
+            logger.error("❌ Spooled upload failed: %s", e, extra={"message_id": item.message_id})
+            file_id = None
+        if file_id:
+            spool.mark_done(item.message_id)
+            if upload_ledger:
+                upload_ledger.update_file_id(item.message_id, file_id)
+            uploaded += 1
+        else:
+            spool.mark_failed(item.message_id)
+            failed += 1
+            if item.attempts + 1 >= spool.max_attempts:
+                logger.warning(
+                    "⚠️ Gave up on spooled upload (%s, %s) after %s attempts; its LINE content may have expired.",
+                    item.group_name, item.entry_date, spool.max_attempts, extra={"message_id": item.message_id},
+                )
+    if uploaded or failed:
+        logger.info("Spool drained: %s uploaded, %s failed.", uploaded, failed)
+    return {"uploaded": uploaded, "failed": failed}
+
+
+class SpoolDrainer:
+    """Periodically drains the upload spool in the background.
+
+    Attributes:
+        interval_seconds: The time between drain passes.
+    """
+    def __init__(
+        self,
+        spool: UploadSpool,
+        gdrive_service: Any,
+        channel_access_token: str,
+        parent_folder_id: Optional[str],
+        upload_ledger: Optional[Any] = None,
+        interval_seconds: float = 300.0,
+    ) -> None:
+        self.spool: UploadSpool = spool
+        self.interval_seconds: float = interval_seconds
+        self._gdrive_service = gdrive_service
+        self._channel_access_token: str = channel_access_token
+        self._parent_folder_id: Optional[str] = parent_folder_id
+        self._upload_ledger = upload_ledger
+        self._task: Optional[asyncio.Task] = None
+
+    async def drain(self) -> Dict[str, int]:
+        """Runs one drain pass now."""
+        return await drain_spool(
+            self.spool, self._gdrive_service, self._channel_access_token,
+            self._parent_folder_id, upload_ledger=self._upload_ledger,
+        )
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.drain()
+            except Exception as e:
+                logger.error("❌ Spool drain pass failed: %s", e)
+
+    def start(self) -> None:
+        """Starts the periodic drain loop on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the drain loop; queued items stay in the spool for the next start."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -1,6 +1,9 @@
 from typing import Dict, Optional, Any
+import logging
 import time
 
+logger = logging.getLogger(__name__)
+
 class StateManager:
     """Manages user sessions for multi-step interactions like photo uploads.
 
@@ -33,7 +36,7 @@ class StateManager:
             "group_name": group_name,
             "timestamp": time.time()
         }
-        print(f"Session started for user {user_id} in group {group_name}")
+        logger.info("Session started for user %s in group %s", user_id, group_name)
 
     def get_active_group(self, user_id: str) -> Optional[str]:
         """Retrieves the active group for a user if their session is valid.
@@ -53,12 +56,63 @@ class StateManager:
 
         elapsed_time: float = time.time() - session_data["timestamp"]
         if elapsed_time > self.SESSION_DURATION_SECONDS:
-            # Session expired, clear it and return None
-            del self._pending_uploads[user_id]
-            print(f"Session for user {user_id} has expired.")
+            # Session expired, clear it and return None (lookups may run in several threads)
+            self._pending_uploads.pop(user_id, None)
+            logger.info("Session for user %s has expired.", user_id)
             return None
         
         # Session is active, return the group name
         return session_data["group_name"]
 
-    
\ No newline at end of file
+    def stats(self) -> Dict[str, int]:
+        """Reports how many sessions are active and how many are stored.
+
+        Expired sessions are only removed when their user is looked up, so
+        the stored count includes those of users who never came back.
+        """
+        sessions = list(self._pending_uploads.values())
+        now: float = time.time()
+        active: int = sum(1 for session in sessions if now - session["timestamp"] <= self.SESSION_DURATION_SECONDS)
+        return {"active_sessions": active, "stored_sessions": len(sessions)}
+
+    
+
+class RedisStateManager(StateManager):
+    """Keeps user sessions in Redis, so that several worker processes share them.
+
+    Used when webhook events are consumed from a Redis Stream: consecutive
+    messages of one user may be handled by different workers. Sessions
+    expire through the key's TTL. The client is synchronous, so the
+    handlers call these methods through `asyncio.to_thread`.
+
+    Each session's expiry is also kept in a sorted set, so `stats()`
+    counts the active sessions with ZCARD instead of scanning the keys.
+    """
+    def __init__(
+        self,
+        redis_client: Any,
+        session_duration_seconds: int = StateManager.SESSION_DURATION_SECONDS,
+        key_prefix: str = "line_session_",
+    ) -> None:
+        super().__init__(session_duration_seconds)
+        self._redis: Any = redis_client
+        self._key_prefix: str = key_prefix
+        self._expiries_key: str = f"{key_prefix}expiries"
+
+    def set_pending_upload(self, user_id: str, group_name: str) -> None:
+        pipeline: Any = self._redis.pipeline()
+        pipeline.set(f"{self._key_prefix}{user_id}", group_name, ex=self.SESSION_DURATION_SECONDS)
+        pipeline.zadd(self._expiries_key, {user_id: time.time() + self.SESSION_DURATION_SECONDS})
+        pipeline.execute()
+
+    def get_active_group(self, user_id: str) -> Optional[str]:
+        group_name: Optional[Any] = self._redis.get(f"{self._key_prefix}{user_id}")
+        return group_name.decode("utf-8") if isinstance(group_name, bytes) else group_name
+
+    def stats(self) -> Dict[str, int]:
+        """Reports how many sessions are active, dropping expired ones from the sorted set first."""
+        pipeline: Any = self._redis.pipeline()
+        pipeline.zremrangebyscore(self._expiries_key, "-inf", time.time())
+        pipeline.zcard(self._expiries_key)
+        _, active = pipeline.execute()
+        return {"active_sessions": active}
@@ -0,0 +1,375 @@
+"""
+Storage backends other than Google Drive for photos, videos, files and notes.
+
+The handlers only need a few calls from their storage:
+`find_or_create_folder`, `upload_file`, `append_text_to_file`,
+`read_text_file` and `write_text_file`. A StorageBackend offers the same
+calls with the same `<group>/<date>` layout as GoogleDriveService, so a site
+can store its uploads somewhere cheaper and faster than Drive. A folder ID is
+simply the folder's path relative to the backend's root, and a file ID is
+the file's path. Given the app's upload index, a backend skips messages it
+has already stored, like Drive does.
+
+Two backends are provided:
+
+- LocalStorageBackend writes into a directory. Every file is written to a
+  temporary file next to its destination and renamed into place, so readers
+  never see a partial file. Content spilled to disk is copied with
+  `os.sendfile` where the platform supports it.
+- S3StorageBackend writes to an S3-compatible bucket (AWS S3, MinIO, ...).
+  Content larger than one part is sent as a multipart upload, one part at a
+  time, so memory use does not depend on the size of the file.
+"""
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Optional, Dict, List, Tuple, Union, BinaryIO, Any
+
+from src import metrics
+from src.upload_index import UploadIndex, IndexedUpload
+
+logger = logging.getLogger(__name__)
+
+# S3 requires every part of a multipart upload but the last to be at least 5 MiB.
+MIN_PART_SIZE: int = 5 * 1024 * 1024
+DEFAULT_PART_SIZE: int = 8 * 1024 * 1024
+COPY_CHUNK_SIZE: int = 1024 * 1024
+
+
+def _safe_name(name: str) -> str:
+    """Makes a folder or file name safe to use as a single path segment."""
+    cleaned: str = name.replace("/", "_").replace("\\", "_").strip()
+    return cleaned if cleaned not in ("", ".", "..") else "_"
+
+
+def _join(folder_id: Optional[str], name: str) -> str:
+    return f"{folder_id}/{_safe_name(name)}" if folder_id else _safe_name(name)
+
+
+def _format_note(text: str) -> str:
+    """Formats a note line like `GoogleDriveService.append_text_to_file`."""
+    return f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {text}"
+
+
+def _digests(stream: BinaryIO) -> Tuple[str, str, int]:
+    """Returns the SHA-256 and MD5 hex digests and the size of a stream from its current position.
+
+    The stream is moved back to that position afterwards.
+    """
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    size: int = 0
+    start: int = stream.tell()
+    while chunk := stream.read(COPY_CHUNK_SIZE):
+        sha256.update(chunk)
+        md5.update(chunk)
+        size += len(chunk)
+    stream.seek(start)
+    return sha256.hexdigest(), md5.hexdigest(), size
+
+
+class StorageBackend(ABC):
+    """The storage calls the handlers make, as offered by GoogleDriveService.
+
+    Subclasses implement the abstract methods below. With an upload index,
+    `upload_file` is idempotent per LINE message ID like Drive's: a
+    redelivered message is not stored again, and the index records the
+    size and digests of every stored message.
+
+    Attributes:
+        upload_index: The optional index of stored messages.
+    """
+    def __init__(self, upload_index: Optional[UploadIndex] = None) -> None:
+        self.upload_index: Optional[UploadIndex] = upload_index
+        self._locks: Dict[str, threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+
+    def _lock_for(self, file_id: str) -> threading.Lock:
+        with self._registry_lock:
+            return self._locks.setdefault(file_id, threading.Lock())
+
+    @abstractmethod
+    def find_or_create_folder(self, folder_name: str, parent_folder_id: Optional[str] = None) -> str:
+        """Returns the ID of a folder inside parent_folder_id (or the root), creating it if needed."""
+
+    def upload_file(
+        self,
+        file_name: str,
+        file_content: Union[bytes, memoryview, BinaryIO],
+        folder_id: str,
+        message_id: Optional[str] = None,
+        app_properties: Optional[Dict[str, str]] = None,
+        mime_type: str = 'image/jpeg',
+    ) -> str:
+        """Stores content as a file in a folder and returns the file's ID.
+
+        A message already in the upload index is not stored again; the ID
+        of its file is returned. File objects must be seekable when the
+        backend has an index, since their digests are computed first.
+        """
+        if not (self.upload_index and message_id):
+            return self._store(file_name, file_content, folder_id, message_id, app_properties, mime_type)
+        existing: Optional[IndexedUpload] = self.upload_index.find_by_message_id(message_id)
+        metrics.record_cache_lookup("upload_index", hit=existing is not None)
+        if existing:
+            logger.info("Skipping upload of '%s': already stored as file ID %s.", file_name, existing.file_id)
+            return existing.file_id
+        if isinstance(file_content, (bytes, bytearray, memoryview)):
+            sha256, md5, size = _digests(io.BytesIO(file_content))
+        else:
+            sha256, md5, size = _digests(file_content)
+        file_id: str = self._store(file_name, file_content, folder_id, message_id, app_properties, mime_type)
+        self.upload_index.record(IndexedUpload(
+            message_id=message_id, sha256=sha256, md5=md5, size=size,
+            file_id=file_id, folder_id=folder_id, file_name=file_name,
+        ))
+        return file_id
+
+    @abstractmethod
+    def _store(
+        self,
+        file_name: str,
+        file_content: Union[bytes, memoryview, BinaryIO],
+        folder_id: str,
+        message_id: Optional[str],
+        app_properties: Optional[Dict[str, str]],
+        mime_type: str,
+    ) -> str:
+        """Writes content as a file in a folder and returns the file's ID."""
+
+    @abstractmethod
+    def read_text_file(self, file_name: str, folder_id: str) -> Optional[Tuple[str, str]]:
+        """Returns the ID and text of a file, or None if there is no such file."""
+
+    @abstractmethod
+    def write_text_file(self, file_name: str, content: str, folder_id: str, file_id: Optional[str] = None) -> str:
+        """Creates or overwrites a text file and returns its ID."""
+
+    def append_text_to_file(self, file_name: str, text_to_append: str, folder_id: str) -> None:
+        """Appends a timestamped line of text to a file, creating it if needed.
+
+        Appends to the same file are serialised within the process.
+        """
+        with self._lock_for(_join(folder_id, file_name)):
+            existing: Optional[Tuple[str, str]] = self.read_text_file(file_name, folder_id)
+            line: str = _format_note(text_to_append)
+            content: str = f"{existing[1]}\n{line}" if existing else line
+            self.write_text_file(file_name, content, folder_id, file_id=existing[0] if existing else None)
+        logger.info("Appended text to '%s'.", _join(folder_id, file_name))
+
+
+class LocalStorageBackend(StorageBackend):
+    """Stores files in a local directory tree.
+
+    Attributes:
+        root_dir: The directory the group folders are created in.
+    """
+    def __init__(self, root_dir: str, upload_index: Optional[UploadIndex] = None) -> None:
+        super().__init__(upload_index)
+        self.root_dir: str = os.path.abspath(root_dir)
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _path(self, relative_path: str) -> str:
+        return os.path.join(self.root_dir, *relative_path.split("/"))
+
+    def find_or_create_folder(self, folder_name: str, parent_folder_id: Optional[str] = None) -> str:
+        folder_id: str = _join(parent_folder_id, folder_name)
+        os.makedirs(self._path(folder_id), exist_ok=True)
+        return folder_id
+
+    @staticmethod
+    def _copy(source: BinaryIO, target_fd: int) -> None:
+        """Copies a file object into target_fd, in the kernel if source is a real file."""
+        try:
+            source_fd: int = source.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            source_fd = -1
+        if source_fd >= 0 and hasattr(os, "sendfile"):
+            offset: int = source.tell()
+            try:
+                while True:
+                    sent: int = os.sendfile(target_fd, source_fd, offset, COPY_CHUNK_SIZE)
+                    if sent == 0:
+                        return
+                    offset += sent
+            except OSError:
+                # Not supported for this pair of files; copy the rest in user space.
+                source.seek(offset)
+        with os.fdopen(os.dup(target_fd), "wb") as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+
+    def _write_atomically(self, file_id: str, content: Union[bytes, memoryview, BinaryIO]) -> None:
+        path: str = self._path(file_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".part")
+        try:
+            if isinstance(content, (bytes, bytearray, memoryview)):
+                with os.fdopen(os.dup(fd), "wb") as target:
+                    target.write(content)
+            else:
+                self._copy(content, fd)
+            os.fsync(fd)
+            os.close(fd)
+            fd = -1
+            os.replace(temp_path, path)
+        except BaseException:
+            if fd >= 0:
+                os.close(fd)
+            os.unlink(temp_path)
+            raise
+
+    def _store(
+        self,
+        file_name: str,
+        file_content: Union[bytes, memoryview, BinaryIO],
+        folder_id: str,
+        message_id: Optional[str],
+        app_properties: Optional[Dict[str, str]],
+        mime_type: str,
+    ) -> str:
+        file_id: str = _join(folder_id, file_name)
+        self._write_atomically(file_id, file_content)
+        logger.info("File '%s' stored at '%s'.", file_name, self._path(file_id))
+        return file_id
+
+    def append_text_to_file(self, file_name: str, text_to_append: str, folder_id: str) -> None:
+        file_id: str = _join(folder_id, file_name)
+        path: str = self._path(file_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock_for(file_id), open(path, "a", encoding="utf-8") as f:
+            if f.tell():
+                f.write("\n")
+            f.write(_format_note(text_to_append))
+        logger.info("Appended text to '%s'.", path)
+
+    def read_text_file(self, file_name: str, folder_id: str) -> Optional[Tuple[str, str]]:
+        file_id: str = _join(folder_id, file_name)
+        try:
+            with open(self._path(file_id), "r", encoding="utf-8", errors="replace") as f:
+                return file_id, f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_text_file(self, file_name: str, content: str, folder_id: str, file_id: Optional[str] = None) -> str:
+        file_id = file_id or _join(folder_id, file_name)
+        self._write_atomically(file_id, content.encode("utf-8"))
+        return file_id
+
+
+class S3StorageBackend(StorageBackend):
+    """Stores files in an S3-compatible bucket.
+
+    S3 has no folders, so creating one costs no request; a folder ID is just
+    the key prefix of its files. The LINE message ID and any extra
+    properties are stored as object metadata (e.g. `line-message-id`).
+
+    Attributes:
+        bucket: The bucket the files are stored in.
+        prefix: A key prefix for every object, e.g. "line-photos".
+        part_size: The size of each part of a multipart upload.
+    """
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        client: Optional[Any] = None,
+        endpoint_url: Optional[str] = None,
+        part_size: int = DEFAULT_PART_SIZE,
+        upload_index: Optional[UploadIndex] = None,
+    ) -> None:
+        """Initializes the backend.
+
+        Args:
+            bucket: The bucket the files are stored in.
+            prefix: A key prefix for every object.
+            client: A ready boto3 S3 client. If omitted, one is created.
+            endpoint_url: The endpoint of an S3-compatible service such as
+                MinIO; AWS S3 if omitted.
+            part_size: The multipart upload part size, at least 5 MiB.
+            upload_index: The optional index of stored messages.
+        """
+        super().__init__(upload_index)
+        if client is None:
+            try:
+                import boto3  # Optional, and slow to import; only the S3 backend needs it.
+            except ImportError:
+                raise RuntimeError("boto3 is required for the S3 storage backend.")
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self._client: Any = client
+        self.bucket: str = bucket
+        self.prefix: str = prefix.strip("/")
+        self.part_size: int = max(part_size, MIN_PART_SIZE)
+
+    def _key(self, file_id: str) -> str:
+        return f"{self.prefix}/{file_id}" if self.prefix else file_id
+
+    def find_or_create_folder(self, folder_name: str, parent_folder_id: Optional[str] = None) -> str:
+        return _join(parent_folder_id, folder_name)
+
+    def _upload(self, key: str, stream: BinaryIO, mime_type: str, metadata: Dict[str, str]) -> None:
+        """Uploads a stream, as a single request if it fits in one part and as a multipart upload otherwise."""
+        data: bytes = stream.read(self.part_size)
+        if len(data) < self.part_size:
+            self._client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=mime_type, Metadata=metadata)
+            return
+
+        upload_id: str = self._client.create_multipart_upload(
+            Bucket=self.bucket, Key=key, ContentType=mime_type, Metadata=metadata
+        )["UploadId"]
+        parts: List[Dict[str, Any]] = []
+        try:
+            while data:
+                part_number: int = len(parts) + 1
+                response: Dict[str, Any] = self._client.upload_part(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data
+                )
+                parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+                data = stream.read(self.part_size)
+            self._client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            # Parts of an unfinished upload are billed until it is aborted.
+            self._client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def _store(
+        self,
+        file_name: str,
+        file_content: Union[bytes, memoryview, BinaryIO],
+        folder_id: str,
+        message_id: Optional[str],
+        app_properties: Optional[Dict[str, str]],
+        mime_type: str,
+    ) -> str:
+        file_id: str = _join(folder_id, file_name)
+        stream: BinaryIO = (
+            io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray, memoryview)) else file_content
+        )
+        # Metadata travels as HTTP headers, which do not reliably keep underscores.
+        metadata: Dict[str, str] = {key.replace("_", "-"): value for key, value in (app_properties or {}).items()}
+        if message_id:
+            metadata["line-message-id"] = message_id
+        self._upload(self._key(file_id), stream, mime_type, metadata)
+        logger.info("File '%s' stored at s3://%s/%s.", file_name, self.bucket, self._key(file_id))
+        return file_id
+
+    def read_text_file(self, file_name: str, folder_id: str) -> Optional[Tuple[str, str]]:
+        file_id: str = _join(folder_id, file_name)
+        try:
+            response: Dict[str, Any] = self._client.get_object(Bucket=self.bucket, Key=self._key(file_id))
+        except self._client.exceptions.NoSuchKey:
+            return None
+        return file_id, response["Body"].read().decode("utf-8", errors="replace")
+
+    def write_text_file(self, file_name: str, content: str, folder_id: str, file_id: Optional[str] = None) -> str:
+        file_id = file_id or _join(folder_id, file_name)
+        self._client.put_object(
+            Bucket=self.bucket, Key=self._key(file_id), Body=content.encode("utf-8"), ContentType="text/plain"
+        )
+        return file_id
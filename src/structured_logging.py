@@ -0,0 +1,210 @@
+"""
+Logging off the event loop, as JSON records with per-event correlation IDs.
+
+`configure()` replaces the root logger's handlers with one QueueHandler. A
+logging call on the event loop only checks the rate limit, copies the
+record and puts it on a bounded queue. A QueueListener thread formats the
+records and writes them to stdout, so a slow stdout never stalls the loop.
+
+Records are formatted in the listener thread, not when they are logged.
+Hot paths therefore log with %-style arguments,
+`logger.info("Saved %s", message_id)`, not f-strings; the message string is
+only built for records that are actually written.
+
+`bind(message_id=..., user_id=...)` adds fields to every record logged in
+the block, including in tasks and threads started from it. The ID of the
+current trace is added as well, so a log line can be matched with its
+trace (see `src.tracing`). Other threads can read the fields bound in a
+task with `fields_of(task)`.
+
+INFO and DEBUG records are rate limited per call site (logger and line).
+Past the limit they are dropped before they are formatted. The next record
+from that call site that gets through carries the number that were dropped.
+Warnings and errors are never dropped by the rate limit. When the queue is
+full, a record is dropped rather than blocking the caller, and counted.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, Dict, Any, Iterator, Tuple, TextIO
+
+from src import tracing
+
+TEXT_FORMAT: str = '%(asctime)s - %(levelname)s - %(message)s'
+
+_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("log_context", default={})
+
+# Attributes every LogRecord has; anything else was passed with `extra=` or bound with bind().
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+# The bound fields of each task, for code that cannot see the task's context (see fields_of()).
+_task_fields: Dict["asyncio.Task[Any]", Dict[str, Any]] = {}
+
+
+def _current_task() -> Optional["asyncio.Task[Any]"]:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:  # Not on an event loop, e.g. in a worker thread.
+        return None
+
+
+@contextmanager
+def bind(**fields: Any) -> Iterator[None]:
+    """Adds the fields to every record logged in the block."""
+    bound: Dict[str, Any] = {**_context.get(), **fields}
+    token = _context.set(bound)
+    task = _current_task()
+    previous: Optional[Dict[str, Any]] = None
+    if task is not None:
+        previous = _task_fields.get(task)
+        _task_fields[task] = {**bound, "trace_id": tracing.current_trace_id()}
+    try:
+        yield
+    finally:
+        _context.reset(token)
+        if task is not None:
+            if previous is None:
+                _task_fields.pop(task, None)
+            else:
+                _task_fields[task] = previous
+
+
+def fields_of(task: Optional["asyncio.Task[Any]"]) -> Dict[str, Any]:
+    """The fields bound in a task, read from another thread (e.g. a watchdog); empty if none are."""
+    fields: Dict[str, Any] = _task_fields.get(task, {}) if task is not None else {}
+    return {key: value for key, value in fields.items() if value is not None}
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `per_second` INFO/DEBUG records per call site, with bursts of as many.
+
+    Attributes:
+        per_second: The sustained rate per call site; 0 turns the limit off.
+    """
+    def __init__(self, per_second: float = 10.0) -> None:
+        super().__init__()
+        self.per_second: float = per_second
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, int], list] = {}  # call site -> [tokens, last refill, suppressed]
+        self._suppressed: int = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.per_second <= 0 or record.levelno > logging.INFO:
+            return True
+        now: float = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.setdefault((record.name, record.lineno), [self.per_second, now, 0])
+            bucket[0] = min(self.per_second, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self._suppressed += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+    @property
+    def suppressed(self) -> int:
+        return self._suppressed
+
+
+class ContextQueueHandler(QueueHandler):
+    """Puts records on the queue with the bound fields and trace ID, without formatting them."""
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]") -> None:
+        super().__init__(log_queue)
+        self._dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler.prepare, the message is left unformatted; the listener formats it.
+        # A shallow copy, without running LogRecord.__init__ again (makeLogRecord would double the cost).
+        prepared: logging.LogRecord = logging.LogRecord.__new__(logging.LogRecord)
+        prepared.__dict__.update(record.__dict__)
+        for key, value in _context.get().items():
+            setattr(prepared, key, value)
+        trace_id: Optional[str] = tracing.current_trace_id()
+        if trace_id:
+            prepared.trace_id = trace_id
+        if record.exc_info:
+            # Traceback objects keep their frames alive; the text is all the listener needs.
+            prepared.exc_text = logging.Formatter().formatException(record.exc_info)
+            prepared.exc_info = None
+        return prepared
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Reports the records waiting to be written and those dropped by a full queue or the rate limit."""
+        rate_limit: int = sum(f.suppressed for f in self.filters if isinstance(f, RateLimitFilter))
+        return {"queued": self.queue.qsize(), "dropped_full": self._dropped, "dropped_rate_limit": rate_limit}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one line of JSON, with its bound and `extra=` fields."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextTextFormatter(logging.Formatter):
+    """The plain text format, followed by the record's bound and `extra=` fields as key=value pairs."""
+    def format(self, record: logging.LogRecord) -> str:
+        line: str = super().format(record)
+        fields: str = " ".join(
+            f"{key}={value}" for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES
+        )
+        return f"{line} [{fields}]" if fields else line
+
+
+def configure(
+    level: int = logging.INFO,
+    json_format: bool = True,
+    rate_per_second: float = 10.0,
+    queue_size: int = 10000,
+    stream: TextIO = sys.stdout,
+) -> Tuple[ContextQueueHandler, QueueListener]:
+    """Routes the root logger through a queue to a listener thread writing to the stream.
+
+    Returns the handler (whose `stats()` report drops) and the started
+    listener; stop the listener to flush the queue on exit.
+    """
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate_per_second))
+
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(JsonFormatter() if json_format else ContextTextFormatter(TEXT_FORMAT))
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root: logging.Logger = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener.start()
+    return queue_handler, listener
@@ -0,0 +1,321 @@
+"""
+Traces webhook deliveries with custom spans and tail-based sampling.
+
+Each delivery gets a trace: a "webhook" span for the request, a
+"process_delivery" span for the background task that handles it, and child
+spans for the LINE download, every Drive call and Redis. The current span
+lives in a context variable. Tasks and `asyncio.to_thread` calls copy the
+context, so spans opened there become children of the span that started
+them.
+
+A trace's spans are kept in memory until all of them have ended. Then the
+Sampler decides whether to export the trace:
+- Traces with an error are always kept.
+- So are traces that took at least `slow_seconds`.
+- Of the rest, `rate` are kept at random.
+Sampling at the end means errors and slow deliveries are never lost to
+sampling. A trace that is dropped costs only the spans' bookkeeping.
+
+Kept traces go to an exporter:
+- InMemoryExporter keeps the most recent ones for `GET /traces`.
+- JsonLinesExporter appends them to a file.
+- SentryExporter sends them to Sentry as transactions.
+
+Tracing is off until `configure()` installs a Tracer; until then `span()`
+does nothing.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional, Dict, List, Any, Callable, Deque, Iterator, TypeVar
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+@dataclass
+class Span:
+    """One timed operation of a trace."""
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "start": self.start, "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes, "error": self.error,
+        }
+
+
+class Sampler:
+    """Decides which finished traces are exported.
+
+    Attributes:
+        rate: The share of ordinary traces that are kept, from 0 to 1.
+        slow_seconds: Traces at least this long are always kept.
+    """
+    def __init__(self, rate: float = 0.1, slow_seconds: float = 5.0, random_fn: Callable[[], float] = random.random) -> None:
+        self.rate: float = rate
+        self.slow_seconds: float = slow_seconds
+        self._random = random_fn
+
+    def keep(self, spans: List[Span]) -> Optional[str]:
+        """Returns why the trace is kept ("error", "slow" or "sampled"), or None to drop it."""
+        if any(span.error for span in spans):
+            return "error"
+        duration: float = max(span.end for span in spans) - min(span.start for span in spans)
+        if duration >= self.slow_seconds:
+            return "slow"
+        if self._random() < self.rate:
+            return "sampled"
+        return None
+
+
+class InMemoryExporter:
+    """Keeps the most recent kept traces in memory."""
+    def __init__(self, max_traces: int = 200) -> None:
+        self._traces: Deque[Dict[str, Any]] = deque(maxlen=max_traces)
+
+    def export(self, spans: List[Span], reason: str) -> None:
+        self._traces.append({"reason": reason, "spans": [span.to_dict() for span in spans]})
+
+    def traces(self) -> List[Dict[str, Any]]:
+        """Returns the kept traces, newest first."""
+        return list(reversed(self._traces))
+
+
+class JsonLinesExporter:
+    """Appends each kept trace to a file as one line of JSON."""
+    def __init__(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path: str = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span], reason: str) -> None:
+        line: str = json.dumps({"reason": reason, "spans": [span.to_dict() for span in spans]}, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class SentryExporter:
+    """Sends each kept trace to Sentry as a transaction with child spans.
+
+    Sentry should be initialized with `traces_sample_rate=0`, so that its
+    own automatic transactions are off and the Sampler alone decides what
+    is sent.
+    """
+    def export(self, spans: List[Span], reason: str) -> None:
+        import sentry_sdk
+
+        def timestamp(seconds: float) -> datetime:
+            return datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+        children: Dict[Optional[str], List[Span]] = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+        span_ids = {span.span_id for span in spans}
+        roots: List[Span] = [span for span in spans if span.parent_id not in span_ids]
+
+        def add_children(sentry_span: Any, span: Span) -> None:
+            for child in children.get(span.span_id, []):
+                sentry_child = sentry_span.start_child(op=child.name, name=child.name, start_timestamp=timestamp(child.start))
+                for key, value in child.attributes.items():
+                    sentry_child.set_data(key, value)
+                if child.error:
+                    sentry_child.set_status("internal_error")
+                    sentry_child.set_data("error", child.error)
+                add_children(sentry_child, child)
+                sentry_child.finish(end_timestamp=timestamp(child.end))
+
+        for root in roots:
+            transaction = sentry_sdk.start_transaction(
+                name=root.name, op=root.name, trace_id=root.trace_id, parent_span_id=root.parent_id, sampled=True,
+                start_timestamp=timestamp(root.start),
+            )
+            transaction.set_tag("sampling_reason", reason)
+            for key, value in root.attributes.items():
+                transaction.set_data(key, value)
+            if root.error:
+                transaction.set_status("internal_error")
+            add_children(transaction, root)
+            transaction.finish(end_timestamp=timestamp(root.end))
+
+
+class _OpenTrace:
+    __slots__ = ("spans", "open")
+
+    def __init__(self) -> None:
+        self.spans: List[Span] = []
+        self.open: int = 0
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(hex_digits: int) -> str:
+    return f"{random.getrandbits(hex_digits * 4):0{hex_digits}x}"
+
+
+class Tracer:
+    """Records spans, buffers each trace until it ends and exports the sampled ones."""
+    def __init__(self, sampler: Sampler, exporter: Any) -> None:
+        self.sampler: Sampler = sampler
+        self.exporter: Any = exporter
+        self._lock = threading.Lock()
+        self._traces: Dict[str, _OpenTrace] = {}
+        self._kept: int = 0
+        self._dropped: int = 0
+        self._export_failures: int = 0
+
+    def start_span(self, name: str, traceparent: Optional[str] = None, **attributes: Any) -> Span:
+        """Starts a span under the current span, or under a remote parent given as a traceparent.
+
+        The span is not made current; use activate() for that, e.g. in the
+        background task that continues the work.
+        """
+        parent: Optional[Span] = _current_span.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        elif traceparent:
+            _, trace_id, parent_id, _ = traceparent.split("-")
+        else:
+            trace_id, parent_id = _new_id(32), None
+        span = Span(name, trace_id, _new_id(16), parent_id, time.time(), attributes=dict(attributes))
+        with self._lock:
+            trace: _OpenTrace = self._traces.setdefault(trace_id, _OpenTrace())
+            trace.spans.append(span)
+            trace.open += 1
+        return span
+
+    @contextmanager
+    def activate(self, span: Span) -> Iterator[Span]:
+        """Makes a started span current for the block and ends it afterwards."""
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span)
+
+    def end_span(self, span: Span) -> None:
+        span.end = time.time()
+        with self._lock:
+            trace: Optional[_OpenTrace] = self._traces.get(span.trace_id)
+            if trace is None:
+                return
+            trace.open -= 1
+            if trace.open > 0:
+                return
+            del self._traces[span.trace_id]
+        self._finish_trace(trace.spans)
+
+    def _finish_trace(self, spans: List[Span]) -> None:
+        reason: Optional[str] = self.sampler.keep(spans)
+        if reason is None:
+            self._dropped += 1
+            return
+        self._kept += 1
+        try:
+            self.exporter.export(spans, reason)
+        except Exception as e:
+            self._export_failures += 1
+            logger.warning("⚠️ Exporting a trace failed: %s", e)
+
+    def stats(self) -> Dict[str, int]:
+        """Reports the traces kept and dropped so far and those still open."""
+        with self._lock:
+            open_traces: int = len(self._traces)
+        return {
+            "traces_kept": self._kept,
+            "traces_dropped": self._dropped,
+            "traces_open": open_traces,
+            "export_failures": self._export_failures,
+        }
+
+
+_tracer: Optional[Tracer] = None
+
+
+def configure(tracer: Optional[Tracer]) -> None:
+    """Installs the tracer used by span(), or turns tracing off with None."""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    """The installed tracer, or None when tracing is off."""
+    return _tracer
+
+
+def start_span(name: str, traceparent: Optional[str] = None, **attributes: Any) -> Optional[Span]:
+    """Starts a span to be activated later, or returns None when tracing is off."""
+    return _tracer.start_span(name, traceparent, **attributes) if _tracer else None
+
+
+@contextmanager
+def activate(span: Optional[Span]) -> Iterator[Optional[Span]]:
+    """Makes a span from start_span() current for the block; does nothing for None."""
+    if span is None or _tracer is None:
+        yield span
+        return
+    with _tracer.activate(span):
+        yield span
+
+
+@contextmanager
+def span(name: str, traceparent: Optional[str] = None, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Records the block as a span of the current trace (or starts a new trace)."""
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.activate(_tracer.start_span(name, traceparent, **attributes)) as started:
+        yield started
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Records every call of a (blocking) function as a span."""
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def traceparent() -> Optional[str]:
+    """The current span as a W3C traceparent header value, for continuing the trace elsewhere."""
+    current: Optional[Span] = _current_span.get()
+    return f"00-{current.trace_id}-{current.span_id}-01" if current else None
+
+
+def current_trace_id() -> Optional[str]:
+    """The ID of the current trace, for correlating log records with it."""
+    current: Optional[Span] = _current_span.get()
+    return current.trace_id if current else None
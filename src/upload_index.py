@@ -0,0 +1,196 @@
+"""
+A local, persistent index of files that have already been uploaded to Drive.
+
+Every upload is keyed by the LINE message ID and by the SHA-256 of its
+content. Checking this index before uploading turns a retried or redelivered
+event into a cheap lookup instead of a second multi-megabyte upload. The
+stored MD5 digest allows the index to be reconciled against the
+`md5Checksum` that Google Drive reports for each file.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, List, Any
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class IndexedUpload:
+    """A single entry of the upload index."""
+    message_id: str
+    sha256: str
+    md5: str
+    size: int
+    file_id: str
+    folder_id: str
+    file_name: str
+
+
+class UploadIndex:
+    """A SQLite-backed index mapping message IDs and content hashes to Drive files.
+
+    The index is safe to share between threads; all access goes through a
+    single connection guarded by a lock.
+    """
+    def __init__(self, db_path: str) -> None:
+        if db_path != ":memory:" and os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS uploads (
+                    message_id TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    md5 TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    file_id TEXT NOT NULL,
+                    folder_id TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    uploaded_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_uploads_folder_sha ON uploads (folder_id, sha256)"
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS resumable_sessions (
+                    message_id TEXT PRIMARY KEY,
+                    session_uri TEXT NOT NULL,
+                    started_at REAL NOT NULL
+                )
+                """
+            )
+
+    @staticmethod
+    def _to_entry(row: Optional[sqlite3.Row]) -> Optional[IndexedUpload]:
+        if row is None:
+            return None
+        return IndexedUpload(
+            message_id=row["message_id"],
+            sha256=row["sha256"],
+            md5=row["md5"],
+            size=row["size"],
+            file_id=row["file_id"],
+            folder_id=row["folder_id"],
+            file_name=row["file_name"],
+        )
+
+    def find_by_message_id(self, message_id: str) -> Optional[IndexedUpload]:
+        """Returns the upload recorded for a LINE message ID, if any."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM uploads WHERE message_id = ?", (message_id,)
+            ).fetchone()
+        return self._to_entry(row)
+
+    def find_by_hash(self, sha256: str, folder_id: str) -> Optional[IndexedUpload]:
+        """Returns an upload with identical content in the same folder, if any."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM uploads WHERE sha256 = ? AND folder_id = ? LIMIT 1",
+                (sha256, folder_id),
+            ).fetchone()
+        return self._to_entry(row)
+
+    def record(self, entry: IndexedUpload) -> None:
+        """Adds or replaces the index entry for a message ID."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO uploads
+                    (message_id, sha256, md5, size, file_id, folder_id, file_name, uploaded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    entry.message_id, entry.sha256, entry.md5, entry.size,
+                    entry.file_id, entry.folder_id, entry.file_name, time.time(),
+                ),
+            )
+
+    def entries_by_folder(self) -> Dict[str, List[IndexedUpload]]:
+        """Returns all index entries grouped by their Drive folder ID."""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM uploads ORDER BY folder_id").fetchall()
+        grouped: Dict[str, List[IndexedUpload]] = {}
+        for row in rows:
+            entry = self._to_entry(row)
+            grouped.setdefault(entry.folder_id, []).append(entry)
+        return grouped
+
+    def remove(self, message_ids: List[str]) -> None:
+        """Deletes the entries for the given message IDs."""
+        if not message_ids:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM uploads WHERE message_id = ?", [(m,) for m in message_ids]
+            )
+
+    def reconcile(self, gdrive_service: Any) -> Dict[str, int]:
+        """Drops entries that no longer match what Google Drive holds.
+
+        Each folder referenced by the index is listed once, and an entry is
+        kept only if its file still exists and Drive's `md5Checksum` equals
+        the locally recorded MD5 digest. Stale entries are removed so the
+        next upload of that content goes through again.
+
+        Args:
+            gdrive_service: The GoogleDriveService used to list folder checksums.
+
+        Returns:
+            A summary with the number of entries checked and removed.
+        """
+        checked: int = 0
+        stale: List[str] = []
+        for folder_id, entries in self.entries_by_folder().items():
+            checksums: Dict[str, Optional[str]] = gdrive_service.list_file_checksums(folder_id)
+            for entry in entries:
+                checked += 1
+                if checksums.get(entry.file_id) != entry.md5:
+                    stale.append(entry.message_id)
+
+        self.remove(stale)
+        logger.info("Upload index reconciled: %s checked, %s stale entries removed.", checked, len(stale))
+        return {"checked": checked, "removed": len(stale)}
+
+    def save_resumable_session(self, message_id: str, session_uri: str) -> None:
+        """Remembers the Drive resumable session of an in-progress upload."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO resumable_sessions (message_id, session_uri, started_at) VALUES (?, ?, ?)",
+                (message_id, session_uri, time.time()),
+            )
+
+    def get_resumable_session(self, message_id: str, max_age_seconds: float = 6 * 24 * 3600) -> Optional[str]:
+        """Returns the session URI of an interrupted upload, if still fresh.
+
+        Drive keeps resumable sessions for about a week, so older sessions
+        are ignored.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT session_uri, started_at FROM resumable_sessions WHERE message_id = ?", (message_id,)
+            ).fetchone()
+        if row is None or time.time() - row["started_at"] > max_age_seconds:
+            return None
+        return row["session_uri"]
+
+    def clear_resumable_session(self, message_id: str) -> None:
+        """Forgets the resumable session of a finished or abandoned upload."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM resumable_sessions WHERE message_id = ?", (message_id,))
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,207 @@
+"""
+A local ledger of every saved upload and note, with per-group daily rollups.
+
+Answering "how many photos did Site B send today, and how many bytes" used
+to require listing Drive folders. The UploadLedger records each saved item
+(message ID, user, group, date, bytes, Drive file ID and latency) in an
+indexed SQLite table. In the same transaction it updates a rollup row per
+group, day and kind, so statistics are read from a handful of
+pre-aggregated rows instead of being counted on demand.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+from linebot.v3.webhooks import MessageEvent
+
+logger = logging.getLogger(__name__)
+
+
+def event_latency_ms(event: MessageEvent) -> float:
+    """Returns the milliseconds between LINE receiving a message and now."""
+    return max(0.0, time.time() * 1000 - event.timestamp)
+
+
+@dataclass(frozen=True)
+class LedgerEntry:
+    """A single saved item recorded in the ledger."""
+    message_id: str
+    user_id: str
+    group_name: str
+    entry_date: str
+    kind: str
+    bytes: int
+    file_id: Optional[str]
+
+
+class UploadLedger:
+    """A SQLite-backed ledger of saved items and their daily rollups.
+
+    The ledger is safe to share between threads; all access goes through a
+    single connection guarded by a lock.
+    """
+    def __init__(self, db_path: str) -> None:
+        if db_path != ":memory:" and os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ledger (
+                    message_id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    group_name TEXT NOT NULL,
+                    entry_date TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    file_id TEXT,
+                    latency_ms REAL NOT NULL,
+                    recorded_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ledger_group_date ON ledger (group_name, entry_date)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (user_id, recorded_at)"
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS daily_rollups (
+                    group_name TEXT NOT NULL,
+                    entry_date TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    total_latency_ms REAL NOT NULL,
+                    PRIMARY KEY (entry_date, group_name, kind)
+                )
+                """
+            )
+
+    def record(
+        self,
+        message_id: str,
+        user_id: str,
+        group_name: str,
+        kind: str,
+        size: int,
+        file_id: Optional[str],
+        latency_ms: float,
+        recorded_at: Optional[float] = None,
+    ) -> bool:
+        """Records one saved item and adds it to its day's rollup.
+
+        An item whose message ID is already in the ledger (e.g. a redelivered
+        event) is not counted twice.
+
+        Args:
+            message_id: The LINE message ID of the item.
+            user_id: The LINE user who sent it.
+            group_name: The group (site) it was saved to.
+            kind: What was saved, e.g. "photo", "video", "file" or "note".
+            size: The number of bytes saved.
+            file_id: The Drive file ID, if the item has its own file.
+            latency_ms: The time from LINE receiving the message until it was saved.
+            recorded_at: The time to record it under; defaults to now.
+
+        Returns:
+            True if the item was recorded, False if it was already in the ledger.
+        """
+        recorded_at = recorded_at if recorded_at is not None else time.time()
+        entry_date: str = datetime.fromtimestamp(recorded_at).strftime("%Y-%m-%d")
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                INSERT OR IGNORE INTO ledger
+                    (message_id, user_id, group_name, entry_date, kind, bytes, file_id, latency_ms, recorded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (message_id, user_id, group_name, entry_date, kind, size, file_id, latency_ms, recorded_at),
+            )
+            if not cursor.rowcount:
+                return False
+            self._conn.execute(
+                """
+                INSERT INTO daily_rollups (group_name, entry_date, kind, count, bytes, total_latency_ms)
+                VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT (entry_date, group_name, kind) DO UPDATE SET
+                    count = count + 1,
+                    bytes = bytes + excluded.bytes,
+                    total_latency_ms = total_latency_ms + excluded.total_latency_ms
+                """,
+                (group_name, entry_date, kind, size, latency_ms),
+            )
+        return True
+
+    def stats(self, entry_date: Optional[str] = None, group_name: Optional[str] = None) -> Dict[str, Any]:
+        """Returns per-group counts and volumes of one day from the rollups.
+
+        Args:
+            entry_date: The day as YYYY-MM-DD; defaults to today.
+            group_name: Restricts the result to one group.
+
+        Returns:
+            The date and, per group and kind, the count, bytes and average
+            latency in milliseconds.
+        """
+        entry_date = entry_date or datetime.now().strftime("%Y-%m-%d")
+        query: str = "SELECT * FROM daily_rollups WHERE entry_date = ?"
+        params: tuple = (entry_date,)
+        if group_name:
+            query += " AND group_name = ?"
+            params += (group_name,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        groups: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for row in rows:
+            groups.setdefault(row["group_name"], {})[row["kind"]] = {
+                "count": row["count"],
+                "bytes": row["bytes"],
+                "avg_latency_ms": round(row["total_latency_ms"] / row["count"], 1),
+            }
+        return {"date": entry_date, "groups": groups}
+
+    def entries_between(self, start_date: str, end_date: str) -> List[LedgerEntry]:
+        """Returns the entries stored as their own Drive file between two dates (inclusive)."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT * FROM ledger
+                WHERE entry_date BETWEEN ? AND ? AND file_id IS NOT NULL
+                ORDER BY group_name, entry_date
+                """,
+                (start_date, end_date),
+            ).fetchall()
+        return [
+            LedgerEntry(
+                message_id=row["message_id"], user_id=row["user_id"], group_name=row["group_name"],
+                entry_date=row["entry_date"], kind=row["kind"], bytes=row["bytes"], file_id=row["file_id"],
+            )
+            for row in rows
+        ]
+
+    def contains(self, message_id: str) -> bool:
+        """Whether the message ID has been recorded."""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM ledger WHERE message_id = ?", (message_id,)).fetchone() is not None
+
+    def update_file_id(self, message_id: str, file_id: str) -> None:
+        """Points an entry at the Drive file that replaced a missing upload."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE ledger SET file_id = ? WHERE message_id = ?", (file_id, message_id))
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
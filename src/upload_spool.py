@@ -0,0 +1,159 @@
+"""
+A persistent queue of uploads that still have to reach Drive.
+
+Items land in the UploadSpool when an upload has to be retried later, for
+example because reconciliation found that a ledger entry is missing from
+Drive. The spool lives in SQLite, so queued items survive restarts. It is
+drained by the SpoolDrainer (see `src.spool_drainer`).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SpooledUpload:
+    """An upload waiting in the spool."""
+    message_id: str
+    user_id: str
+    group_name: str
+    entry_date: str
+    kind: str
+    file_name: Optional[str]
+    reason: str
+    attempts: int = 0
+
+
+class UploadSpool:
+    """A SQLite-backed queue of uploads to retry.
+
+    The spool is safe to share between threads; all access goes through a
+    single connection guarded by a lock.
+
+    Attributes:
+        max_attempts: Items that failed this many times are no longer handed out.
+    """
+    def __init__(self, db_path: str, max_attempts: int = 5) -> None:
+        if db_path != ":memory:" and os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.max_attempts: int = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS spool (
+                    message_id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    group_name TEXT NOT NULL,
+                    entry_date TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    file_name TEXT,
+                    reason TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    enqueued_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_spool_due ON spool (next_attempt_at)")
+
+    @staticmethod
+    def _to_item(row: sqlite3.Row) -> SpooledUpload:
+        return SpooledUpload(
+            message_id=row["message_id"],
+            user_id=row["user_id"],
+            group_name=row["group_name"],
+            entry_date=row["entry_date"],
+            kind=row["kind"],
+            file_name=row["file_name"],
+            reason=row["reason"],
+            attempts=row["attempts"],
+        )
+
+    def enqueue(self, item: SpooledUpload) -> bool:
+        """Adds an item unless it is already queued.
+
+        Returns:
+            True if the item was added.
+        """
+        now: float = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                INSERT OR IGNORE INTO spool
+                    (message_id, user_id, group_name, entry_date, kind, file_name, reason, attempts, next_attempt_at, enqueued_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    item.message_id, item.user_id, item.group_name, item.entry_date, item.kind,
+                    item.file_name, item.reason, item.attempts, now, now,
+                ),
+            )
+        return bool(cursor.rowcount)
+
+    def due(self, limit: int = 50) -> List[SpooledUpload]:
+        """Returns items whose next attempt is due, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM spool WHERE next_attempt_at <= ? AND attempts < ? ORDER BY enqueued_at LIMIT ?",
+                (time.time(), self.max_attempts, limit),
+            ).fetchall()
+        return [self._to_item(row) for row in rows]
+
+    def contains(self, message_id: str) -> bool:
+        """Whether an item is queued for the message ID."""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM spool WHERE message_id = ?", (message_id,)).fetchone() is not None
+
+    def items(self) -> List[SpooledUpload]:
+        """Returns every queued item, including ones not yet due."""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM spool ORDER BY enqueued_at").fetchall()
+        return [self._to_item(row) for row in rows]
+
+    def exhausted(self) -> List[SpooledUpload]:
+        """Returns the items that failed max_attempts times and are no longer retried."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM spool WHERE attempts >= ? ORDER BY enqueued_at", (self.max_attempts,)
+            ).fetchall()
+        return [self._to_item(row) for row in rows]
+
+    def mark_done(self, message_id: str) -> None:
+        """Removes an item that has reached Drive."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM spool WHERE message_id = ?", (message_id,))
+
+    def mark_failed(self, message_id: str, retry_after_seconds: float = 60.0) -> None:
+        """Counts a failed attempt and backs the item off exponentially."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                UPDATE spool SET attempts = attempts + 1,
+                    next_attempt_at = ? * (1 << MIN(attempts, 10)) + ?
+                WHERE message_id = ?
+                """,
+                (retry_after_seconds, time.time(), message_id),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        """Reports how many items are queued and how many gave up."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS queued, SUM(attempts >= ?) AS exhausted FROM spool", (self.max_attempts,)
+            ).fetchone()
+        return {"queued": row["queued"], "exhausted": row["exhausted"] or 0}
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
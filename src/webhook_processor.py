@@ -3,41 +3,64 @@ Acts as a router for incoming webhook events from the LINE API.
 
 This module receives all webhook events, checks for duplicates using Redis
 if available, and then forwards the event to the appropriate handler
-(e.g., text or image) based on its message type.
+(e.g., text, image, video or file) based on its message type.
 """
+import asyncio
 import logging
-from typing import Optional, Any
+from typing import Optional, Any, List
 
-import redis
 import os
 
-from linebot.v3.webhooks import MessageEvent, TextMessageContent, ImageMessageContent
+from linebot.v3.webhooks import (
+    MessageEvent, TextMessageContent, ImageMessageContent, VideoMessageContent, FileMessageContent
+)
 from linebot.v3.messaging import AsyncMessagingApi
 
 from src.state_manager import StateManager
 from src.config_manager import ConfigManager
 from src.google_drive_uploader import GoogleDriveService
+from src.near_duplicate_detector import NearDuplicateDetector
+from src.image_transformer import ImageTransformer
+from src.media_buffer import MediaMemoryBudget
+from src.image_set_batcher import ImageSetBatcher
+from src.confirmation_aggregator import ConfirmationAggregator
+from src.note_journal import NoteJournal
+from src.google_docs_notes import GoogleDocsNotesBackend
+from src.upload_ledger import UploadLedger
+from src import metrics, structured_logging, tracing
 
 # Import handlers
 from src.handlers.text_message_handler import handle_text_message
 from src.handlers.image_message_handler import handle_image_message
+from src.handlers.media_message_handler import handle_video_message, handle_file_message
 
 
 logger = logging.getLogger(__name__)
 
-# --- Redis Client Initialization ---
-redis_client: Optional[redis.Redis] = None
-redis_url: Optional[str] = os.getenv('REDIS_URL')
-if redis_url:
+# --- Redis Client (used to drop duplicate events) ---
+redis_client: Optional[Any] = None
+
+
+def connect_redis() -> Optional[Any]:
+    """Connects the client used to drop duplicate events, if REDIS_URL is set.
+
+    Called on startup rather than at import, since connecting needs the network.
+    """
+    global redis_client
+    redis_url: Optional[str] = os.getenv('REDIS_URL')
+    if not redis_url:
+        logger.warning("REDIS_URL not found. Redis client is not initialized.")
+        return None
+    import redis
     try:
-        redis_client = redis.from_url(redis_url, decode_responses=True)
-        redis_client.ping()
+        client = redis.from_url(redis_url, decode_responses=True)
+        client.ping()
         logger.info("✅ Successfully connected to Redis.")
+        redis_client = client
     except redis.exceptions.ConnectionError as e:
-        logger.error(f"❌ Failed to connect to Redis: {e}")
+        logger.error("❌ Failed to connect to Redis: %s", e)
         redis_client = None
-else:
-    logger.warning("REDIS_URL not found. Redis client is not initialized.")
+    return redis_client
 
 
 async def process_webhook_event(
@@ -47,7 +70,15 @@ async def process_webhook_event(
     gdrive_service: GoogleDriveService,
     line_bot_api: AsyncMessagingApi,
     channel_access_token: str,
-    parent_folder_id: Optional[str]
+    parent_folder_id: Optional[str],
+    near_duplicate_detector: Optional[NearDuplicateDetector] = None,
+    image_transformer: Optional[ImageTransformer] = None,
+    media_budget: Optional[MediaMemoryBudget] = None,
+    image_set_batcher: Optional[ImageSetBatcher] = None,
+    confirmation_aggregator: Optional[ConfirmationAggregator] = None,
+    note_journal: Optional[NoteJournal] = None,
+    notes_backend: Optional[GoogleDocsNotesBackend] = None,
+    upload_ledger: Optional[UploadLedger] = None,
 ) -> None:
     """Validates, de-duplicates, and routes a webhook event to its handler.
 
@@ -55,38 +86,122 @@ async def process_webhook_event(
         event: The event object from the LINE webhook.
         state_manager: The manager for user sessions.
         config_manager: The manager for application configuration.
-        gdrive_service: The service for Google Drive interactions.
+        gdrive_service: The storage uploads and notes are written to: the
+            Google Drive service or another StorageBackend.
         line_bot_api: The LINE Messaging API client for sending replies.
         channel_access_token: The access token for downloading message content.
         parent_folder_id: The root Google Drive folder ID for uploads.
+        near_duplicate_detector: The optional near-duplicate photo detector.
+        image_transformer: The optional image resize/re-encode stage.
+        media_budget: The optional memory budget for downloaded media.
+        image_set_batcher: The optional batcher for photos sent as an image set.
+        confirmation_aggregator: The optional aggregator of upload confirmations.
+        note_journal: The optional local journal that notes are written to.
+        notes_backend: The optional Google Docs backend that notes are appended to.
+        upload_ledger: The optional ledger of saved uploads and notes.
     """
     if not isinstance(event, MessageEvent):
-        logger.info(f"Received non-message event: {type(event).__name__}. Ignoring.")
+        logger.info("Received non-message event: %s. Ignoring.", type(event).__name__)
+        metrics.EVENTS.labels("non_message", "ignored").inc()
         return
+    # Every record logged while handling the event carries its message and user ID.
+    with structured_logging.bind(message_id=event.message.id, user_id=getattr(event.source, "user_id", None)):
+        event_type: str = getattr(event.message, "type", None) or "unknown"
+
+        # --- Duplicate Event Check (using Redis) ---
+        if redis_client:
+            message_id: str = event.message.id
+            redis_key: str = f"line_msg_{message_id}"
+            with metrics.stage("redis_dedupe"):
+                is_new: bool = bool(redis_client.set(redis_key, "processed", nx=True, ex=60))
+            metrics.record_cache_lookup("redis_dedupe", hit=not is_new)
+            if not is_new:
+                logger.warning("⚠️ Duplicate event received. Ignoring.", extra={"message_id": message_id})
+                metrics.EVENTS.labels(event_type, "duplicate").inc()
+                return
+
+        # --- Routing Logic (timed, traced and counted per message type) ---
+        outcome: str = "error"
+        try:
+            with metrics.EVENT_SECONDS.labels(event_type).time(), tracing.span("event", type=event_type):
+                if isinstance(event.message, TextMessageContent):
+                    await handle_text_message(
+                        event,
+                        state_manager,
+                        config_manager,
+                        gdrive_service,
+                        line_bot_api,
+                        parent_folder_id,
+                        confirmation_aggregator=confirmation_aggregator,
+                        note_journal=note_journal,
+                        notes_backend=notes_backend,
+                        upload_ledger=upload_ledger,
+                    )
+                elif isinstance(event.message, ImageMessageContent):
+                    await handle_image_message(
+                        event,
+                        state_manager,
+                        gdrive_service,
+                        channel_access_token,
+                        parent_folder_id,
+                        near_duplicate_detector=near_duplicate_detector,
+                        image_transformer=image_transformer,
+                        media_budget=media_budget,
+                        image_set_batcher=image_set_batcher,
+                        confirmation_aggregator=confirmation_aggregator,
+                        upload_ledger=upload_ledger,
+                    )
+                elif isinstance(event.message, VideoMessageContent):
+                    await handle_video_message(
+                        event,
+                        state_manager,
+                        gdrive_service,
+                        channel_access_token,
+                        parent_folder_id,
+                        confirmation_aggregator=confirmation_aggregator,
+                        upload_ledger=upload_ledger,
+                    )
+                elif isinstance(event.message, FileMessageContent):
+                    await handle_file_message(
+                        event,
+                        state_manager,
+                        gdrive_service,
+                        channel_access_token,
+                        parent_folder_id,
+                        confirmation_aggregator=confirmation_aggregator,
+                        upload_ledger=upload_ledger,
+                    )
+            outcome = "handled"
+        finally:
+            metrics.EVENTS.labels(event_type, outcome).inc()
+
 
-    # --- Duplicate Event Check (using Redis) ---
-    if redis_client:
-        message_id: str = event.message.id
-        redis_key: str = f"line_msg_{message_id}"
-        if not redis_client.set(redis_key, "processed", nx=True, ex=60):
-            logger.warning(f"⚠️ Duplicate event received: message_id={message_id}. Ignoring.")
-            return
-
-    # --- Routing Logic ---
-    if isinstance(event.message, TextMessageContent):
-        await handle_text_message(
-            event,
-            state_manager,
-            config_manager,
-            gdrive_service,
-            line_bot_api,
-            parent_folder_id
-        )
-    elif isinstance(event.message, ImageMessageContent):
-        await handle_image_message(
-            event,
-            state_manager,
-            gdrive_service,
-            channel_access_token,
-            parent_folder_id
-        )
\ No newline at end of file
+def _image_set_id(event: Any) -> Optional[str]:
+    """Returns the image set ID of a photo sent as part of an image set, else None."""
+    if isinstance(event, MessageEvent) and isinstance(event.message, ImageMessageContent):
+        image_set = getattr(event.message, "image_set", None)
+        return image_set.id if image_set else None
+    return None
+
+
+async def process_webhook_events(events: List[Any], **services: Any) -> None:
+    """Processes the events of one webhook delivery.
+
+    Events are handled in the order they were sent, so e.g. a secret code
+    takes effect before the photos that follow it. When an image set
+    batcher is configured, consecutive photos of the same image set are the
+    exception: they are handled concurrently, and the batcher bounds how
+    many of them are processed at once.
+
+    Args:
+        events: The parsed events of the delivery.
+        **services: The keyword arguments passed to process_webhook_event.
+    """
+    index: int = 0
+    while index < len(events):
+        end: int = index + 1
+        set_id: Optional[str] = _image_set_id(events[index]) if services.get("image_set_batcher") else None
+        while set_id and end < len(events) and _image_set_id(events[end]) == set_id:
+            end += 1
+        await asyncio.gather(*(process_webhook_event(event=event, **services) for event in events[index:end]))
+        index = end
@@ -0,0 +1,198 @@
+"""
+Streams a daily Drive folder to an HTTP client as a ZIP archive.
+
+The archive is produced while it is being sent. Files are downloaded from
+Drive in chunks, and each chunk is written into the ZIP stream and handed to
+the response as soon as it arrives. Neither a whole file nor the whole
+archive is ever held in memory. Every entry is written as ZIP64, so
+archives and videos larger than 4 GiB are valid, and entries are stored
+uncompressed, since photos and videos are already compressed. A few files
+are downloaded ahead of the one being written, and each has a bounded
+chunk queue. Memory use is therefore capped at about
+`max_concurrent * queue_chunks * chunk_size`.
+"""
+import asyncio
+import logging
+import zipfile
+from datetime import datetime
+from typing import Optional, Dict, List, Any, AsyncIterator, Iterator, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FILE_FIELDS: str = "id, name, mimeType, modifiedTime"
+GOOGLE_APPS_MIME_PREFIX: str = "application/vnd.google-apps."
+# Native Google files have no content to download; these are exported instead.
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "application/vnd.google-apps.document": ("text/plain", ".txt"),
+}
+
+
+class _ChunkSink:
+    """A write-only, unseekable file object that collects what ZipFile writes.
+
+    Because it cannot seek, ZipFile writes a data descriptor after each entry
+    instead of going back to patch the local header. That is what allows
+    entries to be streamed before their size is known.
+    """
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        """Returns and forgets everything written since the last drain."""
+        data: bytes = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _unique_name(name: str, used: Set[str]) -> str:
+    """Returns name, or "name (2).ext" etc. if an entry of that name already exists."""
+    candidate: str = name
+    stem, dot, extension = name.rpartition(".")
+    if not dot:
+        stem, extension = name, ""
+    number: int = 2
+    while candidate in used:
+        candidate = f"{stem} ({number}){dot}{extension}"
+        number += 1
+    used.add(candidate)
+    return candidate
+
+
+def _zip_info(file: Dict[str, Any], name: str) -> zipfile.ZipInfo:
+    modified: datetime = datetime.now()
+    if file.get("modifiedTime"):
+        modified = datetime.fromisoformat(file["modifiedTime"].replace("Z", "+00:00"))
+    info = zipfile.ZipInfo(name, date_time=modified.timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    return info
+
+
+def _exportable(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Returns the file as it goes into the archive, or None if it cannot be included.
+
+    Google Docs (e.g. the daily notes of the Google Docs notes backend) are
+    exported as plain text under a ".txt" name. Folders and other native
+    Google files are left out.
+    """
+    mime_type: str = item.get("mimeType", "")
+    if not mime_type.startswith(GOOGLE_APPS_MIME_PREFIX):
+        return item
+    if mime_type not in EXPORT_FORMATS:
+        return None
+    export_mime_type, extension = EXPORT_FORMATS[mime_type]
+    return {**item, "name": f"{item.get('name') or item['id']}{extension}", "exportMimeType": export_mime_type}
+
+
+async def list_folder_files(gdrive_service: Any, folder_id: str) -> List[Dict[str, Any]]:
+    """Lists the files of a Drive folder that can go into an archive, following all pages."""
+    files: List[Dict[str, Any]] = []
+    page_token: Optional[str] = None
+    while True:
+        page, page_token = await asyncio.to_thread(
+            gdrive_service.list_children_page, folder_id, EXPORT_FILE_FIELDS, False, page_token
+        )
+        files.extend(file for file in map(_exportable, page) if file)
+        if not page_token:
+            return sorted(files, key=lambda item: item.get("name", ""))
+
+
+async def _download(
+    gdrive_service: Any, file: Dict[str, Any], queue: "asyncio.Queue[Union[bytes, None, Exception]]", chunk_size: int
+) -> None:
+    """Feeds a file's chunks into queue, ending with None, or with the exception if the download fails.
+
+    Waits whenever the queue is full, so at most `queue.maxsize` chunks are buffered.
+    """
+    terminator: Optional[Exception] = None
+    chunks: Optional[Iterator[bytes]] = None
+    try:
+        chunks = gdrive_service.iter_file_content(
+            file["id"], chunk_size, export_mime_type=file.get("exportMimeType")
+        )
+        while True:
+            chunk: Optional[bytes] = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            await queue.put(chunk)
+    except asyncio.CancelledError:
+        # The archive was abandoned; nobody reads the queue any more.
+        queue = None
+        raise
+    except Exception as e:
+        terminator = e
+    finally:
+        # Always end the queue, or the archive writer would wait for this file forever.
+        if queue is not None:
+            await queue.put(terminator)
+        close = getattr(chunks, "close", None)
+        if close:
+            try:
+                await asyncio.to_thread(close)
+            except Exception as e:
+                logger.warning("⚠️ Could not close the download of '%s': %s", file.get('name'), e)
+
+
+async def stream_zip(
+    gdrive_service: Any,
+    files: List[Dict[str, Any]],
+    max_concurrent: int = 4,
+    chunk_size: int = 1024 * 1024,
+    queue_chunks: int = 4,
+) -> AsyncIterator[bytes]:
+    """Yields a ZIP archive of Drive files, piece by piece.
+
+    Args:
+        gdrive_service: The service used to download each file's content.
+        files: The Drive files to include, with at least "id" and "name".
+        max_concurrent: How many files are downloaded at once, counting the
+            file being written.
+        chunk_size: The download chunk size.
+        queue_chunks: How many chunks of a file may wait to be written.
+
+    Raises:
+        Exception: The error of a failed download. The archive is cut short
+            there, so the client does not receive a valid ZIP file.
+    """
+    sink = _ChunkSink()
+    used_names: Set[str] = set()
+    queues: List["asyncio.Queue[Union[bytes, None, Exception]]"] = [asyncio.Queue(maxsize=queue_chunks) for _ in files]
+    downloads: Dict[int, asyncio.Task] = {}
+
+    def start_download(index: int) -> None:
+        if index < len(files):
+            downloads[index] = asyncio.create_task(
+                _download(gdrive_service, files[index], queues[index], chunk_size)
+            )
+
+    try:
+        for index in range(min(max_concurrent, len(files))):
+            start_download(index)
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for index, file in enumerate(files):
+                name: str = _unique_name(file.get("name") or file["id"], used_names)
+                with archive.open(_zip_info(file, name), mode="w", force_zip64=True) as entry:
+                    while True:
+                        chunk: Union[bytes, None, Exception] = await queues[index].get()
+                        if isinstance(chunk, Exception):
+                            logger.error("❌ ZIP export stopped: download of '%s' failed: %s", name, chunk)
+                            raise chunk
+                        if chunk is None:
+                            break
+                        entry.write(chunk)
+                        yield sink.drain()
+                await downloads.pop(index)
+                start_download(index + max_concurrent)
+        # The last entry's data descriptor and the central directory.
+        yield sink.drain()
+        logger.info("Streamed ZIP export of %s file(s).", len(files))
+    finally:
+        for task in downloads.values():
+            task.cancel()
+        await asyncio.gather(*downloads.values(), return_exceptions=True)
@@ -0,0 +1,111 @@
+"""
+A local stand-in for the Google Docs API used by tests.
+
+It serves `documents.get` and `documents.batchUpdate` (insertText only) over
+real HTTP, so the Docs client built by googleapiclient can be exercised
+end-to-end without network access.
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import httplib2
+from googleapiclient.discovery import build
+
+_DOCUMENT_PATH = re.compile(r"^/v1/documents/([^/:?]+)(:batchUpdate)?")
+
+
+class FakeDocsServer:
+    """Holds documents in memory and serves them on an ephemeral local port."""
+    def __init__(self) -> None:
+        self.documents: Dict[str, str] = {}
+        self.batch_updates: List[str] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    def create_document(self, document_id: str) -> None:
+        # A new Google Doc consists of a single empty paragraph.
+        self.documents[document_id] = "\n"
+
+    def text(self, document_id: str) -> str:
+        return self.documents[document_id]
+
+    def docs_service(self):
+        """Builds a real Docs API client that talks to this server."""
+        return build(
+            "docs", "v1", http=httplib2.Http(), static_discovery=True,
+            client_options={"api_endpoint": self.url},
+        )
+
+    def start(self) -> "FakeDocsServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _apply(self, document_id: str, requests: List[dict]) -> None:
+        with self._lock:
+            content: str = self.documents[document_id]
+            for request in requests:
+                insert = request["insertText"]
+                if "endOfSegmentLocation" in insert:
+                    # Text is inserted before the body's final newline.
+                    index = len(content) - 1
+                else:
+                    index = insert["location"]["index"] - 1
+                content = content[:index] + insert["text"] + content[index:]
+            self.documents[document_id] = content
+            self.batch_updates.append(document_id)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def _reply(self, status: int, body: dict) -> None:
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _document_id(self):
+                match = _DOCUMENT_PATH.match(self.path)
+                if not match or match.group(1) not in fake.documents:
+                    self._reply(404, {"error": {"code": 404, "message": "Requested entity was not found."}})
+                    return None, None
+                return match.group(1), match.group(2)
+
+            def do_GET(self) -> None:
+                document_id, _ = self._document_id()
+                if document_id:
+                    content = fake.text(document_id)
+                    self._reply(200, {"documentId": document_id, "body": {"content": [
+                        {"startIndex": 1, "endIndex": len(content) + 1,
+                         "paragraph": {"elements": [{"textRun": {"content": content}}]}}
+                    ]}})
+
+            def do_POST(self) -> None:
+                document_id, action = self._document_id()
+                if not document_id:
+                    return
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if action != ":batchUpdate":
+                    self._reply(400, {"error": {"code": 400, "message": "Unsupported"}})
+                    return
+                fake._apply(document_id, body["requests"])
+                self._reply(200, {"documentId": document_id, "replies": [{} for _ in body["requests"]]})
+
+        return Handler
@@ -1,4 +1,5 @@
 # Standard Library Imports
+import asyncio
 from datetime import datetime
 from unittest.mock import MagicMock, AsyncMock, patch, call
 
@@ -6,11 +7,16 @@ from unittest.mock import MagicMock, AsyncMock, patch, call
 import pytest
 import aiohttp
 from linebot.v3.webhooks import (
-    ImageMessageContent, ContentProvider
+    ImageMessageContent, ContentProvider, ImageSet
 )
 
 # Local Application Imports
 from src.state_manager import StateManager
+from src.near_duplicate_detector import NearDuplicateMatch
+from src.image_transformer import TransformedImage, PNG
+from src.media_buffer import MediaMemoryBudget
+from src.image_set_batcher import ImageSetBatcher
+from src.upload_ledger import UploadLedger
 # --- 1. Import handler and function test---
 from src.handlers.image_message_handler import handle_image_message, download_image_content
 
@@ -56,7 +62,9 @@ class TestImageMessages:
             mock_gdrive_service.find_or_create_folder.assert_has_calls(expected_calls)
             
             mock_gdrive_service.upload_file.assert_called_once_with(
-                f"{event.message.id}.jpg", b'fake-image-bytes', "daily_folder_id"
+                f"{event.message.id}.jpg", b'fake-image-bytes', "daily_folder_id",
+                message_id="msg_abc", app_properties=None,
+                mime_type="image/jpeg"
             )
                     
     @pytest.mark.asyncio
@@ -78,6 +86,81 @@ class TestImageMessages:
         mock_download.assert_not_called()
         mock_gdrive_service.upload_file.assert_not_called()
         
+    @pytest.mark.asyncio
+    @patch('src.handlers.image_message_handler.download_image_content')
+    async def test_skips_near_duplicate_image(
+            self, mock_download, mock_state_manager, mock_gdrive_service
+        ):
+        """Tests that an image flagged as a near-duplicate is not uploaded."""
+        mock_state_manager.get_active_group.return_value = "Group_A"
+        mock_download.return_value = b'fake-image-bytes'
+        mock_detector = MagicMock()
+        mock_detector.action = "skip"
+        mock_detector.check = AsyncMock(return_value=NearDuplicateMatch("msg_original", 2, 0.97))
+        image_message = ImageMessageContent(id="msg_dup", quote_token="q_token_4", content_provider=ContentProvider(type="line"))
+        event = create_mock_event("U123_any_user", image_message)
+
+        await handle_image_message(
+            event, mock_state_manager, mock_gdrive_service,
+            "dummy_token", "dummy_parent_id",
+            near_duplicate_detector=mock_detector
+        )
+
+        mock_detector.check.assert_awaited_once_with("Group_A", b'fake-image-bytes', "msg_dup")
+        mock_gdrive_service.upload_file.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch('src.handlers.image_message_handler.download_image_content')
+    async def test_uploads_transformed_image_with_real_format(
+            self, mock_download, mock_state_manager, mock_gdrive_service
+        ):
+        """Tests that the transformed content is uploaded with its real extension and MIME type."""
+        mock_state_manager.get_active_group.return_value = "Group_A"
+        mock_download.return_value = b'large-original-bytes'
+        mock_gdrive_service.find_or_create_folder.side_effect = ["group_folder_id", "daily_folder_id"]
+        mock_transformer = MagicMock()
+        mock_transformer.transform = AsyncMock(return_value=TransformedImage(b'small-bytes', PNG, True))
+        image_message = ImageMessageContent(id="msg_png", quote_token="q_token_5", content_provider=ContentProvider(type="line"))
+        event = create_mock_event("U123_any_user", image_message)
+
+        await handle_image_message(
+            event, mock_state_manager, mock_gdrive_service,
+            "dummy_token", "dummy_parent_id",
+            image_transformer=mock_transformer
+        )
+
+        mock_gdrive_service.upload_file.assert_called_once_with(
+            "msg_png.png", b'small-bytes', "daily_folder_id",
+            message_id="msg_png", app_properties=None, mime_type="image/png"
+        )
+
+    @pytest.mark.asyncio
+    @patch('src.handlers.image_message_handler.download_content_to_buffer')
+    async def test_uploads_from_budgeted_buffer(
+            self, mock_download, mock_state_manager, mock_gdrive_service
+        ):
+        """Tests that with a media budget the image is uploaded straight from its buffer."""
+        mock_state_manager.get_active_group.return_value = "Group_A"
+        budget = MediaMemoryBudget(max_bytes=1024, spill_threshold=8)
+        media_buffer = budget.new_buffer()
+        media_buffer.write(b'fake-image-bytes')
+        mock_download.return_value = media_buffer
+        mock_gdrive_service.find_or_create_folder.side_effect = ["group_folder_id", "daily_folder_id"]
+        uploaded = []
+        mock_gdrive_service.upload_file.side_effect = lambda name, source, *args, **kwargs: uploaded.append(source.read())
+        image_message = ImageMessageContent(id="msg_big", quote_token="q_token_6", content_provider=ContentProvider(type="line"))
+        event = create_mock_event("U123_any_user", image_message)
+
+        await handle_image_message(
+            event, mock_state_manager, mock_gdrive_service,
+            "dummy_token", "dummy_parent_id",
+            media_budget=budget
+        )
+
+        assert uploaded == [b'fake-image-bytes']
+        assert media_buffer.spilled
+        assert budget.stats()["buffers_in_flight"] == 0
+
 class TestNetworkHandling:
     """Tests helper functions related to network operations, such as
     downloading content with retry logic.
@@ -106,4 +189,69 @@ class TestNetworkHandling:
         # --- 6. call directly download_image_content  ---
         result = await download_image_content("any_image_id", "dummy_token")
         assert result == b'successful-image-bytes'
-        assert mock_session_get.call_count == 2
\ No newline at end of file
+        assert mock_session_get.call_count == 2
+
+class TestImageSets:
+    """Tests batching of photos sent together as a LINE image set."""
+    @pytest.mark.asyncio
+    @patch('src.handlers.image_message_handler.download_image_content')
+    async def test_image_set_resolves_session_and_folders_once(
+        self, mock_download, mock_state_manager, mock_gdrive_service
+    ):
+        """Tests that a set shares one session lookup and folder resolution and is named by index."""
+        in_flight = {"now": 0, "peak": 0}
+
+        async def slow_download(message_id, token):
+            in_flight["now"] += 1
+            in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+            await asyncio.sleep(0.01)
+            in_flight["now"] -= 1
+            return b'fake-image-bytes'
+
+        mock_download.side_effect = slow_download
+        mock_state_manager.get_active_group.return_value = "Group_A"
+        mock_gdrive_service.find_or_create_folder.side_effect = ["group_folder_id", "daily_folder_id"]
+        batcher = ImageSetBatcher(fan_out=2, name_by_index=True)
+
+        events = [
+            create_mock_event("U123", ImageMessageContent(
+                id=f"msg_{index}", quote_token="q_token", content_provider=ContentProvider(type="line"),
+                image_set=ImageSet(id="set_1", index=index, total=4)
+            ))
+            for index in range(1, 5)
+        ]
+        await asyncio.gather(*(
+            handle_image_message(
+                event, mock_state_manager, mock_gdrive_service,
+                "dummy_token", "dummy_parent_id", image_set_batcher=batcher
+            )
+            for event in events
+        ))
+
+        mock_state_manager.get_active_group.assert_called_once_with("U123")
+        assert mock_gdrive_service.find_or_create_folder.call_count == 2
+        assert in_flight["peak"] == 2
+        uploaded_names = sorted(c.args[0] for c in mock_gdrive_service.upload_file.call_args_list)
+        assert uploaded_names == ["set_1_1.jpg", "set_1_2.jpg", "set_1_3.jpg", "set_1_4.jpg"]
+        assert all(c.args[2] == "daily_folder_id" for c in mock_gdrive_service.upload_file.call_args_list)
+
+
+@pytest.mark.asyncio
+@patch('src.handlers.image_message_handler.download_image_content')
+async def test_uploaded_image_is_recorded_in_ledger(mock_download, mock_state_manager, mock_gdrive_service):
+    """Tests that a successful upload is recorded with its size and Drive file ID."""
+    mock_state_manager.get_active_group.return_value = "Group_A"
+    mock_download.return_value = b'fake-image-bytes'
+    mock_gdrive_service.upload_file.return_value = "file_1"
+    upload_ledger = UploadLedger(":memory:")
+    event = create_mock_event("U123", ImageMessageContent(
+        id="msg_ledger", quote_token="q", content_provider=ContentProvider(type="line")
+    ))
+
+    await handle_image_message(
+        event, mock_state_manager, mock_gdrive_service, "dummy_token", "dummy_parent_id",
+        upload_ledger=upload_ledger
+    )
+
+    rollup = upload_ledger.stats(group_name="Group_A")["groups"]["Group_A"]["photo"]
+    assert (rollup["count"], rollup["bytes"]) == (1, len(b'fake-image-bytes'))
@@ -0,0 +1,207 @@
+# Standard Library Imports
+from unittest.mock import MagicMock, AsyncMock, patch
+
+# Third-party Imports
+import pytest
+from linebot.v3.webhooks import FileMessageContent, VideoMessageContent, ContentProvider
+
+# Local Application Imports
+from src.upload_index import UploadIndex
+from src.storage_backends import LocalStorageBackend
+from src.handlers.media_message_handler import (
+    handle_file_message, handle_video_message, stream_content_to_drive,
+    upload_chunks_resumable, wait_for_content_ready
+)
+from tests.test_helpers import create_mock_event
+
+CHUNK = 256 * 1024
+
+
+async def iterate(pieces):
+    for piece in pieces:
+        yield piece
+
+def make_response(status=200, pieces=(), headers=None, json_body=None, content_type="video/mp4"):
+    """Builds a mock aiohttp response usable as an async context manager."""
+    resp = AsyncMock()
+    resp.status = status
+    resp.headers = headers or {}
+    resp.content_type = content_type
+    resp.content_length = sum(len(p) for p in pieces) if pieces else None
+    resp.content = MagicMock()
+    resp.content.iter_chunked = lambda size: iterate(pieces)
+    resp.json = AsyncMock(return_value=json_body)
+    resp.__aenter__.return_value = resp
+    resp.__aexit__ = AsyncMock(return_value=None)
+    return resp
+
+def make_drive(final_result=None):
+    """Builds a fake Drive service that records every chunk it receives."""
+    gdrive_service = MagicMock()
+    gdrive_service.upload_index = UploadIndex(":memory:")
+    received = []
+
+    def upload_chunk(session_uri, chunk, offset, total_size):
+        received.append((offset, chunk, total_size))
+        if total_size is not None and offset + len(chunk) >= total_size:
+            return final_result or {"id": "file_id", "name": "video.mp4", "size": str(total_size), "md5Checksum": "md5"}
+        return None
+
+    gdrive_service.upload_resumable_chunk.side_effect = upload_chunk
+    gdrive_service.start_resumable_upload.return_value = "https://upload/session_1"
+    return gdrive_service, received
+
+
+class TestResumableStreaming:
+    """Tests streaming content into Drive resumable sessions."""
+    @pytest.mark.asyncio
+    async def test_stream_is_sent_in_fixed_size_chunks(self):
+        """Tests that only whole 256 KiB multiples are sent before the final chunk."""
+        gdrive_service, received = make_drive()
+        pieces = [bytes([i]) * 100_000 for i in range(10)]
+
+        result = await upload_chunks_resumable(
+            gdrive_service, "https://upload/session_1", iterate(pieces), chunk_size=CHUNK
+        )
+
+        assert result["id"] == "file_id"
+        assert [len(chunk) for _, chunk, _ in received] == [CHUNK, CHUNK, CHUNK, 1_000_000 - 3 * CHUNK]
+        assert [offset for offset, _, _ in received] == [0, CHUNK, 2 * CHUNK, 3 * CHUNK]
+        assert received[-1][2] == 1_000_000
+        assert b"".join(chunk for _, chunk, _ in received) == b"".join(pieces)
+
+    @pytest.mark.asyncio
+    @patch('src.handlers.media_message_handler.aiohttp.ClientSession.get')
+    async def test_interrupted_upload_resumes_from_drive_offset(self, mock_session_get):
+        """Tests that a saved session is resumed at the offset Drive reports."""
+        content = bytes(range(256)) * 4096  # 1 MiB
+        gdrive_service, received = make_drive()
+        gdrive_service.upload_index.save_resumable_session("msg_video", "https://upload/session_old")
+        gdrive_service.query_resumable_upload.return_value = (CHUNK, None)
+        mock_session_get.return_value = make_response(pieces=[content[i:i + 65536] for i in range(0, len(content), 65536)])
+
+        file_id = await stream_content_to_drive(
+            "msg_video", "dummy_token", gdrive_service, "daily_folder_id", chunk_size=CHUNK
+        )
+
+        assert file_id == "file_id"
+        gdrive_service.start_resumable_upload.assert_not_called()
+        assert received[0][0] == CHUNK
+        assert b"".join(chunk for _, chunk, _ in received) == content[CHUNK:]
+        assert mock_session_get.call_args[1]["headers"]["Range"] == f"bytes={CHUNK}-"
+        assert gdrive_service.upload_index.get_resumable_session("msg_video") is None
+        assert gdrive_service.upload_index.find_by_message_id("msg_video").file_id == "file_id"
+
+    @pytest.mark.asyncio
+    @patch('src.handlers.media_message_handler.aiohttp.ClientSession.get')
+    async def test_new_upload_records_hash_and_session(self, mock_session_get):
+        """Tests that a fresh upload opens a session with the real MIME type and tags the SHA-256."""
+        gdrive_service, received = make_drive()
+        mock_session_get.return_value = make_response(pieces=[b"pdf-bytes"], content_type="application/pdf")
+
+        await stream_content_to_drive(
+            "msg_file", "dummy_token", gdrive_service, "daily_folder_id", file_name="plan.pdf", chunk_size=CHUNK
+        )
+
+        args = gdrive_service.start_resumable_upload.call_args[0]
+        assert args[:4] == ("plan.pdf", "daily_folder_id", "application/pdf", 9)
+        gdrive_service.set_app_properties.assert_called_once()
+        assert gdrive_service.set_app_properties.call_args[0][1]["sha256"]
+
+    @pytest.mark.asyncio
+    async def test_already_uploaded_message_is_not_streamed_again(self):
+        """Tests that a redelivered message is answered from the upload index."""
+        gdrive_service, received = make_drive()
+        gdrive_service.upload_index.record(MagicMock(
+            message_id="msg_done", sha256="", md5="", size=1,
+            file_id="existing_id", folder_id="f", file_name="x.mp4"
+        ))
+
+        assert await stream_content_to_drive("msg_done", "dummy_token", gdrive_service, "f") == "existing_id"
+        assert received == []
+
+
+class TestMediaMessages:
+    """Tests the video and file message handlers."""
+    @pytest.mark.asyncio
+    @patch('src.handlers.media_message_handler.aiohttp.ClientSession.get')
+    async def test_waits_until_transcoding_succeeds(self, mock_session_get):
+        """Tests that transcoding status is polled until it succeeds."""
+        mock_session_get.side_effect = [
+            make_response(json_body={"status": "processing"}),
+            make_response(json_body={"status": "succeeded"}),
+        ]
+
+        import aiohttp
+        async with aiohttp.ClientSession() as session:
+            ready = await wait_for_content_ready(session, "msg_video", "dummy_token", interval=0)
+
+        assert ready is True
+        assert mock_session_get.call_count == 2
+
+    @pytest.mark.asyncio
+    @patch('src.handlers.media_message_handler.stream_content_to_drive', new_callable=AsyncMock)
+    @patch('src.handlers.media_message_handler.wait_for_content_ready', new_callable=AsyncMock)
+    async def test_video_is_not_uploaded_when_transcoding_fails(
+        self, mock_wait, mock_stream, mock_state_manager, mock_gdrive_service
+    ):
+        """Tests that a video whose transcoding failed is not uploaded."""
+        mock_state_manager.get_active_group.return_value = "Group_A"
+        mock_wait.return_value = False
+        video = VideoMessageContent(id="msg_video", duration=1000, content_provider=ContentProvider(type="line"), quote_token="q")
+        event = create_mock_event("U123", video)
+
+        await handle_video_message(event, mock_state_manager, mock_gdrive_service, "dummy_token", "dummy_parent_id")
+
+        mock_stream.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch('src.handlers.media_message_handler.stream_content_to_drive', new_callable=AsyncMock)
+    async def test_file_keeps_original_name(self, mock_stream, mock_state_manager, mock_gdrive_service):
+        """Tests that a file message is streamed to the daily folder under its original name."""
+        mock_state_manager.get_active_group.return_value = "Group_A"
+        mock_gdrive_service.find_or_create_folder.side_effect = ["group_folder_id", "daily_folder_id"]
+        file_message = FileMessageContent(id="msg_file", file_name="site-plan.pdf", file_size=1234)
+        event = create_mock_event("U123", file_message)
+
+        await handle_file_message(event, mock_state_manager, mock_gdrive_service, "dummy_token", "dummy_parent_id")
+
+        mock_stream.assert_awaited_once_with(
+            "msg_file", "dummy_token", mock_gdrive_service, "daily_folder_id", file_name="site-plan.pdf"
+        )
+
+    @pytest.mark.asyncio
+    @patch('src.handlers.media_message_handler.aiohttp.ClientSession.get')
+    async def test_file_is_stored_in_a_storage_backend(self, mock_session_get, mock_state_manager, tmp_path):
+        """Tests that with a non-Drive backend the file is streamed via a temporary file into its daily folder."""
+        storage = LocalStorageBackend(str(tmp_path))
+        mock_state_manager.get_active_group.return_value = "Group_A"
+        mock_session_get.return_value = make_response(pieces=[b"pdf-", b"bytes"], content_type="application/pdf")
+        event = create_mock_event("U123", FileMessageContent(id="msg_file", file_name="site-plan.pdf", file_size=9))
+
+        with patch('src.handlers.image_message_handler.datetime') as mock_datetime:
+            mock_datetime.now.return_value.strftime.return_value = "2025-08-30"
+            await handle_file_message(event, mock_state_manager, storage, "dummy_token", None)
+
+        assert (tmp_path / "Group_A" / "2025-08-30" / "site-plan.pdf").read_bytes() == b"pdf-bytes"
+
+    @pytest.mark.asyncio
+    @patch('src.handlers.media_message_handler.wait_for_content_ready', new_callable=AsyncMock)
+    @patch('src.handlers.media_message_handler.aiohttp.ClientSession.get')
+    async def test_video_in_a_storage_backend_is_recorded_with_its_size_once(
+        self, mock_session_get, mock_wait, mock_state_manager, tmp_path
+    ):
+        """Tests that the ledger gets the bytes stored, and a redelivered video is not downloaded again."""
+        storage = LocalStorageBackend(str(tmp_path / "storage"), upload_index=UploadIndex(str(tmp_path / "index.db")))
+        ledger = MagicMock()
+        mock_state_manager.get_active_group.return_value = "Group_A"
+        mock_wait.return_value = True
+        mock_session_get.return_value = make_response(pieces=[b"mp4-", b"bytes"])
+        video = VideoMessageContent(id="msg_video", duration=1000, content_provider=ContentProvider(type="line"), quote_token="q")
+        event = create_mock_event("U123", video)
+
+        await handle_video_message(event, mock_state_manager, storage, "dummy_token", None, upload_ledger=ledger)
+        await handle_video_message(event, mock_state_manager, storage, "dummy_token", None, upload_ledger=ledger)
+
+        assert mock_session_get.call_count == 1
+        assert [c.args[4] for c in ledger.record.call_args_list] == [9, 9]
@@ -1,4 +1,5 @@
 # Standard Library Imports
+import threading
 from datetime import datetime
 from unittest.mock import MagicMock, AsyncMock, ANY
 
@@ -154,4 +155,166 @@ class TestTextMessagesAndNotes:
         mock_gdrive_service.append_text_to_file.assert_called_once()
         args, kwargs = mock_gdrive_service.append_text_to_file.call_args
         extracted_note = args[1]
-        assert extracted_note == "This is for group ten."
\ No newline at end of file
+        assert extracted_note == "This is for group ten."
+
+@pytest.mark.asyncio
+async def test_saved_note_is_added_to_confirmation(
+    mock_config_manager, mock_state_manager, mock_line_bot_api, mock_gdrive_service
+):
+    """Tests that a saved note is reported to the confirmation aggregator, not replied directly."""
+    mock_state_manager.get_active_group.return_value = "Group_A"
+    confirmation_aggregator = MagicMock()
+    event = create_mock_event("U123", TextMessageContent(id="n1", text="Rebar delivered", quote_token="q"))
+
+    await handle_text_message(
+        event, mock_state_manager, mock_config_manager, mock_gdrive_service,
+        mock_line_bot_api, "dummy_parent_id", confirmation_aggregator=confirmation_aggregator
+    )
+
+    confirmation_aggregator.record.assert_called_once_with(
+        "U123", "Group_A", "note", reply_token="dummy_reply_token", success=True
+    )
+    mock_line_bot_api.reply_message.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_failed_note_is_confirmed_as_failure(
+    mock_config_manager, mock_state_manager, mock_line_bot_api, mock_gdrive_service
+):
+    """Tests that a note that could not be saved is reported as a failure."""
+    mock_state_manager.get_active_group.return_value = "Group_A"
+    mock_gdrive_service.append_text_to_file.side_effect = RuntimeError("Drive unavailable")
+    confirmation_aggregator = MagicMock()
+    event = create_mock_event("U123", TextMessageContent(id="n2", text="Rebar delivered", quote_token="q"))
+
+    with pytest.raises(RuntimeError):
+        await handle_text_message(
+            event, mock_state_manager, mock_config_manager, mock_gdrive_service,
+            mock_line_bot_api, "dummy_parent_id", confirmation_aggregator=confirmation_aggregator
+        )
+
+    confirmation_aggregator.record.assert_called_once_with(
+        "U123", "Group_A", "note", reply_token="dummy_reply_token", success=False
+    )
+
+
+@pytest.mark.asyncio
+async def test_note_is_written_to_journal_instead_of_drive(
+    mock_config_manager, mock_state_manager, mock_line_bot_api, mock_gdrive_service
+):
+    """Tests that with a note journal, a note is a local insert and Drive is not touched."""
+    from src.note_journal import NoteJournal
+
+    mock_state_manager.get_active_group.return_value = "Group_A"
+    note_journal = NoteJournal(":memory:")
+    event = create_mock_event("U123", TextMessageContent(id="n2", text="Concrete poured", quote_token="q"))
+
+    await handle_text_message(
+        event, mock_state_manager, mock_config_manager, mock_gdrive_service,
+        mock_line_bot_api, "dummy_parent_id", note_journal=note_journal
+    )
+
+    assert [note.text for note in note_journal.notes_by_user("U123")] == ["Concrete poured"]
+    mock_gdrive_service.append_text_to_file.assert_not_called()
+    mock_gdrive_service.find_or_create_folder.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_search_command_replies_with_matches_from_active_group(
+    mock_config_manager, mock_state_manager, mock_line_bot_api, mock_gdrive_service
+):
+    """Tests that '? <terms>' replies with matching notes and is not saved as a note."""
+    from src.note_journal import NoteJournal
+
+    mock_state_manager.get_active_group.return_value = "Group_A"
+    note_journal = NoteJournal(":memory:")
+    note_journal.append("Group_A", "U1", "Rebar delivered to gate 2", created_at=datetime(2025, 8, 30, 8, 15).timestamp())
+    event = create_mock_event("U123", TextMessageContent(id="s1", text="? rebar", quote_token="q"))
+
+    await handle_text_message(
+        event, mock_state_manager, mock_config_manager, mock_gdrive_service,
+        mock_line_bot_api, "dummy_parent_id", note_journal=note_journal
+    )
+
+    reply = mock_line_bot_api.reply_message.call_args[0][0].messages[0].text
+    assert reply == "Notes in Group_A matching 'rebar':\n[2025-08-30 08:15] Rebar delivered to gate 2"
+    assert note_journal.notes_by_user("U123") == []
+
+
+@pytest.mark.asyncio
+async def test_question_mark_text_is_a_note_without_search(
+    mock_config_manager, mock_state_manager, mock_line_bot_api, mock_gdrive_service
+):
+    """Tests that without a note journal a message starting with '?' is saved as a note."""
+    mock_state_manager.get_active_group.return_value = "Group_A"
+    event = create_mock_event("U123", TextMessageContent(id="q1", text="?Is the crane booked", quote_token="q"))
+
+    await handle_text_message(
+        event, mock_state_manager, mock_config_manager, mock_gdrive_service,
+        mock_line_bot_api, "dummy_parent_id"
+    )
+
+    mock_gdrive_service.append_text_to_file.assert_called_once_with(ANY, "?Is the crane booked", ANY)
+    mock_line_bot_api.reply_message.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_note_is_appended_through_docs_backend(
+    mock_config_manager, mock_state_manager, mock_line_bot_api, mock_gdrive_service
+):
+    """Tests that a configured notes backend receives the note instead of the Drive text file."""
+    mock_state_manager.get_active_group.return_value = "Group_A"
+    mock_gdrive_service.find_or_create_folder.side_effect = ["group_folder_id", "daily_folder_id"]
+    notes_backend = MagicMock()
+    event = create_mock_event("U123", TextMessageContent(id="n3", text="Formwork removed", quote_token="q"))
+
+    await handle_text_message(
+        event, mock_state_manager, mock_config_manager, mock_gdrive_service,
+        mock_line_bot_api, "dummy_parent_id", notes_backend=notes_backend
+    )
+
+    notes_backend.append_text_to_file.assert_called_once_with(ANY, "Formwork removed", "daily_folder_id")
+    mock_gdrive_service.append_text_to_file.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_notes_backend_is_called_off_the_event_loop(
+    mock_config_manager, mock_state_manager, mock_line_bot_api, mock_gdrive_service
+):
+    """Tests that the blocking Drive/Docs calls of a note run in a worker thread."""
+    mock_state_manager.get_active_group.return_value = "Group_A"
+    calling_threads = []
+    notes_backend = MagicMock()
+    notes_backend.append_text_to_file.side_effect = lambda *args: calling_threads.append(threading.get_ident())
+    event = create_mock_event("U123", TextMessageContent(id="n4", text="Scaffold inspected", quote_token="q"))
+
+    await handle_text_message(
+        event, mock_state_manager, mock_config_manager, mock_gdrive_service,
+        mock_line_bot_api, "dummy_parent_id", notes_backend=notes_backend
+    )
+
+    assert len(calling_threads) == 1
+    assert calling_threads[0] != threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_stats_command_reports_active_group_from_ledger(
+    mock_config_manager, mock_state_manager, mock_line_bot_api, mock_gdrive_service
+):
+    """Tests that '!stats' replies with today's rollups for the active group without Drive calls."""
+    from src.upload_ledger import UploadLedger
+
+    mock_state_manager.get_active_group.return_value = "Site B"
+    upload_ledger = UploadLedger(":memory:")
+    upload_ledger.record("m1", "U1", "Site B", "photo", 3 * 1024 * 1024, "f1", 2500)
+    upload_ledger.record("m2", "U1", "Site A", "photo", 1024, "f2", 500)
+    event = create_mock_event("U123", TextMessageContent(id="c1", text="!stats", quote_token="q"))
+
+    await handle_text_message(
+        event, mock_state_manager, mock_config_manager, mock_gdrive_service,
+        mock_line_bot_api, "dummy_parent_id", upload_ledger=upload_ledger
+    )
+
+    reply = mock_line_bot_api.reply_message.call_args[0][0].messages[0].text
+    assert reply.splitlines()[1:] == ["Site B:", "  photo: 1 (3.0 MB), avg 2.5s"]
+    mock_gdrive_service.find_or_create_folder.assert_not_called()
@@ -0,0 +1,192 @@
+import io
+import threading
+import zipfile
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src import tracing
+from src.admin_api import router
+from src.media_buffer import MediaMemoryBudget
+from src.memory_snapshots import MemorySnapshots
+from src.profiler import SamplingProfiler
+from src.state_manager import StateManager
+from src.upload_ledger import UploadLedger
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("ADMIN_API_TOKEN", "secret-token")
+    app = FastAPI()
+    app.upload_ledger = UploadLedger(":memory:")
+    app.upload_ledger.record("m1", "U1", "Site B", "photo", 2048, "f1", 1500, recorded_at=datetime(2025, 8, 30, 9).timestamp())
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_stats_endpoint_returns_rollups(client):
+    """GET /stats returns the ledger rollups for the requested day and group."""
+    response = client.get(
+        "/stats", params={"group": "Site B", "date": "2025-08-30"},
+        headers={"Authorization": "Bearer secret-token"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["groups"]["Site B"]["photo"] == {"count": 1, "bytes": 2048, "avg_latency_ms": 1500.0}
+
+
+def test_stats_endpoint_requires_admin_token(client):
+    """Requests without the right bearer token are rejected."""
+    assert client.get("/stats").status_code == 401
+    assert client.get("/stats", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+
+def test_admin_endpoints_are_disabled_without_configured_token(client, monkeypatch):
+    """No token configured means the admin API is off."""
+    monkeypatch.delenv("ADMIN_API_TOKEN")
+
+    assert client.get("/stats", headers={"Authorization": "Bearer secret-token"}).status_code == 403
+
+
+def test_stats_endpoint_validates_date(client):
+    """A malformed date is a client error."""
+    response = client.get("/stats", params={"date": "30/08/2025"}, headers={"Authorization": "Bearer secret-token"})
+
+    assert response.status_code == 400
+
+
+def test_runtime_stats_report_configured_services(client):
+    """GET /stats/runtime exposes the stats() of each configured service, such as the media budget."""
+    client.app.media_budget = MediaMemoryBudget(max_bytes=1024, spill_threshold=512)
+    client.app.image_transformer = None
+
+    response = client.get("/stats/runtime", headers={"Authorization": "Bearer secret-token"})
+
+    assert response.status_code == 200
+    assert response.json() == {"media_budget": client.app.media_budget.stats()}
+
+
+def test_export_streams_the_daily_folder_as_zip(client):
+    """GET /export/{group}/{date}.zip streams the files of the group's daily folder."""
+    gdrive = MagicMock()
+    gdrive.find_folder.side_effect = lambda name, parent: {"Site B": "g1", "2025-08-30": "d1"}.get(name)
+    gdrive.list_children_page.return_value = ([{"id": "f1", "name": "photo.jpg", "mimeType": "image/jpeg"}], None)
+
+    def content(file_id, chunk_size, export_mime_type=None):
+        yield b"jpeg-"
+        yield b"bytes"
+
+    gdrive.iter_file_content.side_effect = content
+    client.app.gdrive_service = gdrive
+    headers = {"Authorization": "Bearer secret-token"}
+
+    response = client.get("/export/Site B/2025-08-30.zip", headers=headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    assert zipfile.ZipFile(io.BytesIO(response.content)).read("photo.jpg") == b"jpeg-bytes"
+    assert client.get("/export/Site Z/2025-08-30.zip", headers=headers).status_code == 404
+    assert client.get("/export/Site B/2025-08-30.zip").status_code == 401
+
+
+def test_export_is_unavailable_with_another_storage_backend(client):
+    """The export reads Drive folders, so it is off when uploads are stored elsewhere."""
+    client.app.gdrive_service = MagicMock()
+    client.app.storage_backend = MagicMock()
+
+    response = client.get("/export/Site B/2025-08-30.zip", headers={"Authorization": "Bearer secret-token"})
+
+    assert response.status_code == 404
+    assert "STORAGE_BACKEND" in response.json()["detail"]
+    client.app.gdrive_service.find_folder.assert_not_called()
+
+
+def test_metrics_endpoint_serves_prometheus_text(client):
+    """GET /metrics includes the pipeline metrics and the runtime stats as gauges."""
+    client.app.media_budget = MediaMemoryBudget(max_bytes=1024, spill_threshold=512)
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret-token"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE line_stage_seconds histogram" in response.text
+    assert "line_media_budget_budget_bytes 1024.0" in response.text
+    assert client.get("/metrics").status_code == 401
+
+
+def test_traces_endpoint_lists_kept_traces(client):
+    """GET /traces lists the in-memory traces, and is absent with another exporter."""
+    headers = {"Authorization": "Bearer secret-token"}
+    assert client.get("/traces", headers=headers).status_code == 404
+
+    client.app.tracer = tracing.Tracer(tracing.Sampler(rate=1.0), tracing.InMemoryExporter())
+    span = client.app.tracer.start_span("webhook")
+    client.app.tracer.end_span(span)
+
+    response = client.get("/traces", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()[0]["reason"] == "sampled"
+    assert response.json()[0]["spans"][0]["name"] == "webhook"
+
+
+def test_profile_endpoint_samples_busy_threads(client):
+    """GET /debug/profile returns collapsed stacks or speedscope JSON, one profile at a time."""
+    headers = {"Authorization": "Bearer secret-token"}
+    client.app.profiler = SamplingProfiler()
+    stop = threading.Event()
+
+    def crunch_numbers():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=crunch_numbers, name="cpu-worker")
+    worker.start()
+    try:
+        collapsed = client.get("/debug/profile", params={"seconds": 0.3}, headers=headers)
+        speedscope = client.get("/debug/profile", params={"seconds": 0.1, "format": "speedscope"}, headers=headers)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert collapsed.status_code == 200
+    line = next(line for line in collapsed.text.splitlines() if line.startswith("cpu-worker;"))
+    assert "crunch_numbers (" in line and int(line.rsplit(" ", 1)[1]) > 0
+    assert "cpu-worker" in [profile["name"] for profile in speedscope.json()["profiles"]]
+
+    client.app.profiler._lock.acquire()
+    try:
+        assert client.get("/debug/profile", params={"seconds": 1}, headers=headers).status_code == 409
+    finally:
+        client.app.profiler._lock.release()
+    assert client.get("/debug/profile", params={"seconds": 600}, headers=headers).status_code == 400
+
+
+def test_memory_endpoints_diff_snapshots_and_report_subsystems(client):
+    """Snapshots are taken only while tracing, and the diff points at the growing line."""
+    headers = {"Authorization": "Bearer secret-token"}
+    client.app.memory_snapshots = MemorySnapshots()
+    client.app.state_manager = StateManager()
+    retained = []
+    try:
+        assert client.post("/debug/memory/snapshots/before", headers=headers).status_code == 409
+        assert client.post("/debug/memory/start", headers=headers).json()["tracing"] is True
+        client.post("/debug/memory/snapshots/before", headers=headers)
+
+        retained.extend(bytearray(1024) for _ in range(2000))
+        client.app.state_manager.set_pending_upload("U1", "Site B")
+        client.post("/debug/memory/snapshots/after", headers=headers)
+
+        response = client.get("/debug/memory/diff", params={"base": "before", "against": "after"}, headers=headers)
+        assert client.get("/debug/memory/diff", params={"base": "missing"}, headers=headers).status_code == 404
+    finally:
+        client.app.memory_snapshots.stop()
+
+    top = response.json()["top"][0]
+    assert "test_admin_api.py" in top["location"]
+    assert top["size_diff_bytes"] >= 2000 * 1024
+    assert response.json()["subsystems"]["state_manager"] == {"active_sessions": 1, "stored_sessions": 1}
+    assert client.get("/debug/memory", headers=headers).json()["tracing"] is False
@@ -42,4 +42,16 @@ def test_parse_non_command_text():
     assert parse_command("hello world") is None
     assert parse_command("#s1") is None
     # Ensure the old command is no longer recognized
-    assert parse_command("list codes") is None
\ No newline at end of file
+    assert parse_command("list codes") is None
+def test_parse_search_command():
+    """Tests parsing the '?' note search command, with or without a space."""
+    assert parse_command("? rebar delivery") == {"action": "search", "query": "rebar delivery"}
+    assert parse_command("?เหล็ก") == {"action": "search", "query": "เหล็ก"}
+    assert parse_command("?") is None
+    assert parse_command("? rebar delivery", search_enabled=False) is None
+
+def test_parse_stats_command():
+    """Tests parsing '!stats' with and without a group."""
+    assert parse_command("!stats") == {"action": "stats", "group": ""}
+    assert parse_command("!stats Site B") == {"action": "stats", "group": "Site B"}
+    assert parse_command("!") == {"action": "list"}
@@ -0,0 +1,74 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from linebot.v3.messaging import PushMessageRequest, ReplyMessageRequest
+
+from src.confirmation_aggregator import ConfirmationAggregator
+
+
+@pytest.fixture
+def line_bot_api():
+    api = AsyncMock()
+    api.reply_message = AsyncMock()
+    api.push_message = AsyncMock()
+    return api
+
+
+@pytest.mark.asyncio
+async def test_burst_is_coalesced_into_one_reply(line_bot_api):
+    """A burst of outcomes inside the window results in a single reply."""
+    aggregator = ConfirmationAggregator(line_bot_api, window_seconds=0.01)
+
+    for i in range(12):
+        aggregator.record("U1", "Site A", "photo", reply_token=f"token_{i}")
+    aggregator.record("U1", "Site A", "note", reply_token="token_note")
+    await asyncio.sleep(0.05)
+
+    line_bot_api.reply_message.assert_awaited_once()
+    request: ReplyMessageRequest = line_bot_api.reply_message.call_args[0][0]
+    assert request.reply_token == "token_note"
+    assert request.messages[0].text == "✅ 12 photos saved to Site A\n✅ 1 note saved to Site A"
+    line_bot_api.push_message.assert_not_called()
+    assert aggregator.stats()["outcomes"] == 13
+
+
+@pytest.mark.asyncio
+async def test_expired_reply_token_falls_back_to_push(line_bot_api):
+    """Once the reply token is too old, the summary is pushed instead."""
+    aggregator = ConfirmationAggregator(line_bot_api, window_seconds=0.01, reply_token_ttl_seconds=0)
+
+    aggregator.record("U1", "Site A", "video", reply_token="old_token")
+    aggregator.record("U1", "Site A", "video", success=False)
+    await asyncio.sleep(0.05)
+
+    line_bot_api.reply_message.assert_not_called()
+    request: PushMessageRequest = line_bot_api.push_message.call_args[0][0]
+    assert request.to == "U1"
+    assert request.messages[0].text == "✅ 1 video saved to Site A\n⚠️ 1 video could not be saved to Site A"
+
+
+@pytest.mark.asyncio
+async def test_rejected_reply_falls_back_to_push(line_bot_api):
+    """A reply rejected by LINE (e.g. a token already used) is retried as a push."""
+    line_bot_api.reply_message.side_effect = Exception("Invalid reply token")
+    aggregator = ConfirmationAggregator(line_bot_api, window_seconds=0.01)
+
+    aggregator.record("U1", "Site B", "file", reply_token="used_token")
+    await asyncio.sleep(0.05)
+
+    line_bot_api.push_message.assert_awaited_once()
+    assert aggregator.stats()["pushes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_flush_all_sends_pending_summaries_immediately(line_bot_api):
+    """Pending summaries of every user are sent without waiting for the window."""
+    aggregator = ConfirmationAggregator(line_bot_api, window_seconds=60)
+
+    aggregator.record("U1", "Site A", "photo", reply_token="token_1")
+    aggregator.record("U2", "Site B", "photo", reply_token="token_2")
+    await aggregator.flush_all()
+
+    assert line_bot_api.reply_message.await_count == 2
+    assert aggregator.stats()["pending_users"] == 0
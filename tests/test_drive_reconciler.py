@@ -0,0 +1,89 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.drive_reconciler import DriveReconciler
+from src.rate_limiter import AsyncRateLimiter
+from src.upload_ledger import UploadLedger
+from src.upload_spool import UploadSpool, SpooledUpload
+
+FOLDERS = {
+    "parent": [{"id": "g-b", "name": "Site B"}, {"id": "g-c", "name": "Site C"}],
+    "g-b": [{"id": "d-30", "name": "2025-08-30"}, {"id": "d-01", "name": "2025-08-01"}],
+    "d-30": [
+        {"id": "f1"},
+        {"id": "f2-copy", "appProperties": {"line_message_id": "m2"}},
+        {"id": "f-spooled", "appProperties": {"line_message_id": "m9"}},
+    ],
+}
+
+
+class FakeDrive:
+    """Serves FOLDERS one entry per page, so every listing paginates."""
+    def __init__(self):
+        self.upload_index = MagicMock()
+        self.calls = []
+
+    def list_children_page(self, folder_id, fields, folders_only=False, page_token=None, page_size=1000):
+        self.calls.append((folder_id, fields))
+        children = FOLDERS.get(folder_id, [])
+        index = int(page_token or 0)
+        next_token = str(index + 1) if index + 1 < len(children) else None
+        return children[index:index + 1], next_token
+
+
+def at(day):
+    return datetime(2025, 8, day, 9).timestamp()
+
+
+@pytest.fixture
+def ledger():
+    ledger = UploadLedger(":memory:")
+    yield ledger
+    ledger.close()
+
+
+@pytest.fixture
+def spool():
+    spool = UploadSpool(":memory:")
+    yield spool
+    spool.close()
+
+
+@pytest.mark.asyncio
+async def test_missing_entries_are_requeued(ledger, spool):
+    """Entries found by file ID or message ID stay put; missing ones are spooled and unindexed."""
+    ledger.record("m1", "U1", "Site B", "photo", 10, "f1", 0, recorded_at=at(30))
+    ledger.record("m2", "U1", "Site B", "photo", 10, "f2", 0, recorded_at=at(30))
+    ledger.record("m3", "U2", "Site B", "video", 10, "f3", 0, recorded_at=at(30))
+    ledger.record("m4", "U1", "Site C", "file", 10, "f4", 0, recorded_at=at(30))
+    ledger.record("m5", "U1", "Site B", "note", 10, None, 0, recorded_at=at(30))
+    spool.enqueue(SpooledUpload("m9", "U1", "Site B", "2025-08-30", "photo", None, "missing_in_drive"))
+    drive = FakeDrive()
+    reconciler = DriveReconciler(drive, ledger, spool, "parent", rate_limiter=AsyncRateLimiter(rate=1000, burst=100))
+
+    report = await reconciler.reconcile("2025-08-01", "2025-08-31")
+
+    assert (report.ledger_entries, report.missing, report.requeued, report.spool_recovered) == (4, 2, 2, 1)
+    assert sorted(item.message_id for item in spool.items()) == ["m3", "m4"]
+    assert {call.args[0][0] for call in drive.upload_index.remove.call_args_list} == {"m3", "m4"}
+    assert ("d-30", "id, appProperties") in drive.calls
+    # Two pages of groups, two of Site B dates, one (empty) of Site C and three files; 2025-08-01 is skipped.
+    assert report.api_calls == len(drive.calls) == 2 + 2 + 1 + 3
+
+
+@pytest.mark.asyncio
+async def test_exhausted_spool_items_are_reported(ledger):
+    """Spooled items that are no longer retried and still missing are listed in the report."""
+    spool = UploadSpool(":memory:", max_attempts=1)
+    spool.enqueue(SpooledUpload("m7", "U1", "Site B", "2025-08-30", "photo", None, "missing_in_drive"))
+    spool.enqueue(SpooledUpload("m9", "U1", "Site B", "2025-08-30", "photo", None, "missing_in_drive"))
+    spool.mark_failed("m7")
+    spool.mark_failed("m9")
+    reconciler = DriveReconciler(FakeDrive(), ledger, spool, "parent", rate_limiter=AsyncRateLimiter(rate=1000, burst=100))
+
+    report = await reconciler.reconcile("2025-08-01", "2025-08-31")
+
+    assert (report.spool_recovered, report.spool_exhausted, report.exhausted_message_ids) == (1, 1, ["m7"])
+    spool.close()
@@ -0,0 +1,82 @@
+import json
+
+import fakeredis
+import pytest
+import pytest_asyncio
+from linebot.v3.webhooks import MessageEvent, TextMessageContent
+
+from src.event_stream import WebhookEventStream, StreamWorker
+from tests.test_helpers import create_mock_event
+
+
+def webhook_body(*texts):
+    events = [
+        json.loads(create_mock_event("U1", TextMessageContent(id=f"m{i}", text=text, quote_token="q")).to_json())
+        for i, text in enumerate(texts)
+    ]
+    return json.dumps({"destination": "Ubot", "events": events})
+
+
+@pytest_asyncio.fixture
+async def stream():
+    redis_client = fakeredis.FakeAsyncRedis()
+    stream = WebhookEventStream(redis_client, stream_name="events")
+    await stream.ensure_group()
+    yield stream
+    await redis_client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_worker_handles_and_acknowledges_deliveries(stream):
+    """Published deliveries reach the handler as parsed events, in order, and are acknowledged."""
+    received = []
+
+    async def handler(events):
+        assert all(isinstance(event, MessageEvent) for event in events)
+        received.append([event.message.text for event in events])
+
+    await stream.publish(webhook_body("#s1", "Rebar delivered"))
+    worker = StreamWorker(stream, "worker-1", handler, block_ms=10)
+
+    assert await worker.read_new() == 1
+    assert received == [["#s1", "Rebar delivered"]]
+    assert (await stream._redis.xpending("events", "upload-workers"))["pending"] == 0
+    assert worker.stats()["processed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_entries_of_a_dead_worker_are_claimed(stream):
+    """An entry a worker read but never acknowledged is handled by another worker once idle."""
+    received = []
+
+    async def handler(events):
+        received.append(events[0].message.text)
+
+    await stream.publish(webhook_body("Concrete poured"))
+    # worker-1 reads the entry and dies before handling it.
+    await stream._redis.xreadgroup("upload-workers", "worker-1", {"events": ">"}, count=10)
+    worker = StreamWorker(stream, "worker-2", handler, block_ms=10, claim_idle_ms=0)
+
+    assert await worker.read_new() == 0
+    assert await worker.claim_stale() == 1
+    assert received == ["Concrete poured"]
+    assert (await stream._redis.xpending("events", "upload-workers"))["pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_failing_entry_is_retried_then_dead_lettered(stream):
+    """A failing entry stays pending for a retry, and is dead-lettered after max_deliveries."""
+    async def handler(events):
+        raise RuntimeError("Drive unavailable")
+
+    await stream.publish(webhook_body("Formwork removed"))
+    worker = StreamWorker(stream, "worker-1", handler, block_ms=10, claim_idle_ms=0, max_deliveries=2)
+
+    await worker.read_new()
+    assert (await stream._redis.xpending("events", "upload-workers"))["pending"] == 1
+    await worker.claim_stale()
+
+    assert (await stream._redis.xpending("events", "upload-workers"))["pending"] == 0
+    dead = await stream._redis.xrange("events:dead")
+    assert len(dead) == 1 and dead[0][1][b"error"] == b"Drive unavailable"
+    assert worker.stats() == {"processed": 0, "failed": 2, "claimed": 1, "dead_lettered": 1}
@@ -0,0 +1,88 @@
+import threading
+from unittest.mock import MagicMock, patch
+from datetime import datetime
+
+import pytest
+
+from src.google_docs_notes import GoogleDocsNotesBackend, DOCUMENT_MIME_TYPE
+from tests.fake_docs_server import FakeDocsServer
+
+
+@pytest.fixture
+def docs_server():
+    server = FakeDocsServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def gdrive_service():
+    service = MagicMock()
+    service.service.files.return_value.list.return_value.execute.return_value = {'files': [{'id': 'doc_1'}]}
+    return service
+
+
+@patch('src.google_docs_notes.datetime')
+def test_notes_are_appended_in_place(mock_datetime, docs_server, gdrive_service):
+    """Each note is one batchUpdate at the end of the document; nothing is downloaded."""
+    mock_datetime.now.return_value = datetime(2025, 8, 30, 8, 0, 0)
+    docs_server.create_document("doc_1")
+    backend = GoogleDocsNotesBackend(gdrive_service, docs_service=docs_server.docs_service())
+
+    backend.append_text_to_file("2025-08-30_notes.txt", "First note", "daily_folder_id")
+    backend.append_text_to_file("2025-08-30_notes.txt", "ส่งเหล็กแล้ว", "daily_folder_id")
+
+    assert docs_server.text("doc_1") == "[2025-08-30 08:00:00] First note\n[2025-08-30 08:00:00] ส่งเหล็กแล้ว\n\n"
+    assert docs_server.batch_updates == ["doc_1", "doc_1"]
+    gdrive_service.service.files.return_value.get_media.assert_not_called()
+    # The document is looked up once and then cached.
+    gdrive_service.service.files.return_value.list.assert_called_once()
+
+
+def test_missing_document_is_created_as_google_doc(docs_server, gdrive_service):
+    """A day without a notes document gets a new Google Doc named without '.txt'."""
+    files = gdrive_service.service.files.return_value
+    files.list.return_value.execute.return_value = {'files': []}
+    files.create.return_value.execute.return_value = {'id': 'new_doc'}
+    docs_server.create_document("new_doc")
+    backend = GoogleDocsNotesBackend(gdrive_service, docs_service=docs_server.docs_service())
+
+    backend.append_text_to_file("2025-08-30_notes.txt", "Note", "daily_folder_id")
+
+    assert files.create.call_args[1]['body'] == {
+        'name': '2025-08-30_notes', 'parents': ['daily_folder_id'], 'mimeType': DOCUMENT_MIME_TYPE
+    }
+    assert "Note" in docs_server.text("new_doc")
+
+
+def test_concurrent_appends_are_not_lost(docs_server, gdrive_service):
+    """Concurrent writers to the same document all land in it."""
+    docs_server.create_document("doc_1")
+    backend = GoogleDocsNotesBackend(gdrive_service, docs_service=docs_server.docs_service())
+    backend.find_or_create_document("2025-08-30_notes.txt", "daily_folder_id")
+
+    # httplib2 connections are not thread-safe, so each writer uses its own client.
+    def writer(number):
+        GoogleDocsNotesBackend(gdrive_service, docs_service=docs_server.docs_service()).append_to_document(
+            "doc_1", f"note {number}"
+        )
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(docs_server.text("doc_1").split("\n")[:-2]) == sorted(f"note {n}" for n in range(10))
+
+
+def test_deleted_document_is_looked_up_again(docs_server, gdrive_service):
+    """A cached document that no longer exists is replaced on the next append."""
+    files = gdrive_service.service.files.return_value
+    files.list.return_value.execute.side_effect = [{'files': [{'id': 'gone'}]}, {'files': [{'id': 'doc_2'}]}]
+    docs_server.create_document("doc_2")
+    backend = GoogleDocsNotesBackend(gdrive_service, docs_service=docs_server.docs_service())
+
+    backend.append_text_to_file("2025-08-30_notes.txt", "Note", "daily_folder_id")
+
+    assert "Note" in docs_server.text("doc_2")
@@ -1,7 +1,10 @@
+import threading
+import hashlib
 from unittest.mock import MagicMock, patch
 import pytest
 
 from src.google_drive_uploader import GoogleDriveService
+from src.upload_index import UploadIndex
 
 # เราจะเพิ่ม patch สำหรับ os.getenv เพื่อควบคุมสภาพแวดล้อมของเทสต์
 @patch('src.google_drive_uploader.os.getenv')
@@ -84,12 +87,16 @@ def test_upload_file_calls_api_with_correct_parameters(mock_build, mock_get_cred
     assert file_id == 'uploaded_file_id'
     mock_media_io.assert_called_once()
     
-    expected_metadata = {'name': file_name, 'parents': [folder_id]}
+    expected_metadata = {
+        'name': file_name,
+        'parents': [folder_id],
+        'appProperties': {'sha256': hashlib.sha256(file_content).hexdigest()},
+    }
     
     mock_service.files.return_value.create.assert_called_once_with(
         body=expected_metadata,
         media_body=mock_media_io.return_value,
-        fields='id'
+        fields='id, md5Checksum'
     )
 
 @patch('src.google_drive_uploader.os.getenv')
@@ -145,4 +152,97 @@ def test_append_text_to_file_appends_to_existing_file(mock_build, mock_get_crede
     full_content = media_body._fd.getvalue()
 
     assert full_content.startswith(existing_content)
-    assert b"Appended line." in full_content
\ No newline at end of file
+    assert b"Appended line." in full_content
+
+@patch('src.google_drive_uploader.os.getenv')
+@patch('src.google_drive_uploader.GoogleDriveService._get_credentials')
+@patch('src.google_drive_uploader.build')
+def test_upload_file_tags_message_id_and_skips_retry(mock_build, mock_get_credentials, mock_getenv):
+    """
+    Tests that an upload carries the LINE message ID in appProperties and
+    that a retry of the same message is answered from the upload index.
+    """
+    mock_getenv.return_value = None
+    mock_service = MagicMock()
+    mock_build.return_value = mock_service
+    mock_get_credentials.return_value = MagicMock()
+    mock_request = MagicMock()
+    mock_service.files.return_value.create.return_value = mock_request
+    mock_request.next_chunk.return_value = (None, {'id': 'uploaded_file_id', 'md5Checksum': 'abc'})
+
+    google_drive_service = GoogleDriveService(upload_index=UploadIndex(":memory:"))
+    first_id = google_drive_service.upload_file('msg_1.jpg', b'image-bytes', 'folder_id', message_id='msg_1')
+    retry_id = google_drive_service.upload_file('msg_1.jpg', b'image-bytes', 'folder_id', message_id='msg_1')
+
+    assert first_id == retry_id == 'uploaded_file_id'
+    mock_service.files.return_value.create.assert_called_once()
+    metadata = mock_service.files.return_value.create.call_args[1]['body']
+    assert metadata['appProperties']['line_message_id'] == 'msg_1'
+
+@patch('src.google_drive_uploader.os.getenv')
+@patch('src.google_drive_uploader.GoogleDriveService._get_credentials')
+@patch('src.google_drive_uploader.build')
+def test_upload_file_skips_identical_content_in_same_folder(mock_build, mock_get_credentials, mock_getenv):
+    """
+    Tests that a different message with identical content in the same folder
+    reuses the existing file instead of uploading a duplicate.
+    """
+    mock_getenv.return_value = None
+    mock_service = MagicMock()
+    mock_build.return_value = mock_service
+    mock_get_credentials.return_value = MagicMock()
+    mock_request = MagicMock()
+    mock_service.files.return_value.create.return_value = mock_request
+    mock_request.next_chunk.return_value = (None, {'id': 'uploaded_file_id', 'md5Checksum': 'abc'})
+
+    upload_index = UploadIndex(":memory:")
+    google_drive_service = GoogleDriveService(upload_index=upload_index)
+    google_drive_service.upload_file('msg_1.jpg', b'same-bytes', 'folder_id', message_id='msg_1')
+    file_id = google_drive_service.upload_file('msg_2.jpg', b'same-bytes', 'folder_id', message_id='msg_2')
+
+    assert file_id == 'uploaded_file_id'
+    mock_service.files.return_value.create.assert_called_once()
+    assert upload_index.find_by_message_id('msg_2').file_id == 'uploaded_file_id'
+
+@patch('src.google_drive_uploader.os.getenv')
+@patch('src.google_drive_uploader.GoogleDriveService._get_credentials')
+@patch('src.google_drive_uploader.build')
+def test_write_text_file_overwrites_known_file_without_downloading(mock_build, mock_get_credentials, mock_getenv):
+    """
+    Tests that a text file with a known ID is rewritten without listing or downloading it.
+    """
+    mock_getenv.return_value = None
+    mock_service = MagicMock()
+    mock_build.return_value = mock_service
+    mock_get_credentials.return_value = MagicMock()
+
+    google_drive_service = GoogleDriveService()
+    file_id = google_drive_service.write_text_file("2025-08-30_notes.txt", "Line 1\nLine 2", "folder_id", file_id="notes_file_id")
+
+    assert file_id == "notes_file_id"
+    mock_service.files.return_value.list.assert_not_called()
+    mock_service.files.return_value.get_media.assert_not_called()
+    update_kwargs = mock_service.files.return_value.update.call_args[1]
+    assert update_kwargs['fileId'] == "notes_file_id"
+    assert update_kwargs['media_body']._fd.getvalue() == b"Line 1\nLine 2"
+
+@patch('src.google_drive_uploader.os.getenv')
+@patch('src.google_drive_uploader.GoogleDriveService._get_credentials')
+@patch('src.google_drive_uploader.build')
+@patch('src.google_drive_uploader.AuthorizedSession')
+def test_raw_http_sessions_are_per_thread(mock_session_class, mock_build, mock_get_credentials, mock_getenv):
+    """
+    Tests that resumable-upload and download requests made from worker
+    threads each use their own HTTP session.
+    """
+    mock_getenv.return_value = None
+    mock_session_class.side_effect = lambda credentials: MagicMock()
+    google_drive_service = GoogleDriveService()
+
+    sessions = []
+    worker = threading.Thread(target=lambda: sessions.append(google_drive_service._session()))
+    worker.start()
+    worker.join()
+
+    assert google_drive_service._session() is google_drive_service._session()
+    assert sessions[0] is not google_drive_service._session()
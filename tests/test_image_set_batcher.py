@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from src.image_set_batcher import ImageSetBatcher, UPLOADED, SKIPPED, FAILED
+
+
+@pytest.mark.asyncio
+async def test_destination_is_resolved_once_per_set():
+    """Concurrent photos of a set share the result of a single resolution."""
+    batcher = ImageSetBatcher()
+    batch = batcher.batch_for("set_1", 3)
+    calls = []
+
+    async def resolve():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ("Group_A", "daily_folder_id")
+
+    results = await asyncio.gather(*(batch.destination(resolve) for _ in range(3)))
+
+    assert results == [("Group_A", "daily_folder_id")] * 3
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_resolution_is_retried_by_the_next_photo():
+    """A failed resolution does not poison the rest of the set."""
+    batch = ImageSetBatcher().batch_for("set_1", 2)
+    attempts = []
+
+    async def resolve():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("Drive unavailable")
+        return "daily_folder_id"
+
+    with pytest.raises(RuntimeError):
+        await batch.destination(resolve)
+    assert await batch.destination(resolve) == "daily_folder_id"
+
+
+def test_summary_is_returned_after_the_last_photo():
+    """The set is summarised and forgotten once every photo has an outcome."""
+    batcher = ImageSetBatcher()
+    batch = batcher.batch_for("set_1", 3)
+
+    assert batcher.complete(batch, UPLOADED) is None
+    assert batcher.complete(batch, SKIPPED) is None
+    summary = batcher.complete(batch, FAILED)
+
+    assert (summary.uploaded, summary.skipped, summary.failed, summary.complete) == (1, 1, 1, True)
+    assert batcher.batch_for("set_1", 3) is not batch
+
+
+def test_stale_sets_expire():
+    """A set whose remaining photos never arrive is dropped after max_age_seconds."""
+    batcher = ImageSetBatcher(max_age_seconds=0)
+    batch = batcher.batch_for("set_1", 5)
+    batcher.complete(batch, UPLOADED)
+
+    batcher.batch_for("set_2", 1)
+
+    assert batcher.batch_for("set_1", 5) is not batch
+
+
+def test_file_stem_is_zero_padded_to_the_set_size():
+    """Index-based names sort in the order the photos were sent."""
+    batcher = ImageSetBatcher(name_by_index=True)
+
+    assert batcher.file_stem("abc", 3, 12) == "abc_03"
+    assert batcher.file_stem("abc", 3, 5) == "abc_3"
@@ -0,0 +1,96 @@
+import io
+import random
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from PIL import Image
+
+from src.shared_memory_executor import SharedMemoryExecutor
+from src.image_transformer import (
+    ImageTransformer, detect_image_format, JPEG, PNG, GIF, WEBP, HEIC
+)
+
+def make_image(format_name, size=(1600, 1200), mode="RGB", **save_options):
+    """Creates a noisy test image so that encoders cannot compress it away."""
+    rng = random.Random(0)
+    image = Image.new(mode, (size[0] // 8, size[1] // 8))
+    channels = len(mode)
+    image.putdata([tuple(rng.randrange(256) for _ in range(channels)) for _ in range(image.width * image.height)])
+    image = image.resize(size, Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, format=format_name, **save_options)
+    return buffer.getvalue()
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+def test_detect_image_format_from_magic_bytes():
+    """Tests that formats are recognised from their signatures, not their labels."""
+    assert detect_image_format(make_image("JPEG", size=(16, 16))) == JPEG
+    assert detect_image_format(make_image("PNG", size=(16, 16))) == PNG
+    assert detect_image_format(b"GIF89a" + b"\x00" * 10) == GIF
+    assert detect_image_format(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == WEBP
+    assert detect_image_format(b"\x00\x00\x00\x18ftypheic\x00\x00\x00\x00") == HEIC
+    assert detect_image_format(b"not an image") is None
+
+@pytest.mark.asyncio
+async def test_large_photo_is_resized_and_reencoded(executor):
+    """Tests that a large, high-quality JPEG is shrunk to the maximum dimension."""
+    original = make_image("JPEG", quality=95)
+    transformer = ImageTransformer(max_dimension=800, quality=80, executor=executor)
+
+    result = await transformer.transform(original)
+
+    assert result.transformed is True
+    assert result.image_format == JPEG
+    assert len(result.content) < len(original)
+    with Image.open(io.BytesIO(result.content)) as image:
+        assert max(image.size) == 800
+    assert transformer.stats()["savings_ratio"] > 0
+
+@pytest.mark.asyncio
+async def test_original_is_kept_when_savings_are_too_small(executor):
+    """Tests that the original is uploaded when re-encoding saves too little."""
+    original = make_image("JPEG", size=(400, 300), quality=60)
+    transformer = ImageTransformer(max_dimension=2048, quality=95, min_savings=0.5, executor=executor)
+
+    result = await transformer.transform(original)
+
+    assert result.transformed is False
+    assert result.content is original
+    assert transformer.stats()["kept_original"] == 1
+
+@pytest.mark.asyncio
+async def test_png_with_transparency_stays_png(executor):
+    """Tests that transparent images are not flattened into JPEG."""
+    original = make_image("PNG", mode="RGBA")
+    transformer = ImageTransformer(max_dimension=400, min_savings=0.0, executor=executor)
+
+    result = await transformer.transform(original)
+
+    assert result.image_format == PNG
+
+@pytest.mark.asyncio
+async def test_unrecognised_content_is_passed_through(executor):
+    """Tests that content that is not a known image is uploaded unchanged."""
+    transformer = ImageTransformer(executor=executor)
+
+    result = await transformer.transform(b"fake-image-bytes")
+
+    assert result.content == b"fake-image-bytes"
+    assert result.image_format == JPEG
+    assert result.transformed is False
+
+@pytest.mark.asyncio
+async def test_transform_through_shared_memory_executor():
+    """Tests that the transformer works on the shared memory executor path."""
+    executor = SharedMemoryExecutor(slot_count=2, slot_size=4 * 1024 * 1024, max_workers=1)
+    try:
+        transformer = ImageTransformer(max_dimension=800, executor=executor)
+        result = await transformer.transform(make_image("JPEG", quality=95))
+        assert result.transformed is True
+        assert isinstance(result.content, bytes)
+        assert executor._free.qsize() == 2
+    finally:
+        executor.shutdown()
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from linebot.v3.webhooks import TextMessageContent, ImageMessageContent, FileMessageContent, ContentProvider
+
+from src.inflight import InFlightTracker, drain_on_shutdown
+from src.state_manager import StateManager
+from src.upload_ledger import UploadLedger
+from src.upload_spool import UploadSpool
+from tests.test_helpers import create_mock_event
+
+
+def photo(message_id, user_id="U1"):
+    return create_mock_event(user_id, ImageMessageContent(
+        id=message_id, quote_token="q", content_provider=ContentProvider(type="line")
+    ))
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_deliveries_that_finish_before_the_deadline():
+    tracker = InFlightTracker()
+    finished = []
+
+    async def handle():
+        await asyncio.sleep(0.01)
+        finished.append(True)
+
+    tracker.spawn(handle(), [photo("m1")])
+
+    assert await tracker.drain(timeout=1) == []
+    assert finished == [True]
+    assert len(tracker) == 0
+    with pytest.raises(RuntimeError):
+        tracker.spawn(handle(), [])
+
+
+@pytest.mark.asyncio
+async def test_media_cut_off_at_the_deadline_is_handed_to_the_spool():
+    """Unfinished photos and files go to the spool; text and items already in the ledger do not."""
+    tracker = InFlightTracker()
+    state_manager = StateManager()
+    state_manager.set_pending_upload("U1", "Site B")
+    spool = UploadSpool(":memory:")
+    ledger = UploadLedger(":memory:")
+    ledger.record("m2", "U1", "Site B", "photo", 10, "saved", 0)
+    events = [
+        create_mock_event("U1", TextMessageContent(id="t1", text="hello", quote_token="q")),
+        photo("m1"),
+        photo("m2"),
+        create_mock_event("U1", FileMessageContent(id="f1", file_name="plan.pdf", file_size=3)),
+        photo("m3", user_id="U2"),
+    ]
+    cancelled = []
+
+    async def handle():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    tracker.spawn(handle(), events)
+    result = await drain_on_shutdown(tracker, 0.01, state_manager, spool, upload_ledger=ledger)
+
+    assert cancelled == [True]
+    assert result["in_flight"] == 1
+    assert result["handed_off"] == 2
+    assert [(item.message_id, item.kind, item.file_name, item.reason) for item in spool.items()] == [
+        ("m1", "photo", None, "shutdown"),
+        ("f1", "file", "plan.pdf", "shutdown"),
+    ]
+    spool.close()
+    ledger.close()
@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from src import structured_logging
+from src.loop_monitor import LoopMonitor
+
+
+def block_on_drive_call():
+    time.sleep(0.4)
+
+
+@pytest.mark.asyncio
+async def test_blocking_calls_are_logged_with_their_stack_and_event(caplog):
+    """A blocking call on the loop is reported once, with its stack and the IDs bound to its task."""
+    monitor = LoopMonitor(interval=0.02, block_threshold=0.1)
+    monitor.start()
+
+    async def handle():
+        with structured_logging.bind(message_id="m1", user_id="U1"):
+            block_on_drive_call()
+
+    try:
+        with caplog.at_level(logging.WARNING, logger="src.loop_monitor"):
+            await asyncio.create_task(handle(), name="event-m1")
+            await asyncio.sleep(0.1)
+    finally:
+        monitor.stop()
+
+    (record,) = caplog.records
+    assert "block_on_drive_call" in record.getMessage()
+    assert "event-m1" in record.getMessage()
+    assert (record.message_id, record.user_id) == ("m1", "U1")
+    stats = monitor.stats()
+    assert stats["blocks"] == 1
+    assert stats["longest_block_ms"] >= 300
+
+
+@pytest.mark.asyncio
+async def test_a_responsive_loop_only_records_its_lag(caplog):
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.5)
+    monitor.start()
+    try:
+        with caplog.at_level(logging.WARNING, logger="src.loop_monitor"):
+            await asyncio.sleep(0.1)
+    finally:
+        monitor.stop()
+
+    assert caplog.records == []
+    assert monitor.stats()["blocks"] == 0
+    assert monitor.stats()["max_lag_ms"] < 500
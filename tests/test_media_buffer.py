@@ -0,0 +1,56 @@
+import pytest
+
+from src.media_buffer import MediaMemoryBudget
+
+@pytest.fixture
+def budget():
+    """Provides a budget of 100 bytes with a 40-byte per-item threshold."""
+    return MediaMemoryBudget(max_bytes=100, spill_threshold=40)
+
+def test_small_content_stays_in_memory_and_is_released(budget):
+    """Tests that small content is held in memory and returned to the budget on close."""
+    with budget.new_buffer() as media_buffer:
+        media_buffer.write(b"a" * 30)
+        assert not media_buffer.spilled
+        assert budget.stats()["in_use_bytes"] == 30
+        with media_buffer.view() as view:
+            assert view == b"a" * 30
+
+    stats = budget.stats()
+    assert stats["in_use_bytes"] == 0
+    assert stats["buffers_in_flight"] == 0
+    assert stats["peak_bytes"] == 30
+
+def test_content_over_threshold_spills_to_disk(budget):
+    """Tests that an item growing past the per-item threshold moves to a temporary file."""
+    with budget.new_buffer() as media_buffer:
+        media_buffer.write(b"a" * 30)
+        media_buffer.write(b"b" * 30)
+        assert media_buffer.spilled
+        assert budget.stats()["in_use_bytes"] == 0
+        with media_buffer.view() as view:
+            assert view == b"a" * 30 + b"b" * 30
+        assert media_buffer.stream().read() == b"a" * 30 + b"b" * 30
+
+    assert budget.stats()["spills"] == 1
+
+def test_known_large_size_spills_up_front(budget):
+    """Tests that a Content-Length above the threshold spills before any write."""
+    with budget.new_buffer(expected_size=1000) as media_buffer:
+        assert media_buffer.spilled
+
+def test_exhausted_budget_spills_new_downloads(budget):
+    """Tests that buffers spill once concurrent in-memory buffers use up the budget."""
+    first, second, third = budget.new_buffer(), budget.new_buffer(), budget.new_buffer()
+    first.write(b"a" * 40)
+    second.write(b"b" * 40)
+    third.write(b"c" * 40)
+
+    assert not first.spilled and not second.spilled
+    assert third.spilled
+    assert budget.stats()["in_use_bytes"] == 80
+    assert budget.stats()["buffers_in_flight"] == 3
+
+    for media_buffer in (first, second, third):
+        media_buffer.close()
+    assert budget.stats()["in_use_bytes"] == 0
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+from src import metrics
+from src.state_manager import StateManager
+
+
+def sample(name, **labels):
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_stages_are_timed_into_the_stage_histogram():
+    before = sample("line_stage_seconds_count", stage="test_stage")
+
+    with metrics.stage("test_stage"):
+        pass
+
+    assert sample("line_stage_seconds_count", stage="test_stage") == before + 1
+
+
+def test_group_labels_are_opt_in():
+    """Uploaded bytes carry the group name only once group labels are enabled."""
+    try:
+        metrics.record_upload("test_kind", 100, "Site B")
+        assert sample("line_uploaded_bytes_total", kind="test_kind", group="") == 100
+        assert sample("line_uploaded_bytes_total", kind="test_kind", group="Site B") == 0
+
+        metrics.configure(group_labels=True)
+        metrics.record_upload("test_kind", 50, "Site B")
+        assert sample("line_uploaded_bytes_total", kind="test_kind", group="Site B") == 50
+    finally:
+        metrics.configure(group_labels=False)
+
+
+def test_render_reports_component_stats_as_gauges():
+    state_manager = StateManager()
+    state_manager.set_pending_upload("U1", "Site B")
+
+    families = {
+        family.name: family
+        for family in text_string_to_metric_families(metrics.render({"state_manager": state_manager}).decode())
+    }
+
+    assert families["line_state_manager_active_sessions"].samples[0].value == 1.0
+    assert "line_events" in families
+
+
+@pytest.mark.asyncio
+async def test_events_are_counted_by_type_and_outcome():
+    from unittest.mock import MagicMock, patch
+    from linebot.v3.webhooks import TextMessageContent
+    from src.webhook_processor import process_webhook_event
+    from tests.test_helpers import create_mock_event
+
+    event = create_mock_event("U1", TextMessageContent(id="m1", text="hello", quote_token="q"))
+    handled = sample("line_events_total", type="text", outcome="handled")
+    failed = sample("line_events_total", type="text", outcome="error")
+
+    with patch("src.webhook_processor.handle_text_message"):
+        await process_webhook_event(event, MagicMock(), MagicMock(), MagicMock(), MagicMock(), "token", None)
+    with patch("src.webhook_processor.handle_text_message", side_effect=RuntimeError("boom")):
+        with pytest.raises(RuntimeError):
+            await process_webhook_event(event, MagicMock(), MagicMock(), MagicMock(), MagicMock(), "token", None)
+
+    assert sample("line_events_total", type="text", outcome="handled") == handled + 1
+    assert sample("line_events_total", type="text", outcome="error") == failed + 1
@@ -0,0 +1,105 @@
+import io
+import random
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from PIL import Image
+
+from src.near_duplicate_detector import (
+    NearDuplicateDetector, BKTree, compute_dhash, hamming_distance
+)
+
+def make_jpeg(seed, size=(320, 240), quality=90):
+    """Creates a random-blocks JPEG image; the same seed gives the same picture."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (16, 12))
+    image.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(16 * 12)])
+    image = image.resize(size, Image.NEAREST)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+@pytest.fixture
+def detector():
+    """Provides a detector that hashes in threads to keep the tests fast."""
+    executor = ThreadPoolExecutor(max_workers=2)
+    yield NearDuplicateDetector(similarity_threshold=0.9, executor=executor)
+    executor.shutdown()
+
+def test_dhash_is_stable_across_reencoding():
+    """
+    Tests that re-encoding a photo at another size and quality barely changes
+    its hash, while a different photo has a distant hash.
+    """
+    original = compute_dhash(make_jpeg(1))
+    reencoded = compute_dhash(make_jpeg(1, size=(640, 480), quality=60))
+    different = compute_dhash(make_jpeg(2))
+
+    assert hamming_distance(original, reencoded) <= 4
+    assert hamming_distance(original, different) > 10
+
+def test_bk_tree_finds_hashes_within_distance():
+    """
+    Tests that the BK-tree returns only payloads within the requested distance,
+    closest first.
+    """
+    tree = BKTree()
+    tree.add(0b0000, "zero")
+    tree.add(0b0001, "one_bit")
+    tree.add(0b0111, "three_bits")
+    tree.add(0b1111, "four_bits")
+
+    assert tree.search(0b0000, 1) == [(0, "zero"), (1, "one_bit")]
+    assert [payload for _, payload in tree.search(0b1111, 1)] == ["four_bits", "three_bits"]
+    assert len(tree) == 4
+
+@pytest.mark.asyncio
+async def test_detects_near_duplicate_within_same_group_only(detector):
+    """
+    Tests that a re-sent photo is flagged in the same group but not in a
+    different group, and that stats reflect the skip rate.
+    """
+    assert await detector.check("Group_A", make_jpeg(1), "msg_1") is None
+    assert await detector.check("Group_A", make_jpeg(2), "msg_2") is None
+    detector.remember("msg_1")
+    detector.remember("msg_2")
+
+    match = await detector.check("Group_A", make_jpeg(1, quality=70), "msg_3")
+    assert match is not None
+    assert match.message_id == "msg_1"
+    assert match.similarity >= 0.9
+
+    assert await detector.check("Group_B", make_jpeg(1), "msg_4") is None
+
+    stats = detector.stats()
+    assert stats["processed"] == 4
+    assert stats["near_duplicates"] == 1
+    assert stats["skip_rate"] == pytest.approx(0.25)
+
+@pytest.mark.asyncio
+async def test_undecodable_content_is_treated_as_unique(detector):
+    """Tests that content Pillow cannot decode does not block the upload."""
+    assert await detector.check("Group_A", b"not-an-image", "msg_bad") is None
+    assert detector.stats()["failures"] == 1
+
+@pytest.mark.asyncio
+async def test_window_evicts_old_hashes():
+    """Tests that photos older than the window are no longer matched."""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        detector = NearDuplicateDetector(window_size=2, executor=executor)
+        for index in (1, 2, 3):
+            await detector.check("Group_A", make_jpeg(index), f"msg_{index}")
+            detector.remember(f"msg_{index}")
+
+        assert await detector.check("Group_A", make_jpeg(1), "msg_4") is None
+        assert (await detector.check("Group_A", make_jpeg(3), "msg_5")).message_id == "msg_3"
+
+@pytest.mark.asyncio
+async def test_failed_upload_does_not_block_its_retry(detector):
+    """An image is only remembered once uploaded, and never matches its own message ID."""
+    assert await detector.check("Group_A", make_jpeg(1), "msg_1") is None
+    # The upload failed, so remember() was never called; the retry is not a duplicate.
+    assert await detector.check("Group_A", make_jpeg(1), "msg_1") is None
+    detector.remember("msg_1")
+
+    assert await detector.check("Group_A", make_jpeg(1), "msg_1") is None
+    assert (await detector.check("Group_A", make_jpeg(1), "msg_2")).message_id == "msg_1"
@@ -0,0 +1,136 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.note_journal import NoteJournal, NoteExporter, render_notes
+
+
+@pytest.fixture
+def journal():
+    journal = NoteJournal(":memory:")
+    yield journal
+    journal.close()
+
+
+@pytest.fixture
+def gdrive_service():
+    service = MagicMock()
+    service.find_or_create_folder.side_effect = lambda name, parent_folder_id=None: f"{name}_folder_id"
+    service.write_text_file.return_value = "notes_file_id"
+    service.read_text_file.return_value = None
+    return service
+
+
+def at(hour, minute):
+    return datetime(2025, 8, 30, hour, minute).timestamp()
+
+
+def test_redelivered_note_is_journaled_once(journal):
+    """A note with an already journaled message ID is ignored."""
+    assert journal.append("Group_A", "U1", "Rebar delivered", message_id="m1") is not None
+    assert journal.append("Group_A", "U1", "Rebar delivered", message_id="m1") is None
+
+    assert [n.text for n in journal.notes_for_day("Group_A", datetime.now().strftime("%Y-%m-%d"))] == ["Rebar delivered"]
+
+
+def test_notes_render_in_daily_file_format(journal):
+    """Notes are rendered as timestamped lines, oldest first."""
+    journal.append("Group_A", "U1", "First", created_at=at(8, 0))
+    journal.append("Group_A", "U2", "Second", created_at=at(9, 30))
+
+    rendered = render_notes(journal.notes_for_day("Group_A", "2025-08-30"))
+
+    assert rendered == "[2025-08-30 08:00:00] First\n[2025-08-30 09:30:00] Second"
+    assert [n.text for n in journal.notes_by_user("U2")] == ["Second"]
+
+
+@pytest.mark.asyncio
+async def test_exporter_writes_each_changed_day_once_per_flush(journal, gdrive_service):
+    """Many notes cost one Drive write per day, and unchanged days are not rewritten."""
+    for minute in range(20):
+        journal.append("Group_A", "U1", f"Note {minute}", created_at=at(8, minute))
+    journal.append("Group_B", "U2", "Other site", created_at=at(10, 0))
+    exporter = NoteExporter(journal, gdrive_service, "parent_id")
+
+    assert await exporter.flush() == 2
+    assert gdrive_service.write_text_file.call_count == 2
+    name, content, folder_id = gdrive_service.write_text_file.call_args_list[0][0]
+    assert (name, folder_id) == ("2025-08-30_notes.txt", "2025-08-30_folder_id")
+    assert content.count("\n") == 19
+
+    assert await exporter.flush() == 0
+
+    journal.append("Group_A", "U1", "Late note", created_at=at(17, 0))
+    assert await exporter.flush() == 1
+    assert gdrive_service.write_text_file.call_args[1]["file_id"] == "notes_file_id"
+
+
+@pytest.mark.asyncio
+async def test_failed_export_is_retried_on_next_flush(journal, gdrive_service):
+    """A day whose upload failed stays pending."""
+    journal.append("Group_A", "U1", "Note", created_at=at(8, 0))
+    gdrive_service.write_text_file.side_effect = [Exception("Drive unavailable"), "notes_file_id"]
+    exporter = NoteExporter(journal, gdrive_service, "parent_id")
+
+    assert await exporter.flush() == 0
+    assert journal.pending_exports() == [("Group_A", "2025-08-30", 1)]
+    assert await exporter.flush() == 1
+    assert journal.pending_exports() == []
+
+
+def test_search_is_scoped_to_group_and_matches_all_terms(journal):
+    """Search matches substrings of every term, only within the given group."""
+    journal.append("Group_A", "U1", "Rebar delivery arrived at gate 2", created_at=at(8, 0))
+    journal.append("Group_A", "U1", "Concrete delivery delayed", created_at=at(9, 0))
+    journal.append("Group_B", "U2", "Rebar delivery for site B", created_at=at(10, 0))
+
+    assert [n.text for n in journal.search("Group_A", "rebar deliver")] == ["Rebar delivery arrived at gate 2"]
+    assert len(journal.search("Group_A", "delivery")) == 2
+    assert journal.search("Group_A", "scaffold") == []
+
+
+def test_search_handles_thai_and_short_terms(journal):
+    """Thai text is found without word breaks, and short terms fall back to a scan."""
+    journal.append("Group_A", "U1", "ส่งเหล็กเส้นเข้าหน้างานแล้ว", created_at=at(8, 0))
+    journal.append("Group_A", "U1", "Pour slab at B2", created_at=at(9, 0))
+
+    assert len(journal.search("Group_A", "เหล็กเส้น")) == 1
+    assert [n.text for n in journal.search("Group_A", "b2")] == ["Pour slab at B2"]
+    assert journal.search("Group_A", 'quote"s') == []
+
+
+def test_search_index_is_built_for_an_existing_journal(tmp_path):
+    """Notes journaled before the search index existed are indexed on open."""
+    import sqlite3
+
+    db_path = str(tmp_path / "notes.db")
+    NoteJournal(db_path).append("Group_A", "U1", "Rebar delivered", created_at=at(8, 0))
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP TABLE notes_fts")
+    conn.execute("DROP TRIGGER notes_fts_insert")
+    conn.close()
+
+    assert len(NoteJournal(db_path).search("Group_A", "rebar")) == 1
+
+
+@pytest.mark.asyncio
+async def test_first_export_keeps_notes_already_in_the_drive_file(journal, gdrive_service):
+    """A file written before the journal existed is seeded, not overwritten."""
+    gdrive_service.read_text_file.return_value = (
+        "old_file_id", "[2025-08-30 07:00:00] Written earlier\ncontinued\n[2025-08-30 09:00:00] Also earlier"
+    )
+    journal.append("Group_A", "U1", "Journaled", created_at=at(8, 0))
+    exporter = NoteExporter(journal, gdrive_service, "parent_id")
+
+    assert await exporter.flush() == 1
+    assert await exporter.flush() == 0
+
+    name, content, _ = gdrive_service.write_text_file.call_args[0]
+    assert content == (
+        "[2025-08-30 07:00:00] Written earlier\ncontinued\n"
+        "[2025-08-30 08:00:00] Journaled\n"
+        "[2025-08-30 09:00:00] Also earlier"
+    )
+    assert gdrive_service.write_text_file.call_args[1]["file_id"] == "old_file_id"
+    assert journal.seed_day("Group_A", "2025-08-30", "[2025-08-30 07:00:00] Written earlier\ncontinued") == 0
@@ -0,0 +1,25 @@
+import asyncio
+import time
+
+import pytest
+
+from src.rate_limiter import AsyncRateLimiter
+
+
+@pytest.mark.asyncio
+async def test_burst_is_admitted_then_calls_are_paced():
+    """The first `burst` calls pass at once; the rest wait for the refill rate."""
+    limiter = AsyncRateLimiter(rate=50, burst=5)
+
+    started = time.monotonic()
+    await asyncio.gather(*(limiter.acquire() for _ in range(10)))
+    elapsed = time.monotonic() - started
+
+    # Five calls beyond the burst at 50 per second take about 0.1 seconds.
+    assert 0.08 <= elapsed < 0.5
+    assert limiter.stats()["acquired"] == 10
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        AsyncRateLimiter(rate=0)
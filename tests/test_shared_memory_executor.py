@@ -0,0 +1,71 @@
+import zlib
+import pytest
+
+from src.shared_memory_executor import SharedMemoryExecutor, SharedMemoryResult, run_cpu_stage
+
+def _checksum(content):
+    return zlib.crc32(content)
+
+def _upper(content):
+    return bytes(content).upper()
+
+def _fail(content):
+    raise ValueError("boom")
+
+@pytest.fixture
+def executor():
+    """Provides a small shared memory executor with two 1 KiB slots."""
+    executor = SharedMemoryExecutor(slot_count=2, slot_size=1024, max_workers=1)
+    yield executor
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_small_results_are_returned_directly(executor):
+    """Tests that a non-bytes result is returned as-is and the slot is freed."""
+    result = await executor.run(_checksum, b"image-bytes")
+
+    assert result == zlib.crc32(b"image-bytes")
+    assert executor._free.qsize() == 2
+
+@pytest.mark.asyncio
+async def test_bytes_results_come_back_through_shared_memory(executor):
+    """Tests that bytes results are returned as a view that holds its slot until released."""
+    result = await executor.run(_upper, b"image-bytes")
+
+    assert isinstance(result, SharedMemoryResult)
+    assert result.view == b"IMAGE-BYTES"
+    assert executor._free.qsize() == 1
+
+    result.release()
+    assert executor._free.qsize() == 2
+
+@pytest.mark.asyncio
+async def test_oversized_content_uses_pickled_path(executor):
+    """Tests that content larger than a slot still works through the plain pool."""
+    content = b"x" * 4096
+
+    result = await executor.run(_upper, content)
+
+    assert result == b"X" * 4096
+    assert executor._free.qsize() == 2
+
+@pytest.mark.asyncio
+async def test_worker_errors_are_raised_and_free_the_slot(executor):
+    """Tests that a failing stage raises in the caller without leaking a slot."""
+    with pytest.raises(ValueError):
+        await executor.run(_fail, b"image-bytes")
+    assert executor._free.qsize() == 2
+
+@pytest.mark.asyncio
+async def test_run_cpu_stage_dispatches_to_shared_memory(executor):
+    """Tests that the common stage runner uses the shared memory path."""
+    with await run_cpu_stage(executor, _upper, b"abc") as result:
+        assert result.tobytes() == b"ABC"
+
+
+def test_slots_that_do_not_fit_in_dev_shm_are_refused(monkeypatch):
+    """Tests that the executor fails at startup, not with SIGBUS later, when /dev/shm is too small."""
+    monkeypatch.setattr("src.shared_memory_executor.shared_memory_available", lambda: 64 * 1024 * 1024)
+
+    with pytest.raises(RuntimeError, match="needs 128 MB but /dev/shm has only 64 MB free"):
+        SharedMemoryExecutor(slot_count=8, slot_size=16 * 1024 * 1024, max_workers=1)
@@ -0,0 +1,44 @@
+from unittest.mock import MagicMock, patch, AsyncMock
+
+import pytest
+
+from src.upload_ledger import UploadLedger
+from src.upload_spool import UploadSpool, SpooledUpload
+from src.spool_drainer import drain_spool
+
+
+def item(message_id, **overrides):
+    fields = dict(
+        message_id=message_id, user_id="U1", group_name="Site B", entry_date="2025-08-30",
+        kind="photo", file_name=None, reason="missing_in_drive",
+    )
+    fields.update(overrides)
+    return SpooledUpload(**fields)
+
+
+@pytest.fixture
+def spool():
+    spool = UploadSpool(":memory:", max_attempts=2)
+    yield spool
+    spool.close()
+
+
+@pytest.mark.asyncio
+async def test_drain_uploads_into_the_original_date_folder(spool):
+    """Drained items go to the group's folder of their original date and update the ledger."""
+    ledger = UploadLedger(":memory:")
+    ledger.record("m1", "U1", "Site B", "photo", 10, "lost", 0)
+    spool.enqueue(item("m1"))
+    spool.enqueue(item("m2"))
+    gdrive = MagicMock()
+    gdrive.find_or_create_folder.side_effect = lambda name, parent_folder_id=None: f"{parent_folder_id}/{name}"
+    stream = AsyncMock(side_effect=lambda message_id, *args, **kwargs: "new-id" if message_id == "m1" else None)
+
+    with patch("src.spool_drainer.stream_content_to_drive", stream):
+        result = await drain_spool(spool, gdrive, "token", "parent", upload_ledger=ledger)
+
+    assert result == {"uploaded": 1, "failed": 1}
+    assert stream.await_args_list[0].args[3] == "parent/Site B/2025-08-30"
+    assert [queued.message_id for queued in spool.items()] == ["m2"]
+    assert ledger.entries_between("2025-01-01", "2099-12-31")[0].file_id == "new-id"
+    ledger.close()
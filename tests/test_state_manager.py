@@ -1,5 +1,6 @@
 import pytest
 import time
+from unittest.mock import MagicMock, patch
 from src.state_manager import StateManager
 
 @pytest.fixture
@@ -76,4 +77,38 @@ def test_refresh_session_updates_timestamp(state_manager):
         "timestamp": old_timestamp
     }
         
-    
\ No newline at end of file
+    
+
+def test_redis_sessions_are_shared_between_managers():
+    """A session started through one worker's manager is seen by another's."""
+    import fakeredis
+    from src.state_manager import RedisStateManager
+
+    server = fakeredis.FakeServer()
+    first = RedisStateManager(fakeredis.FakeRedis(server=server, decode_responses=True))
+    second = RedisStateManager(fakeredis.FakeRedis(server=server, decode_responses=True))
+
+    first.set_pending_upload("U1", "Group_A")
+
+    assert second.get_active_group("U1") == "Group_A"
+    assert second.get_active_group("U2") is None
+
+
+def test_redis_stats_count_active_sessions_without_scanning():
+    """Active sessions are counted from the expiry set; expired ones are dropped from it."""
+    import fakeredis
+    from src.state_manager import RedisStateManager
+
+    client = fakeredis.FakeRedis(decode_responses=True)
+    manager = RedisStateManager(client, session_duration_seconds=10)
+    manager.set_pending_upload("U1", "Group_A")
+    manager.set_pending_upload("U2", "Group_B")
+    manager.set_pending_upload("U1", "Group_C")
+
+    with patch("src.state_manager.time.time", return_value=time.time() + 5):
+        manager.set_pending_upload("U3", "Group_A")
+    client.scan_iter = MagicMock(side_effect=AssertionError("stats() must not scan"))
+
+    assert manager.stats() == {"active_sessions": 3}
+    with patch("src.state_manager.time.time", return_value=time.time() + 11):
+        assert manager.stats() == {"active_sessions": 1}
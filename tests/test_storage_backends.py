@@ -0,0 +1,127 @@
+import os
+import tempfile
+from unittest.mock import MagicMock
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from src.storage_backends import StorageBackend, LocalStorageBackend, S3StorageBackend, MIN_PART_SIZE
+from src.upload_index import UploadIndex
+
+
+@pytest.fixture
+def local(tmp_path):
+    return LocalStorageBackend(str(tmp_path / "storage"))
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="photos")
+        yield S3StorageBackend("photos", prefix="line", client=client, part_size=MIN_PART_SIZE)
+
+
+def test_local_backend_keeps_the_group_date_layout(local):
+    """Files land in <root>/<group>/<date>, and names cannot escape their folder."""
+    group_folder = local.find_or_create_folder("Site B")
+    daily_folder = local.find_or_create_folder("2025-08-30", parent_folder_id=group_folder)
+
+    file_id = local.upload_file("msg_1.jpg", b"jpeg-bytes", daily_folder, message_id="msg_1")
+    escaped_id = local.upload_file("../../evil.txt", b"x", daily_folder)
+
+    assert file_id == "Site B/2025-08-30/msg_1.jpg"
+    with open(os.path.join(local.root_dir, "Site B", "2025-08-30", "msg_1.jpg"), "rb") as f:
+        assert f.read() == b"jpeg-bytes"
+    assert escaped_id == "Site B/2025-08-30/.._.._evil.txt"
+    assert sorted(os.listdir(os.path.join(local.root_dir, "Site B", "2025-08-30"))) == [".._.._evil.txt", "msg_1.jpg"]
+
+
+def test_local_backend_copies_spilled_files_from_their_current_position(local):
+    """A file object is copied from where it stands, leaving no temporary file behind."""
+    folder = local.find_or_create_folder("Site B")
+    with tempfile.TemporaryFile() as source:
+        source.write(b"header" + b"video" * 100_000)
+        source.seek(len(b"header"))
+        file_id = local.upload_file("clip.mp4", source, folder, mime_type="video/mp4")
+
+    assert local.read_text_file("clip.mp4", folder) == (file_id, "video" * 100_000)
+    assert os.listdir(os.path.join(local.root_dir, "Site B")) == ["clip.mp4"]
+
+
+def test_backends_store_each_message_once_with_an_upload_index(tmp_path):
+    """A redelivered message is not written again, and its size and digests are indexed."""
+    index = UploadIndex(str(tmp_path / "index.db"))
+    backend = LocalStorageBackend(str(tmp_path / "storage"), upload_index=index)
+    folder = backend.find_or_create_folder("Site B")
+    with tempfile.TemporaryFile() as source:
+        source.write(b"header" + b"video" * 1000)
+        source.seek(len(b"header"))
+        file_id = backend.upload_file("clip.mp4", source, folder, message_id="msg_1", mime_type="video/mp4")
+
+    redelivered_id = backend.upload_file("clip (1).mp4", b"other", folder, message_id="msg_1")
+
+    assert redelivered_id == file_id
+    assert os.listdir(os.path.join(backend.root_dir, "Site B")) == ["clip.mp4"]
+    assert backend.read_text_file("clip.mp4", folder) == (file_id, "video" * 1000)
+    indexed = index.find_by_message_id("msg_1")
+    assert (indexed.file_id, indexed.folder_id, indexed.size) == (file_id, folder, 5000)
+
+
+def test_storage_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+def test_local_backend_appends_notes_in_the_daily_file_format(local):
+    folder = local.find_or_create_folder("2025-08-30", parent_folder_id=local.find_or_create_folder("Site B"))
+
+    local.append_text_to_file("2025-08-30_notes.txt", "Rebar delivered", folder)
+    local.append_text_to_file("2025-08-30_notes.txt", "Concrete poured", folder)
+
+    _, content = local.read_text_file("2025-08-30_notes.txt", folder)
+    lines = content.split("\n")
+    assert [line.split("] ", 1)[1] for line in lines] == ["Rebar delivered", "Concrete poured"]
+    assert all(line.startswith("[") for line in lines)
+
+
+def test_s3_backend_uploads_large_content_in_parts(s3):
+    """Content larger than one part goes up as a multipart upload, with its message ID as metadata."""
+    folder = s3.find_or_create_folder("2025-08-30", parent_folder_id=s3.find_or_create_folder("Site B"))
+    content = os.urandom(MIN_PART_SIZE * 2 + 1024)
+
+    file_id = s3.upload_file("clip.mp4", content, folder, message_id="msg_9", mime_type="video/mp4")
+
+    stored = s3._client.get_object(Bucket="photos", Key="line/Site B/2025-08-30/clip.mp4")
+    assert file_id == "Site B/2025-08-30/clip.mp4"
+    assert stored["Body"].read() == content
+    assert stored["ContentType"] == "video/mp4"
+    assert stored["Metadata"] == {"line-message-id": "msg_9"}
+    assert stored["ETag"].strip('"').endswith("-3")
+
+
+def test_s3_backend_appends_and_rewrites_text_files(s3):
+    folder = s3.find_or_create_folder("Site B")
+
+    assert s3.read_text_file("notes.txt", folder) is None
+    s3.append_text_to_file("notes.txt", "First", folder)
+    s3.append_text_to_file("notes.txt", "Second", folder)
+    file_id, content = s3.read_text_file("notes.txt", folder)
+
+    assert file_id == "Site B/notes.txt"
+    assert [line.split("] ", 1)[1] for line in content.split("\n")] == ["First", "Second"]
+
+
+def test_s3_backend_aborts_a_failed_multipart_upload():
+    """Parts already sent are discarded when an upload fails part-way."""
+    client = MagicMock()
+    client.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    client.upload_part.side_effect = [{"ETag": "etag-1"}, ConnectionError("connection reset")]
+    backend = S3StorageBackend("photos", client=client, part_size=MIN_PART_SIZE)
+
+    with pytest.raises(ConnectionError):
+        backend.upload_file("clip.mp4", b"x" * (MIN_PART_SIZE * 2), "Site B")
+
+    client.abort_multipart_upload.assert_called_once_with(Bucket="photos", Key="Site B/clip.mp4", UploadId="upload-1")
+    client.complete_multipart_upload.assert_not_called()
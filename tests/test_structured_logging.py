@@ -0,0 +1,85 @@
+import asyncio
+import io
+import json
+import logging
+import queue
+
+import pytest
+
+from src import structured_logging, tracing
+
+
+@pytest.fixture
+def log_output():
+    """Routes the root logger through the queue for the test, then restores it."""
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    stream = io.StringIO()
+    handler, listener = structured_logging.configure(rate_per_second=2, stream=stream)
+
+    def read():
+        listener.stop()  # Flushes the queue.
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    yield handler, read
+    root.handlers[:] = saved_handlers
+    root.setLevel(saved_level)
+
+
+@pytest.mark.asyncio
+async def test_records_carry_the_bound_ids_of_their_event(log_output):
+    """Records logged in concurrent tasks and threads carry their own event's IDs."""
+    _, read = log_output
+    logger = logging.getLogger("tests.handler")
+
+    async def handle(message_id):
+        with structured_logging.bind(message_id=message_id, user_id="U1"):
+            await asyncio.sleep(0)
+            await asyncio.to_thread(logger.warning, "Uploading %s", message_id)
+
+    await asyncio.gather(handle("m1"), handle("m2"))
+    logger.warning("Outside any event")
+
+    records = {record["message"]: record for record in read()}
+    assert records["Uploading m1"]["message_id"] == "m1"
+    assert records["Uploading m2"]["message_id"] == "m2"
+    assert records["Uploading m2"]["user_id"] == "U1"
+    assert "message_id" not in records["Outside any event"]
+
+
+def test_records_carry_the_trace_id_and_extra_fields(log_output):
+    _, read = log_output
+    tracing.configure(tracing.Tracer(tracing.Sampler(rate=0.0), tracing.InMemoryExporter()))
+    try:
+        with tracing.span("webhook") as span:
+            logging.getLogger("tests").warning("Slow upload", extra={"bytes": 2048})
+    finally:
+        tracing.configure(None)
+
+    (record,) = read()
+    assert record["trace_id"] == span.trace_id
+    assert record["bytes"] == 2048
+    assert record["level"] == "WARNING"
+
+
+def test_info_records_are_rate_limited_per_call_site(log_output):
+    """Past the limit, INFO records from one line are dropped; warnings always pass."""
+    handler, read = log_output
+    logger = logging.getLogger("tests.hot")
+
+    for i in range(10):
+        logger.info("Uploaded chunk %s", i)
+    logger.warning("Upload failed")
+
+    records = read()
+    assert [record["message"] for record in records] == ["Uploaded chunk 0", "Uploaded chunk 1", "Upload failed"]
+    assert handler.stats()["dropped_rate_limit"] == 8
+
+
+def test_a_full_queue_drops_records_instead_of_blocking():
+    handler = structured_logging.ContextQueueHandler(queue.Queue(maxsize=1))
+
+    for _ in range(3):
+        handler.handle(logging.makeLogRecord({"msg": "event", "levelno": logging.WARNING}))
+
+    assert handler.stats() == {"queued": 1, "dropped_full": 2, "dropped_rate_limit": 0}
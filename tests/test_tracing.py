@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+import pytest
+import sentry_sdk
+from sentry_sdk.transport import Transport
+
+from src import tracing
+from src.tracing import Tracer, Sampler, InMemoryExporter, JsonLinesExporter, SentryExporter
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemoryExporter()
+    tracing.configure(Tracer(Sampler(rate=0.0, slow_seconds=5.0), exporter))
+    yield exporter
+    tracing.configure(None)
+
+
+def test_errors_and_slow_traces_are_always_kept():
+    sampler = Sampler(rate=0.0, slow_seconds=5.0)
+    ok = tracing.Span("webhook", "t", "s1", None, start=100.0, end=100.2)
+    failed = tracing.Span("drive.upload_file", "t", "s2", "s1", start=100.0, end=100.1, error="HttpError: 500")
+    slow = tracing.Span("webhook", "t", "s1", None, start=100.0, end=106.0)
+
+    assert sampler.keep([ok]) is None
+    assert sampler.keep([ok, failed]) == "error"
+    assert sampler.keep([slow]) == "slow"
+    assert Sampler(rate=0.5, random_fn=lambda: 0.4).keep([ok]) == "sampled"
+
+
+@pytest.mark.asyncio
+async def test_spans_in_tasks_and_threads_join_the_trace(exporter):
+    """A delivery started by the request continues its trace in a task, and blocking calls in threads."""
+    @tracing.traced("drive.upload_file")
+    def upload():
+        raise RuntimeError("quota exceeded")
+
+    async def handle(span):
+        with tracing.activate(span):
+            with tracing.span("event", type="image"):
+                await asyncio.to_thread(upload)
+
+    with tracing.span("webhook"):
+        task = asyncio.create_task(handle(tracing.start_span("process_delivery")))
+    with pytest.raises(RuntimeError):
+        await task
+
+    (trace,) = exporter.traces()
+    spans = {span["name"]: span for span in trace["spans"]}
+    assert trace["reason"] == "error"
+    assert spans["process_delivery"]["parent_id"] == spans["webhook"]["span_id"]
+    assert spans["drive.upload_file"]["parent_id"] == spans["event"]["span_id"]
+    assert spans["drive.upload_file"]["error"] == "RuntimeError: quota exceeded"
+    assert len({span["trace_id"] for span in trace["spans"]}) == 1
+
+
+def test_ordinary_traces_are_dropped_and_counted(exporter):
+    with tracing.span("webhook"):
+        pass
+
+    assert exporter.traces() == []
+    assert tracing.get_tracer().stats() == {"traces_kept": 0, "traces_dropped": 1, "traces_open": 0, "export_failures": 0}
+
+
+def test_a_remote_traceparent_is_continued(exporter):
+    with tracing.span("webhook"):
+        parent = tracing.traceparent()
+    with pytest.raises(ValueError), tracing.span("process_delivery", traceparent=parent):
+        raise ValueError("bad payload")
+
+    (trace,) = exporter.traces()
+    _, trace_id, span_id, _ = parent.split("-")
+    assert trace["spans"][0]["trace_id"] == trace_id
+    assert trace["spans"][0]["parent_id"] == span_id
+
+
+def test_json_lines_exporter_appends_one_line_per_trace(tmp_path):
+    path = tmp_path / "traces" / "traces.jsonl"
+    tracer = Tracer(Sampler(rate=1.0), JsonLinesExporter(str(path)))
+
+    for _ in range(2):
+        tracer.end_span(tracer.start_span("webhook", body_bytes=512))
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(lines) == 2
+    assert lines[0]["spans"][0]["attributes"] == {"body_bytes": 512}
+
+
+class CapturingTransport(Transport):
+    def __init__(self, options=None):
+        super().__init__(options)
+        self.envelopes = []
+
+    def capture_envelope(self, envelope):
+        self.envelopes.append(envelope)
+
+
+def test_sentry_exporter_sends_a_transaction_with_child_spans():
+    transport = CapturingTransport()
+    sentry_sdk.init(dsn="https://key@sentry.invalid/1", transport=transport, traces_sample_rate=0.0, default_integrations=False)
+    try:
+        tracer = Tracer(Sampler(slow_seconds=0.0), SentryExporter())
+        root = tracer.start_span("webhook")
+        with tracer.activate(root):
+            tracer.end_span(tracer.start_span("drive.upload_file"))
+        sentry_sdk.flush()
+    finally:
+        sentry_sdk.init()
+
+    transactions = [item.payload.json for envelope in transport.envelopes for item in envelope.items if item.type == "transaction"]
+    assert len(transactions) == 1
+    assert transactions[0]["transaction"] == "webhook"
+    assert transactions[0]["tags"]["sampling_reason"] == "slow"
+    assert transactions[0]["contexts"]["trace"]["trace_id"] == root.trace_id
+    assert [span["op"] for span in transactions[0]["spans"]] == ["drive.upload_file"]
@@ -0,0 +1,59 @@
+import hashlib
+from unittest.mock import MagicMock
+import pytest
+
+from src.upload_index import UploadIndex, IndexedUpload
+
+@pytest.fixture
+def upload_index():
+    """Provides a clean in-memory UploadIndex for each test."""
+    return UploadIndex(":memory:")
+
+def make_entry(message_id, content=b"content", file_id="file_1", folder_id="folder_1"):
+    return IndexedUpload(
+        message_id=message_id,
+        sha256=hashlib.sha256(content).hexdigest(),
+        md5=hashlib.md5(content).hexdigest(),
+        size=len(content),
+        file_id=file_id,
+        folder_id=folder_id,
+        file_name=f"{message_id}.jpg",
+    )
+
+def test_find_by_message_id_and_hash(upload_index):
+    """
+    Tests that a recorded upload can be found by message ID and by content
+    hash within the same folder only.
+    """
+    entry = make_entry("msg_1")
+    upload_index.record(entry)
+
+    assert upload_index.find_by_message_id("msg_1") == entry
+    assert upload_index.find_by_hash(entry.sha256, "folder_1") == entry
+    assert upload_index.find_by_hash(entry.sha256, "another_folder") is None
+    assert upload_index.find_by_message_id("msg_unknown") is None
+
+def test_reconcile_removes_missing_and_mismatched_files(upload_index):
+    """
+    Tests that reconciliation keeps entries whose md5Checksum matches Drive
+    and removes entries whose file is missing or has different content.
+    """
+    matching = make_entry("msg_ok", b"ok", file_id="file_ok")
+    changed = make_entry("msg_changed", b"changed", file_id="file_changed")
+    missing = make_entry("msg_missing", b"missing", file_id="file_missing")
+    for entry in (matching, changed, missing):
+        upload_index.record(entry)
+
+    mock_gdrive_service = MagicMock()
+    mock_gdrive_service.list_file_checksums.return_value = {
+        "file_ok": matching.md5,
+        "file_changed": "a-different-md5",
+    }
+
+    summary = upload_index.reconcile(mock_gdrive_service)
+
+    assert summary == {"checked": 3, "removed": 2}
+    mock_gdrive_service.list_file_checksums.assert_called_once_with("folder_1")
+    assert upload_index.find_by_message_id("msg_ok") is not None
+    assert upload_index.find_by_message_id("msg_changed") is None
+    assert upload_index.find_by_message_id("msg_missing") is None
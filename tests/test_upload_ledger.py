@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pytest
+
+from src.upload_ledger import UploadLedger
+
+
+def at(day, hour=9):
+    return datetime(2025, 8, day, hour).timestamp()
+
+
+@pytest.fixture
+def ledger():
+    ledger = UploadLedger(":memory:")
+    yield ledger
+    ledger.close()
+
+
+def test_rollups_aggregate_per_group_day_and_kind(ledger):
+    """Counts, bytes and average latency are rolled up as items are recorded."""
+    ledger.record("m1", "U1", "Site B", "photo", 1000, "f1", 2000, recorded_at=at(30))
+    ledger.record("m2", "U2", "Site B", "photo", 3000, "f2", 4000, recorded_at=at(30))
+    ledger.record("m3", "U1", "Site B", "note", 20, None, 100, recorded_at=at(30))
+    ledger.record("m4", "U1", "Site A", "photo", 500, "f4", 1000, recorded_at=at(30))
+    ledger.record("m5", "U1", "Site B", "photo", 9999, "f5", 1000, recorded_at=at(29))
+
+    stats = ledger.stats(entry_date="2025-08-30", group_name="Site B")
+
+    assert stats == {"date": "2025-08-30", "groups": {"Site B": {
+        "photo": {"count": 2, "bytes": 4000, "avg_latency_ms": 3000.0},
+        "note": {"count": 1, "bytes": 20, "avg_latency_ms": 100.0},
+    }}}
+    assert set(ledger.stats(entry_date="2025-08-30")["groups"]) == {"Site A", "Site B"}
+
+
+def test_redelivered_message_is_counted_once(ledger):
+    """Recording the same message twice does not inflate the rollup."""
+    assert ledger.record("m1", "U1", "Site B", "photo", 1000, "f1", 10, recorded_at=at(30)) is True
+    assert ledger.record("m1", "U1", "Site B", "photo", 1000, "f1", 10, recorded_at=at(30)) is False
+
+    assert ledger.stats(entry_date="2025-08-30")["groups"]["Site B"]["photo"]["count"] == 1
@@ -0,0 +1,39 @@
+import pytest
+
+from src.upload_spool import UploadSpool, SpooledUpload
+
+
+def item(message_id, **overrides):
+    fields = dict(
+        message_id=message_id, user_id="U1", group_name="Site B", entry_date="2025-08-30",
+        kind="photo", file_name=None, reason="missing_in_drive",
+    )
+    fields.update(overrides)
+    return SpooledUpload(**fields)
+
+
+@pytest.fixture
+def spool():
+    spool = UploadSpool(":memory:", max_attempts=2)
+    yield spool
+    spool.close()
+
+
+def test_enqueue_ignores_items_already_queued(spool):
+    assert spool.enqueue(item("m1")) is True
+    assert spool.enqueue(item("m1")) is False
+
+    assert [queued.message_id for queued in spool.due()] == ["m1"]
+    assert spool.contains("m1")
+
+
+def test_failed_items_back_off_and_give_up(spool):
+    """A failed item is not due again until its backoff passes, and stops after max_attempts."""
+    spool.enqueue(item("m1"))
+
+    spool.mark_failed("m1", retry_after_seconds=0)
+    assert [queued.attempts for queued in spool.due()] == [1]
+    spool.mark_failed("m1", retry_after_seconds=3600)
+    assert spool.due() == []
+    assert spool.stats() == {"queued": 1, "exhausted": 1}
+    assert [exhausted.message_id for exhausted in spool.exhausted()] == ["m1"]
@@ -0,0 +1,63 @@
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+from linebot.v3.webhook import WebhookParser, UnknownEvent
+from linebot.v3.webhooks import TextMessageContent
+
+from src import webhook_payload
+from src.webhook_payload import SignatureVerifier, parse_events, OFF_LOOP_VERIFY_BYTES
+from tests.test_helpers import create_mock_event
+
+SECRET = "channel-secret"
+
+
+def sign(body: bytes) -> str:
+    return base64.b64encode(hmac.new(SECRET.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def webhook_body(*events) -> bytes:
+    return json.dumps({"destination": "Ubot", "events": list(events)}, ensure_ascii=False).encode("utf-8")
+
+
+def text_event(message_id, text):
+    return json.loads(create_mock_event("U1", TextMessageContent(id=message_id, text=text, quote_token="q")).to_json())
+
+
+def test_signatures_are_checked_on_the_raw_bytes():
+    """The verifier agrees with the SDK, including for non-ASCII bodies."""
+    body = webhook_body(text_event("m1", "鉄筋搬入"))
+    verifier = SignatureVerifier(SECRET)
+
+    assert verifier.verify(body, sign(body))
+    assert not verifier.verify(body, sign(body + b" "))
+    assert WebhookParser(SECRET).signature_validator.validate(body.decode("utf-8"), sign(body))
+
+
+@pytest.mark.asyncio
+async def test_large_bodies_are_verified_off_the_loop():
+    body = webhook_body(*(text_event(f"m{i}", "x" * 500) for i in range(OFF_LOOP_VERIFY_BYTES // 500)))
+    verifier = SignatureVerifier(SECRET)
+
+    assert len(body) >= OFF_LOOP_VERIFY_BYTES
+    assert await verifier.verify_async(body, sign(body))
+    assert not await verifier.verify_async(body, "forged")
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_events_are_parsed_like_the_sdk_parser(monkeypatch, use_orjson):
+    """Known events become their models, unknown types become UnknownEvent, with or without orjson."""
+    if not use_orjson:
+        monkeypatch.setattr(webhook_payload, "orjson", None)
+    body = webhook_body(text_event("m1", "Rebar delivered"), {
+        "type": "somethingNew", "timestamp": 1, "mode": "active", "webhookEventId": "01GA",
+        "deliveryContext": {"isRedelivery": False},
+    })
+
+    events = parse_events(body)
+
+    assert events[0].message.text == "Rebar delivered"
+    assert isinstance(events[1], UnknownEvent)
+    assert [type(event) for event in events] == [type(event) for event in WebhookParser(SECRET).parse(body.decode(), sign(body))]
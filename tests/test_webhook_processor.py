@@ -1,8 +1,10 @@
+import asyncio
+
 import pytest
 from unittest.mock import patch, MagicMock
-from linebot.v3.webhooks import TextMessageContent, ImageMessageContent, ContentProvider
+from linebot.v3.webhooks import TextMessageContent, ImageMessageContent, FileMessageContent, ContentProvider, ImageSet
 
-from src.webhook_processor import process_webhook_event
+from src.webhook_processor import process_webhook_event, process_webhook_events
 from tests.test_helpers import create_mock_event
 
 @pytest.mark.asyncio
@@ -53,4 +55,115 @@ async def test_process_webhook_event_routes_to_image_handler(
 
     # Assert
     mock_text_handler.assert_not_called()
-    mock_image_handler.assert_called_once()
\ No newline at end of file
+    mock_image_handler.assert_called_once()
+
+@pytest.mark.asyncio
+@patch('src.webhook_processor.handle_file_message')
+@patch('src.webhook_processor.handle_image_message')
+@patch('src.webhook_processor.handle_text_message')
+async def test_process_webhook_event_routes_to_file_handler(
+    mock_text_handler, mock_image_handler, mock_file_handler
+):
+    """
+    Tests that a FileMessageContent event is correctly routed to the file handler.
+    """
+    # Arrange
+    file_message = FileMessageContent(id="789", file_name="plan.pdf", file_size=100)
+    event = create_mock_event("U789", file_message)
+
+    # Act
+    await process_webhook_event(
+        event, MagicMock(), MagicMock(), MagicMock(),
+        MagicMock(), "dummy_token", "dummy_parent_id"
+    )
+
+    # Assert
+    mock_text_handler.assert_not_called()
+    mock_image_handler.assert_not_called()
+    mock_file_handler.assert_called_once()
+
+@pytest.mark.asyncio
+@patch('src.webhook_processor.handle_image_message')
+@patch('src.webhook_processor.handle_text_message')
+async def test_photos_of_an_image_set_are_dispatched_concurrently(
+    mock_text_handler, mock_image_handler
+):
+    """
+    Tests that the photos of one image set in a delivery run concurrently,
+    while the events around them keep their order.
+    """
+    timeline = []
+    in_flight = {"now": 0, "peak": 0}
+
+    async def handle_text(event, *args, **kwargs):
+        timeline.append(event.message.text)
+
+    async def handle_image(event, *args, **kwargs):
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        await asyncio.sleep(0.01)
+        in_flight["now"] -= 1
+        timeline.append(event.message.id)
+
+    mock_text_handler.side_effect = handle_text
+    mock_image_handler.side_effect = handle_image
+    photos = [
+        create_mock_event("U1", ImageMessageContent(
+            id=f"img_{index}", quote_token="q", content_provider=ContentProvider(type="line"),
+            image_set=ImageSet(id="set_1", index=index, total=3)
+        ))
+        for index in range(1, 4)
+    ]
+    events = [
+        create_mock_event("U1", TextMessageContent(id="t1", text="#s1", quote_token="q")),
+        *photos,
+        create_mock_event("U1", TextMessageContent(id="t2", text="after", quote_token="q")),
+    ]
+
+    await process_webhook_events(
+        events, state_manager=MagicMock(), config_manager=MagicMock(), gdrive_service=MagicMock(),
+        line_bot_api=MagicMock(), channel_access_token="dummy_token", parent_folder_id="dummy_parent_id",
+        image_set_batcher=MagicMock(),
+    )
+
+    assert in_flight["peak"] == 3
+    assert timeline[0] == "#s1" and timeline[-1] == "after"
+    assert sorted(timeline[1:4]) == ["img_1", "img_2", "img_3"]
+
+
+def test_redis_is_connected_on_startup_rather_than_at_import(monkeypatch):
+    """Importing the module makes no connection; connect_redis() sets up the duplicate check."""
+    import fakeredis
+    from src import webhook_processor
+
+    monkeypatch.setattr(webhook_processor, "redis_client", None)
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    fake = fakeredis.FakeRedis(decode_responses=True)
+
+    with patch("redis.from_url", return_value=fake) as from_url:
+        assert webhook_processor.connect_redis() is fake
+
+    from_url.assert_called_once_with("redis://localhost:6379/0", decode_responses=True)
+    assert webhook_processor.redis_client is fake
+
+
+@pytest.mark.asyncio
+@patch('src.webhook_processor.handle_text_message')
+async def test_duplicate_event_is_logged_lazily_with_its_message_id(mock_text_handler, monkeypatch, caplog):
+    """A redelivered event is dropped, and the warning carries the message ID as a field."""
+    import fakeredis
+    from src import webhook_processor
+
+    monkeypatch.setattr(webhook_processor, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+    event = create_mock_event("U123", TextMessageContent(id="dup-1", text="hello", quote_token="q"))
+
+    with caplog.at_level("WARNING", logger="src.webhook_processor"):
+        for _ in range(2):
+            await process_webhook_event(
+                event, MagicMock(), MagicMock(), MagicMock(), MagicMock(), "dummy_token", "dummy_parent_id"
+            )
+
+    mock_text_handler.assert_called_once()
+    (record,) = caplog.records
+    assert record.msg == "⚠️ Duplicate event received. Ignoring."
+    assert record.message_id == "dup-1"
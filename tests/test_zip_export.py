@@ -0,0 +1,94 @@
+import io
+import threading
+import zipfile
+from unittest.mock import MagicMock
+
+import pytest
+
+from src.zip_export import stream_zip, list_folder_files
+
+
+class FakeDrive:
+    """Serves file contents in small chunks and records how many downloads run at once."""
+    def __init__(self, contents, fail=None):
+        self.contents = contents
+        self.fail = fail
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def list_children_page(self, folder_id, fields, folders_only=False, page_token=None, page_size=1000):
+        items = [{"id": file_id, "name": f"{file_id}.jpg", "mimeType": "image/jpeg"} for file_id in self.contents]
+        items.append({"id": "sub", "name": "sub", "mimeType": "application/vnd.google-apps.folder"})
+        index = int(page_token or 0)
+        return items[index:index + 2], (str(index + 2) if index + 2 < len(items) else None)
+
+    def iter_file_content(self, file_id, chunk_size=1024 * 1024, export_mime_type=None):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            data = self.contents[file_id]
+            for start in range(0, len(data), 7):
+                if file_id == self.fail and start:
+                    raise IOError("connection reset")
+                yield data[start:start + 7]
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+async def collect(stream):
+    return b"".join([piece async for piece in stream])
+
+
+@pytest.mark.asyncio
+async def test_archive_contains_every_file_and_is_zip64():
+    """Every file is stored under a unique name, and downloads stay within the concurrency bound."""
+    contents = {f"p{i}": bytes([i]) * (50 + i) for i in range(6)}
+    drive = FakeDrive(contents)
+    files = await list_folder_files(drive, "day")
+    files.append({"id": "p0", "name": "p0.jpg"})
+
+    data = await collect(stream_zip(drive, files, max_concurrent=2, queue_chunks=1))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == ["p0.jpg", "p1.jpg", "p2.jpg", "p3.jpg", "p4.jpg", "p5.jpg", "p0 (2).jpg"]
+        assert archive.read("p3.jpg") == contents["p3"]
+        assert archive.read("p0 (2).jpg") == contents["p0"]
+        assert archive.testzip() is None
+    # Each entry's local header carries the ZIP64 extra field (header ID 0x0001).
+    assert data.count(b"\x01\x00\x10\x00") >= len(files)
+    assert drive.max_active <= 2
+
+
+@pytest.mark.asyncio
+async def test_failed_download_cuts_the_archive_short():
+    """A download error ends the stream with the error instead of finishing a corrupt archive."""
+    drive = FakeDrive({"p0": b"a" * 20, "p1": b"b" * 20}, fail="p1")
+    files = await list_folder_files(drive, "day")
+
+    with pytest.raises(IOError):
+        await collect(stream_zip(drive, files))
+
+
+@pytest.mark.asyncio
+async def test_google_docs_are_exported_and_other_native_files_skipped():
+    """Daily notes kept as Google Docs are exported as text; folders and other native files are left out."""
+    drive = MagicMock()
+    drive.list_children_page.return_value = ([
+        {"id": "d1", "name": "2025-08-30_notes", "mimeType": "application/vnd.google-apps.document"},
+        {"id": "s1", "name": "sheet", "mimeType": "application/vnd.google-apps.spreadsheet"},
+        {"id": "p1", "name": "a.jpg", "mimeType": "image/jpeg"},
+    ], None)
+    drive.iter_file_content.side_effect = lambda file_id, chunk_size, export_mime_type=None: iter(
+        [f"{file_id}:{export_mime_type}".encode()]
+    )
+
+    files = await list_folder_files(drive, "day")
+    data = await collect(stream_zip(drive, files))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == ["2025-08-30_notes.txt", "a.jpg"]
+        assert archive.read("2025-08-30_notes.txt") == b"d1:text/plain"
+        assert archive.read("a.jpg") == b"p1:None"
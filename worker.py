@@ -0,0 +1,58 @@
+"""
+Runs an upload worker for EVENT_STREAM mode.
+
+The web process (`uvicorn main:app`) only verifies webhook deliveries and
+appends them to a Redis Stream. Each worker started with
+
+    python worker.py
+
+joins the stream's consumer group and handles the events with the same
+services as the web process. Run as many workers as uploads require.
+
+A worker only consumes the stream. The background jobs that must run once
+(the note export and the spool drain) stay in the web process. The upload
+ledger, index, spool and note journal are SQLite files on local disk, so
+the workers must run on the same host as the web process and share its
+`data/` directory.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+
+from main import app, webhook_services, start_services, stop_services
+from src.event_stream import StreamWorker
+from src.webhook_processor import process_webhook_events
+
+
+async def run_worker() -> None:
+    if not app.event_stream:
+        raise RuntimeError("worker.py requires EVENT_STREAM=true and REDIS_URL.")
+
+    async def handle(events) -> None:
+        await process_webhook_events(events, **webhook_services())
+
+    worker = StreamWorker(
+        app.event_stream,
+        os.getenv('STREAM_CONSUMER_NAME') or f"{socket.gethostname()}-{os.getpid()}",
+        handle,
+        batch_size=int(os.getenv('STREAM_BATCH_SIZE', '10')),
+        claim_idle_ms=int(float(os.getenv('STREAM_CLAIM_IDLE_SECONDS', '120')) * 1000),
+        max_deliveries=int(os.getenv('STREAM_MAX_DELIVERIES', '5')),
+    )
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+
+    # Not the app's lifespan: that also starts the note exporter and spool drainer, which the web process runs.
+    await start_services()
+    try:
+        await worker.run()
+    finally:
+        await stop_services()
+    logging.info("Worker %s stopped: %s", worker.consumer_name, worker.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())